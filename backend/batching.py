@@ -0,0 +1,113 @@
+import queue
+import threading
+import time
+
+from concurrent.futures import Future
+
+_STOP = object()
+
+
+class MicroBatcher:
+    """
+    Collects concurrent inference requests into batches.
+
+    The first request of a batch waits at most max_wait_ms for other
+      requests to arrive. The batch is run with a single batch_fn call when
+      the window closes or max_batch_size requests have been collected, and
+      every caller gets back its own result.
+    """
+
+    def __init__(self, batch_fn, max_batch_size: int = 16, max_wait_ms: float = 5, name: str = "micro-batcher"):
+        """
+        Args:
+            batch_fn (function): Function which takes a list of inputs and
+              returns a list of outputs in the same order.
+            max_batch_size (int): Maximum amount of inputs in one batch.
+            max_wait_ms (float): Maximum time the first request waits for others.
+            name (str): Name of the worker thread.
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.batches_run = 0
+        self.inputs_run = 0
+        self._queue = queue.Queue()
+        self._closed = False
+        # Checking _closed and queueing under one lock keeps requests from
+        #   being queued after the stop marker, where nothing would run them.
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, input):
+        """
+        Submits input to the next batch and waits for its result.
+
+        Args:
+            input: Single input for batch_fn.
+
+        Returns:
+            Output of batch_fn for this input.
+        """
+        future = Future()
+
+        with self._lock:
+            if self._closed:
+                raise Exception("Batcher is closed")
+            self._queue.put((input, future))
+
+        return future.result()
+
+    def close(self):
+        """
+        Stops the worker thread after the requests queued before close.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+
+    def _run(self):
+        stopping = False
+
+        while not stopping:
+            request = self._queue.get()
+            if request is _STOP:
+                break
+
+            batch = [request]
+            deadline = time.monotonic() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+                if request is _STOP:
+                    stopping = True
+                    break
+                batch.append(request)
+
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        inputs = [input for input, _ in batch]
+
+        try:
+            outputs = self.batch_fn(inputs)
+        except Exception as err:
+            for _, future in batch:
+                future.set_exception(err)
+            return
+
+        self.batches_run += 1
+        self.inputs_run += len(inputs)
+
+        for (_, future), output in zip(batch, outputs):
+            future.set_result(output)
@@ -0,0 +1,270 @@
+import cv2
+
+import numpy as np
+
+from backend.visualisation_utils import KEYPOINT_DICT
+
+# Keypoints with lower score are not used for determining the crop region.
+MIN_CROP_KEYPOINT_SCORE = 0.2
+# Smaller crop regions, for example when all keypoints are on the same
+#   point, are replaced with the default crop region.
+MIN_CROP_LENGTH_PX = 8
+
+_TORSO_JOINTS = [KEYPOINT_DICT[joint] for joint in
+                 ['left_shoulder', 'right_shoulder', 'left_hip', 'right_hip']]
+
+
+def init_crop_region(image_height, image_width):
+    """
+    Function by TensorFlow team.
+
+    Defines the default crop region. The crop region is a square around the
+      whole image, padded on the shorter side, so it covers the same pixels
+      as the letterboxed input of a single image.
+
+    Args:
+        image_height (int): Height of the image in pixels.
+        image_width (int): Width of the image in pixels.
+
+    Returns:
+        crop_region (dict): 'y_min', 'x_min', 'y_max', 'x_max', 'height' and
+          'width' of the region in coordinates normalized to the image.
+    """
+    if image_width > image_height:
+        box_height = image_width / image_height
+        box_width = 1.0
+        y_min = (image_height / 2 - image_width / 2) / image_height
+        x_min = 0.0
+    else:
+        box_height = 1.0
+        box_width = image_height / image_width
+        y_min = 0.0
+        x_min = (image_width / 2 - image_height / 2) / image_width
+
+    return {
+        'y_min': y_min,
+        'x_min': x_min,
+        'y_max': y_min + box_height,
+        'x_max': x_min + box_width,
+        'height': box_height,
+        'width': box_width
+    }
+
+
+def torso_visible(keypoints_with_scores):
+    """
+    Function by TensorFlow team.
+
+    Checks whether there are enough torso keypoints. At least one shoulder
+      and one hip need to be confidently found.
+    """
+    scores = keypoints_with_scores[0, 0, :, 2]
+
+    return bool((scores[KEYPOINT_DICT['left_hip']] > MIN_CROP_KEYPOINT_SCORE or
+                 scores[KEYPOINT_DICT['right_hip']] > MIN_CROP_KEYPOINT_SCORE) and
+                (scores[KEYPOINT_DICT['left_shoulder']] > MIN_CROP_KEYPOINT_SCORE or
+                 scores[KEYPOINT_DICT['right_shoulder']] > MIN_CROP_KEYPOINT_SCORE))
+
+
+def determine_torso_and_body_range(keypoints_with_scores, target_keypoints, center_y, center_x):
+    """
+    Function by TensorFlow team. Modifications by me.
+
+    Calculates the maximum distance from the center to the torso joints and
+      to all confidently found joints.
+
+    Args:
+        keypoints_with_scores (numpy array): Keypoints [1, 1, 17, 3].
+        target_keypoints (numpy array): Keypoint coordinates in pixels [17, 2].
+        center_y (float): Center of the body in pixels.
+        center_x (float): Center of the body in pixels.
+
+    Returns:
+        max_torso_yrange, max_torso_xrange, max_body_yrange, max_body_xrange (float)
+    """
+    distances = np.abs(target_keypoints - [center_y, center_x])
+    torso_distances = distances[_TORSO_JOINTS]
+
+    confident = keypoints_with_scores[0, 0, :, 2] >= MIN_CROP_KEYPOINT_SCORE
+    body_distances = distances[confident] if confident.any() \
+        else np.zeros((1, 2))
+
+    max_torso_yrange, max_torso_xrange = torso_distances.max(axis=0)
+    max_body_yrange, max_body_xrange = body_distances.max(axis=0)
+
+    return max_torso_yrange, max_torso_xrange, max_body_yrange, max_body_xrange
+
+
+def determine_crop_region(keypoints_with_scores, image_height, image_width):
+    """
+    Function by TensorFlow team. Modifications by me.
+
+    Determines the region to crop the next frame from, based on the
+      keypoints of the previous frame. The region is a square centered on the
+      hips, large enough for the torso and all confidently found joints. The
+      default crop region is used when the torso is not visible or the
+      region would be smaller than MIN_CROP_LENGTH_PX.
+
+    Args:
+        keypoints_with_scores (numpy array): Keypoints [1, 1, 17, 3] in
+          coordinates normalized to the image.
+        image_height (int): Height of the image in pixels.
+        image_width (int): Width of the image in pixels.
+
+    Returns:
+        crop_region (dict): See init_crop_region.
+    """
+    if not torso_visible(keypoints_with_scores):
+        return init_crop_region(image_height, image_width)
+
+    target_keypoints = keypoints_with_scores[0, 0, :, :2] * \
+        [image_height, image_width]
+
+    center_y, center_x = target_keypoints[
+        [KEYPOINT_DICT['left_hip'], KEYPOINT_DICT['right_hip']]].mean(axis=0)
+
+    (max_torso_yrange, max_torso_xrange,
+     max_body_yrange, max_body_xrange) = determine_torso_and_body_range(
+        keypoints_with_scores, target_keypoints, center_y, center_x)
+
+    crop_length_half = max(max_torso_xrange * 1.9, max_torso_yrange * 1.9,
+                           max_body_yrange * 1.2, max_body_xrange * 1.2)
+    crop_length_half = min(crop_length_half, max(
+        center_x, image_width - center_x, center_y, image_height - center_y))
+
+    if crop_length_half > max(image_width, image_height) / 2 or \
+            crop_length_half * 2 < MIN_CROP_LENGTH_PX:
+        return init_crop_region(image_height, image_width)
+
+    crop_length = crop_length_half * 2
+    y_min = (center_y - crop_length_half) / image_height
+    x_min = (center_x - crop_length_half) / image_width
+
+    return {
+        'y_min': float(y_min),
+        'x_min': float(x_min),
+        'y_max': float(y_min + crop_length / image_height),
+        'x_max': float(x_min + crop_length / image_width),
+        'height': float(crop_length / image_height),
+        'width': float(crop_length / image_width)
+    }
+
+
+def to_image_coordinates(keypoints_with_scores, crop_region):
+    """
+    Converts keypoints estimated from a crop region to coordinates
+      normalized to the whole image.
+
+    Args:
+        keypoints_with_scores (numpy array): Keypoints [1, N, 17, 3] relative
+          to the crop region.
+        crop_region (dict): See init_crop_region.
+
+    Returns:
+        keypoints_with_scores (numpy array): New float32 array of the keypoints.
+    """
+    keypoints_with_scores = np.array(keypoints_with_scores, dtype=np.float32)
+
+    keypoints_with_scores[..., 0] = crop_region['y_min'] + \
+        crop_region['height'] * keypoints_with_scores[..., 0]
+    keypoints_with_scores[..., 1] = crop_region['x_min'] + \
+        crop_region['width'] * keypoints_with_scores[..., 1]
+
+    return keypoints_with_scores
+
+
+def crop_and_resize(image, crop_region, crop_size):
+    """
+    Crops and resizes the image to model input. Parts of the crop region
+      outside the image are black, like the padding of a letterboxed image.
+      Only the pixels inside the crop region are resized.
+
+    Args:
+        image (numpy array): uint8 RGB image [height, width, 3].
+        crop_region (dict): See init_crop_region.
+        crop_size (int): Input size of the model.
+
+    Returns:
+        input_image (numpy array): uint8 array [1, crop_size, crop_size, 3].
+    """
+    height, width = image.shape[:2]
+
+    y_min, y_max = crop_region['y_min'] * height, crop_region['y_max'] * height
+    x_min, x_max = crop_region['x_min'] * width, crop_region['x_max'] * width
+    scale_y = crop_size / (y_max - y_min)
+    scale_x = crop_size / (x_max - x_min)
+
+    # Part of the crop region which is inside the image.
+    top, bottom = max(round(y_min), 0), min(round(y_max), height)
+    left, right = max(round(x_min), 0), min(round(x_max), width)
+
+    input_image = np.zeros((1, crop_size, crop_size, 3), dtype=np.uint8)
+
+    out_top = round((top - y_min) * scale_y)
+    out_bottom = min(round((bottom - y_min) * scale_y), crop_size)
+    out_left = round((left - x_min) * scale_x)
+    out_right = min(round((right - x_min) * scale_x), crop_size)
+
+    if out_bottom > out_top and out_right > out_left:
+        interpolation = cv2.INTER_AREA if min(scale_y, scale_x) < 1 \
+            else cv2.INTER_LINEAR
+        input_image[0, out_top:out_bottom, out_left:out_right] = cv2.resize(
+            image[top:bottom, left:right],
+            (out_right - out_left, out_bottom - out_top),
+            interpolation=interpolation)
+
+    return input_image
+
+
+class CropRegionTracker:
+    """
+    Sequence mode keypoint detector for MoveNet.
+
+    Every frame is cropped to the region around the person found in the
+      previous frame, so the person fills the model input instead of a few
+      pixels of a letterboxed full frame. The first frame, and frames after
+      the torso is lost, use the default crop region of the whole frame.
+    """
+
+    def __init__(self, keypoint_detector, input_size: int):
+        """
+        Args:
+            keypoint_detector (function): MoveNet keypoint detector, see
+              select_movenet_model.
+            input_size (int): Input size of the model.
+        """
+        self.keypoint_detector = keypoint_detector
+        self.input_size = input_size
+        self.crop_region = None
+        self._image_size = None
+
+    def reset(self):
+        self.crop_region = None
+
+    def __call__(self, image):
+        """
+        Estimates pose of the next frame.
+
+        Args:
+            image (numpy array): uint8 RGB image [height, width, 3].
+
+        Returns:
+            keypoints_with_scores [1, 1, 17, 3] (float numpy array): Keypoints
+              in coordinates normalized to the image.
+            crop_region (dict): Region the keypoints were estimated from.
+        """
+        height, width = image.shape[:2]
+        if self.crop_region is None or self._image_size != (height, width):
+            self.crop_region = init_crop_region(height, width)
+            self._image_size = (height, width)
+
+        crop_region = self.crop_region
+        input_image = crop_and_resize(image, crop_region, self.input_size)
+
+        keypoints_with_scores = to_image_coordinates(
+            self.keypoint_detector(input_image), crop_region)
+
+        self.crop_region = determine_crop_region(
+            keypoints_with_scores, height, width)
+
+        return keypoints_with_scores, crop_region
@@ -1,24 +1,61 @@
 import os
 
+import numpy as np
+
 from bson.objectid import ObjectId
 from bson.errors import InvalidId
+from pymongo import ReturnDocument, InsertOne, UpdateOne, DeleteOne
+from pymongo.errors import BulkWriteError, OperationFailure
 
 import backend.database
+from backend.keypoint_codec import encode_keypoints, decode_keypoints, is_encoded
+from backend.stats import stats_pipeline, read_stats, count_prediction_dates, COUNTED_ITEMS_FILTER
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
 
+# Indexes of the predictions collection. Creation time is read from '_id',
+#   which is indexed by MongoDB, so filters on other fields are combined
+#   with '_id' for keyset pagination in creation order.
+PREDICTION_INDEXES = [
+    [("model_name", 1), ("_id", 1)],
+    [("filename", 1), ("_id", 1)],
+    [("content_hash", 1), ("model_name", 1), ("model_version", 1)],
+    [("mean_score", 1), ("_id", 1)]
+]
+
+# Frames of a video are listed in frame order, which is their '_id' order.
+VIDEO_FRAME_INDEXES = [
+    [("video_id", 1), ("_id", 1)]
+]
+
 
 class DBConnection:
-    def __init__(self, collection):
+    def __init__(self, collection, stats_counters=None, keypoint_storage=None, indexes=None):
+        """
+        Args:
+            collection (str): Name of the collection.
+            stats_counters (StatsCounters): Optional counters updated with every change.
+            keypoint_storage (str): Storage format of 'keypoints_with_scores',
+              see keypoint_codec. Keypoints are stored as given if None.
+            indexes (list): Indexes created by ensure_indexes. PREDICTION_INDEXES if None.
+        """
         self.collection = collection
+        self.stats_counters = stats_counters
+        self.keypoint_storage = keypoint_storage
+        self.indexes = PREDICTION_INDEXES if indexes is None else indexes
 
     def insert_item(self, item):
         print(f"Saving item to database")
 
-        backend.database.mongo.db[self.collection].insert_one(item)
+        document = self._to_document(item)
+        backend.database.mongo.db[self.collection].insert_one(document)
 
-        if item.get("_id"):
-            item["_id"] = str(item["_id"])
+        if document.get("_id"):
+            if self.stats_counters:
+                self.stats_counters.add([document])
+            item["_id"] = str(document["_id"])
+            if "mean_score" in document:
+                item["mean_score"] = document["mean_score"]
             db_status = "saved"
             print(f"- Saved: ({item['_id']})")
 
@@ -27,6 +64,36 @@ class DBConnection:
 
         return item, db_status
 
+    def insert_items(self, items):
+        """
+        Saves many items with one unordered bulk write.
+
+        Args:
+            items (list): Items to save. The items get their '_id' field set.
+
+        Returns:
+            items (list): Saved items with '_id' converted to string.
+            db_status (str): 'saved' or 'no_items'.
+        """
+        print(f"Saving {len(items)} items to database")
+
+        if not items:
+            return items, "no_items"
+
+        documents = [self._to_document(item) for item in items]
+        backend.database.mongo.db[self.collection].insert_many(
+            documents, ordered=False)
+        if self.stats_counters:
+            self.stats_counters.add(documents)
+
+        for item, document in zip(items, documents):
+            item["_id"] = str(document["_id"])
+            if "mean_score" in document:
+                item["mean_score"] = document["mean_score"]
+        print(f"- Saved {len(items)} items")
+
+        return items, "saved"
+
     def get_all_items(self):
         print("Fetching all items from database")
 
@@ -35,8 +102,8 @@ class DBConnection:
             items = list(cursor)
 
             if items:
-                for i, item in enumerate(items):
-                    items[i]["_id"] = str(item["_id"])
+                for item in items:
+                    self._from_document(item)
                 db_status = "found"
 
                 print(f"- Fetched {len(items)} documents")
@@ -49,6 +116,166 @@ class DBConnection:
 
         return items, db_status
 
+    def ensure_indexes(self):
+        """
+        Creates the indexes of the collection and its stats counters. Existing
+          indexes are left as they are.
+        """
+        print(f"Ensuring indexes of '{self.collection}'")
+
+        collection = backend.database.mongo.db[self.collection]
+        for keys in self.indexes:
+            collection.create_index(keys)
+
+        if self.stats_counters:
+            self.stats_counters.ensure_indexes()
+
+        print("- Done")
+
+    def get_items(self, limit, after=None, fields=None, filter=None):
+        """
+        Fetches one page of items in '_id' order, which is also the order of
+          creation. Pages are selected by the last '_id' of the previous page,
+          so each page is an index range scan no matter how deep it is.
+
+        Args:
+            limit (int): Maximum amount of items in the page.
+            after (str): '_id' of the last item of the previous page.
+            fields (list): Fields to return in addition to '_id'. All fields if None.
+            filter (dict): Optional filter for the items.
+
+        Returns:
+            items (list): Items of the page.
+            next_after (str): Value of 'after' for the next page, None if this is the last page.
+            db_status (str): 'found', 'not_found', 'invalid_id' or 'error'.
+        """
+        print(f"Fetching {limit} items after ({after}) from database")
+        items = []
+        next_after = None
+
+        try:
+            cursor = self._items_cursor(limit, after, fields, filter)
+
+            for item in cursor:
+                if len(items) == limit:
+                    next_after = items[-1]["_id"]
+                    break
+                items.append(self._from_document(item))
+
+            db_status = "found" if items else "not_found"
+            print(f"- Fetched {len(items)} documents")
+
+        except InvalidId as err:
+            db_status = "invalid_id"
+
+        except Exception as err:
+            print(f"- Error occurred: '{err}'")
+            db_status = "error"
+
+        return items, next_after, db_status
+
+    def explain_items(self, limit, after=None, fields=None, filter=None):
+        """
+        Explains the query of get_items instead of running it.
+
+        Returns:
+            explain (dict): Summary of the query plan, see summarize_explain.
+        """
+        print(f"Explaining items query {filter}")
+
+        return summarize_explain(
+            self._items_cursor(limit, after, fields, filter).explain())
+
+    def _items_cursor(self, limit, after, fields, filter):
+        filter = dict(filter or {})
+        if after:
+            filter["_id"] = {**filter.get("_id", {}),
+                             "$gt": ObjectId(after)}
+        projection = {field: 1 for field in fields} if fields else None
+
+        # One extra item tells if there is a next page.
+        return backend.database.mongo.db[self.collection].find(
+            filter, projection).sort("_id", 1).limit(limit + 1)
+
+    def get_counted_stats(self, top=None):
+        """
+        Reads stats from the stats counters. Counters are rebuilt first if
+          they have never been counted from the predictions, for example for
+          predictions saved before the counters existed.
+
+        Args:
+            top (int): Return only this many most common models and filenames.
+
+        Returns:
+            stats (tuple): total_results, model_amounts, image_amounts, prediction_dates.
+            db_status (str): 'found' or 'not_found'.
+        """
+        if not self.stats_counters:
+            return self.get_stats({}, top)
+
+        print("Reading stats counters from database")
+        if not self.stats_counters.is_built():
+            self.rebuild_stats_counters()
+
+        stats = self.stats_counters.read(top)
+        db_status = "found" if stats[0] else "not_found"
+
+        return stats, db_status
+
+    def rebuild_stats_counters(self):
+        """
+        Recounts the stats counters from the collection.
+        """
+        stats, _ = self.get_stats({})
+        self.stats_counters.rebuild(stats)
+
+    def check_stats_counters(self):
+        """
+        Compares the stats counters to counts from the collection.
+
+        Returns:
+            differences (dict): (kind, key): (counter, expected) for every
+              count which differs.
+        """
+        stats, _ = self.get_stats({})
+        return self.stats_counters.check(stats)
+
+    def get_stats(self, filter, top=None):
+        """
+        Counts items by model, filename and creation date with an aggregation
+          pipeline, so that only the counts are read from the database.
+
+        Args:
+            filter (dict): Filter for the counted items.
+            top (int): Return only this many most common models and filenames.
+
+        Returns:
+            stats (tuple): total_results, model_amounts, image_amounts, prediction_dates.
+            db_status (str): 'found' or 'not_found'.
+        """
+        print("Aggregating stats from database")
+        collection = backend.database.mongo.db[self.collection]
+
+        try:
+            facets = next(collection.aggregate(
+                stats_pipeline(filter, top)))
+            stats = read_stats(facets)
+
+        except OperationFailure as err:
+            # $toDate needs MongoDB 4.0. Only the ids are read for the dates.
+            print(f"- Counting dates from ids: '{err}'")
+            facets = next(collection.aggregate(
+                stats_pipeline(filter, top, with_dates=False)))
+            cursor = collection.find(
+                {**filter, **COUNTED_ITEMS_FILTER}, {"_id": 1})
+            stats = read_stats(facets)[:3] + \
+                (count_prediction_dates(item["_id"] for item in cursor),)
+
+        db_status = "found" if stats[0] else "not_found"
+        print(f"- Aggregated {stats[0]} documents")
+
+        return stats, db_status
+
     def find_item_by_id(self, db_id):
         print(f"Fetching item by id ({db_id})")
         item = {}
@@ -59,7 +286,7 @@ class DBConnection:
             )
             if item:
                 print(f"- Fetched item")
-                item["_id"] = str(item["_id"])
+                self._from_document(item)
                 db_status = "found"
             else:
                 db_status = "not_found"
@@ -73,23 +300,55 @@ class DBConnection:
 
         return item, db_status
 
+    def find_prediction(self, content_hash, model_name, model_version):
+        """
+        Finds stored prediction of the same image content with the same model.
+
+        Returns:
+            prediction (tuple): Stored keypoints_with_scores (numpy array) and
+              boxes (numpy array, None for single pose models). None if not found.
+        """
+        item = backend.database.mongo.db[self.collection].find_one(
+            {
+                "content_hash": content_hash,
+                "model_name": model_name,
+                "model_version": model_version,
+                "edited": {"$ne": True}
+            },
+            {"keypoints_with_scores": 1, "boxes": 1}
+        )
+
+        if not item:
+            return None
+
+        boxes = np.asarray(item["boxes"]) if item.get("boxes") is not None else None
+
+        return decode_keypoints(item["keypoints_with_scores"]), boxes
+
     def update_item(self, db_id, update):
         print(f"Updating item by id ({db_id}). Update {update}")
         item = {}
 
-        filter = {'_id': ObjectId(db_id)}
-        new_values = {'$set': update}
-
         try:
-            item = backend.database.mongo.db[self.collection].find_one_and_update(
+            filter = {'_id': ObjectId(db_id)}
+            new_values = {'$set': self._to_document(update)}
+
+            # The counters are changed from the document replaced by this
+            #   update, so concurrent updates do not apply the same change twice.
+            before = backend.database.mongo.db[self.collection].find_one_and_update(
                 filter,
                 new_values,
                 upsert=False,
-                return_document="after"
+                return_document=ReturnDocument.BEFORE
             )
 
-            if item:
-                item["_id"] = str(item["_id"])
+            if before:
+                item = {**before, **new_values['$set']}
+                if self.stats_counters and \
+                        ("filename" in update or "model_name" in update):
+                    self.stats_counters.remove([before])
+                    self.stats_counters.add([item])
+                self._from_document(item)
                 print(f"- Updated item {item['_id']}")
                 db_status = "updated"
 
@@ -116,7 +375,9 @@ class DBConnection:
 
             if item:
                 db_status = "deleted"
-                item["_id"] = str(item["_id"])
+                if self.stats_counters:
+                    self.stats_counters.remove([item])
+                self._from_document(item)
                 print(f"- Deleted item: {item}")
             else:
                 db_status = "not_found"
@@ -129,3 +390,265 @@ class DBConnection:
             print(f"- Error deleting: '{err}'")
 
         return item, db_status
+
+    def bulk_items(self, operations):
+        """
+        Runs many insert, update and delete operations with one unordered
+          bulk write. Items to update and delete are read first with one
+          query, which tells which of them exist. An item can be changed by
+          only one operation of the batch, later operations with the same id
+          fail with 'duplicate_id'.
+
+        Args:
+            operations (list): Operations as dicts. {"op": "insert", "item": item},
+              {"op": "update", "id": id, "update": values} or {"op": "delete", "id": id}.
+
+        Returns:
+            results (list): Result of every operation in the same order, with
+              'op', 'id' and 'status'. Status is 'inserted', 'updated', 'deleted',
+              'not_found', 'invalid_id', 'duplicate_id', 'invalid_operation'
+              or 'error'.
+            deleted_items (list): Deleted items with '_id', 'filename' and 'model_name'.
+        """
+        print(f"Running {len(operations)} bulk operations")
+        collection = backend.database.mongo.db[self.collection]
+
+        results = []
+        object_ids = []
+        for operation in operations:
+            result, object_id = _check_bulk_operation(operation)
+            results.append(result)
+            object_ids.append(object_id)
+
+        # Results and counter changes are per operation, so a second
+        #   operation on the same item would count its change twice.
+        seen_ids = set()
+        for result, object_id in zip(results, object_ids):
+            if object_id is None:
+                continue
+            if object_id in seen_ids:
+                result["status"] = "duplicate_id"
+            seen_ids.add(object_id)
+
+        existing = {item["_id"]: item for item in collection.find(
+            {"_id": {"$in": [object_id for object_id in object_ids if object_id]}},
+            {"filename": 1, "model_name": 1})}
+
+        requests = []
+        request_indexes = []
+        documents = {}
+        for i, (operation, result) in enumerate(zip(operations, results)):
+            if result["status"]:
+                continue
+
+            if result["op"] == "insert":
+                documents[i] = self._to_document(operation["item"])
+                requests.append(InsertOne(documents[i]))
+            elif object_ids[i] not in existing:
+                result["status"] = "not_found"
+                continue
+            elif result["op"] == "update":
+                requests.append(UpdateOne(
+                    {"_id": object_ids[i]},
+                    {"$set": self._to_document(operation["update"])}))
+            else:
+                requests.append(DeleteOne({"_id": object_ids[i]}))
+            request_indexes.append(i)
+
+        failed = set()
+        if requests:
+            try:
+                collection.bulk_write(requests, ordered=False)
+            except BulkWriteError as err:
+                failed = {request_indexes[error["index"]]
+                          for error in err.details["writeErrors"]}
+
+        added = []
+        removed = []
+        deleted_items = []
+        for i in request_indexes:
+            result = results[i]
+
+            if i in failed:
+                result["status"] = "error"
+
+            elif result["op"] == "insert":
+                result["id"] = str(documents[i]["_id"])
+                result["status"] = "inserted"
+                added.append(documents[i])
+
+            elif result["op"] == "update":
+                result["status"] = "updated"
+                before = existing[object_ids[i]]
+                changed = {key: value for key, value in operations[i]["update"].items()
+                           if key in ("filename", "model_name")}
+                if changed:
+                    removed.append(before)
+                    added.append({**before, **changed})
+
+            else:
+                result["status"] = "deleted"
+                before = existing[object_ids[i]]
+                removed.append(before)
+                deleted_items.append({**before, "_id": result["id"]})
+
+        if self.stats_counters:
+            self.stats_counters.remove(removed)
+            self.stats_counters.add(added)
+
+        print(f"- Done, {len(failed)} failed")
+
+        return results, deleted_items
+
+    def migrate_keypoints(self, storage_format, batch_size=1000):
+        """
+        Converts stored keypoints of all items to the storage format.
+
+        Args:
+            storage_format (str): Storage format, see keypoint_codec.
+            batch_size (int): Amount of items read at a time.
+
+        Returns:
+            migrated (int): Amount of converted items.
+        """
+        print(f"Migrating keypoints to '{storage_format}'")
+        collection = backend.database.mongo.db[self.collection]
+        migrated = 0
+
+        cursor = collection.find(
+            {"keypoints_with_scores": {"$exists": True}},
+            {"keypoints_with_scores": 1}).batch_size(batch_size)
+
+        for item in cursor:
+            keypoints_with_scores = item["keypoints_with_scores"]
+            encoded = encode_keypoints(keypoints_with_scores, storage_format)
+            if encoded == keypoints_with_scores:
+                continue
+
+            collection.update_one(
+                {"_id": item["_id"]},
+                {"$set": {"keypoints_with_scores": encoded}})
+            migrated += 1
+
+        print(f"- Migrated {migrated} items")
+
+        return migrated
+
+    def stored_keypoints(self, keypoints_with_scores):
+        """
+        Returns the keypoints as they are read back from the database, after
+          conversion to the storage format, for example float32 values of
+          float64 model output.
+        """
+        document = self._to_document({"keypoints_with_scores": keypoints_with_scores})
+        return decode_keypoints(document["keypoints_with_scores"])
+
+    def _to_document(self, item):
+        keypoints_with_scores = item.get("keypoints_with_scores")
+        if keypoints_with_scores is None:
+            return dict(item)
+
+        # Every saved item with keypoints gets its score, whichever request
+        #   saved it, so that filtering by score does not leave items out.
+        document = {**item, "mean_score": mean_score(keypoints_with_scores)}
+        if is_encoded(keypoints_with_scores):
+            return document
+
+        # Numpy arrays can not be saved as they are, so they are stored as lists by default.
+        if self.keypoint_storage:
+            keypoints_with_scores = encode_keypoints(
+                keypoints_with_scores, self.keypoint_storage)
+        elif hasattr(keypoints_with_scores, "tolist"):
+            keypoints_with_scores = keypoints_with_scores.tolist()
+        document["keypoints_with_scores"] = keypoints_with_scores
+
+        return document
+
+    def _from_document(self, item):
+        item["_id"] = str(item["_id"])
+        if is_encoded(item.get("keypoints_with_scores")):
+            item["keypoints_with_scores"] = decode_keypoints(
+                item["keypoints_with_scores"])
+
+        return item
+
+
+def mean_score(keypoints_with_scores):
+    """
+    Mean confidence of the keypoints of all people, stored for filtering the
+      items. 0 if there are no people.
+    """
+    scores = decode_keypoints(keypoints_with_scores)[..., 2]
+    return float(np.mean(scores)) if scores.size else 0.0
+
+
+def _check_bulk_operation(operation):
+    # Returns result of the operation with status set if the operation is
+    #   invalid, and ObjectId of the item to update or delete.
+    op = operation.get("op") if isinstance(operation, dict) else None
+    result = {"op": op, "id": None, "status": None}
+
+    if op == "insert":
+        if not isinstance(operation.get("item"), dict):
+            result["status"] = "invalid_operation"
+        return result, None
+
+    if op not in ("update", "delete") or \
+            (op == "update" and not isinstance(operation.get("update"), dict)):
+        result["status"] = "invalid_operation"
+        return result, None
+
+    result["id"] = operation.get("id")
+    try:
+        return result, ObjectId(result["id"])
+    except (InvalidId, TypeError):
+        result["status"] = "invalid_id"
+        return result, None
+
+
+def summarize_explain(explain):
+    """
+    Summarizes explain output of a find query.
+
+    Args:
+        explain (dict): Output of Cursor.explain().
+
+    Returns:
+        summary (dict): Stages of the winning plan, names of the used indexes,
+          whether the collection was scanned and whether the query was covered
+          by an index without reading documents, and the execution stats.
+    """
+    stages = []
+    indexes = []
+
+    def walk(plan):
+        stages.append(plan["stage"])
+        if plan.get("indexName"):
+            indexes.append(plan["indexName"])
+        if plan.get("inputStage"):
+            walk(plan["inputStage"])
+        for input_stage in plan.get("inputStages", []):
+            walk(input_stage)
+
+    winning_plan = explain["queryPlanner"]["winningPlan"]
+    # Plans of the slot based engine are under 'queryPlan'.
+    walk(winning_plan.get("queryPlan", winning_plan))
+
+    execution_stats = explain.get("executionStats", {})
+    docs_examined = execution_stats.get("totalDocsExamined")
+    collection_scan = "COLLSCAN" in stages
+
+    if docs_examined is None:
+        index_covered = not collection_scan and "FETCH" not in stages
+    else:
+        index_covered = not collection_scan and docs_examined == 0
+
+    return {
+        "stages": stages,
+        "indexes": indexes,
+        "collection_scan": collection_scan,
+        "index_covered": index_covered,
+        "keys_examined": execution_stats.get("totalKeysExamined"),
+        "docs_examined": docs_examined,
+        "returned": execution_stats.get("nReturned")
+    }
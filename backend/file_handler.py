@@ -1,51 +1,410 @@
 import os
 import json
+import mmap
+import hashlib
+import tarfile
+import tempfile
 import time
 import uuid
+import zipfile
 
+from contextlib import contextmanager
+from pymongo.errors import DuplicateKeyError
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 
+import backend.database
 from backend.config import config
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
 files_path = config.dict()["filesPath"]
 
+# Files are stored by content hash in this subfolder of files_path and
+#   filenames are mapped to them in FILES_COLLECTION.
+BLOBS_FOLDER = "blobs"
+FILES_COLLECTION = "files"
+CHUNK_SIZE = 1024 * 1024
+SUPPORTED_ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz")
+
+
+class BlobUpload:
+    """
+    Writable file for streaming an upload straight into the blob store.
+
+    Werkzeug writes the request body to it chunk by chunk while parsing the
+      form. Every chunk is hashed and written to a temporary file in the
+      same pass, so the upload is never held in memory and committing it to
+      the blob store is a rename. The size limit and the optional header
+      check are enforced while the body is still being received.
+    """
+
+    def __init__(self, max_size: int = None, header_check=None, header_size: int = 64 * 1024):
+        """
+        Args:
+            max_size (int): Maximum size of the upload in bytes. None for no limit.
+            header_check (function): Optional function which gets the first
+              bytes of the upload and returns True when it has checked them.
+              Can raise to reject the upload.
+            header_size (int): Maximum amount of bytes given to header_check.
+        """
+        self.max_size = max_size
+        self.header_check = header_check
+        self.header_size = header_size
+        self.content_hash = None
+        self.size = 0
+        self.filepath = None
+
+        blobs_path = os.path.abspath(os.path.join(files_path, BLOBS_FOLDER))
+        os.makedirs(blobs_path, exist_ok=True)
+
+        fd, self._temp_path = tempfile.mkstemp(dir=blobs_path, suffix=".tmp")
+        self._file = os.fdopen(fd, "w+b")
+        self._hash = hashlib.sha256()
+        self._header = bytearray() if header_check else None
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise RequestEntityTooLarge(
+                f"File is larger than {self.max_size} bytes")
+
+        if self._header is not None:
+            self._header += data[:self.header_size - len(self._header)]
+            if self.header_check(bytes(self._header)) or \
+                    len(self._header) >= self.header_size:
+                self._header = None
+
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def finish(self):
+        """
+        Finishes the upload without moving it to the blob store yet.
+
+        Returns:
+            content_hash (str): SHA-256 hex digest of the content.
+            size (int): Size of the content in bytes.
+        """
+        if not self.content_hash:
+            self._file.flush()
+            self.content_hash = self._hash.hexdigest()
+
+        return self.content_hash, self.size
+
+    def commit(self):
+        """
+        Moves the upload to the blob store. Can be called more than once.
+
+        Returns:
+            content_hash (str): SHA-256 hex digest of the content.
+            size (int): Size of the content in bytes.
+            filepath (str): Absolute path of the blob.
+        """
+        if self.filepath:
+            return self.content_hash, self.size, self.filepath
+
+        self.finish()
+        self.filepath = _move_to_blob_store(self._temp_path, self.content_hash)
+
+        return self.content_hash, self.size, self.filepath
+
+    def close(self):
+        self._file.close()
+
+        if not self.filepath and os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+
+    def __getattr__(self, name):
+        # read, seek, tell etc. are used by Werkzeug and archive readers.
+        return getattr(self._file, name)
+
 
 def save_file(file):
-    filename = secure_filename(file.filename)
+    """
+    Saves uploaded file to the content-addressed store. The file is hashed
+      while it is streamed to disk.
+
+    Args:
+        file (FileStorage): Uploaded file.
+
+    Returns:
+        filename (str): Name of the saved file.
+        filepath (str): Absolute path of the saved file.
+        content_hash (str): SHA-256 hex digest of the content.
+    """
+    print(f"Saving file '{file.filename}'")
+
+    if isinstance(file.stream, BlobUpload):
+        # Already hashed and written to disk while the request was received.
+        #   Mapped before it is moved to the store, see _store_claimed_blob.
+        content_hash, size = file.stream.finish()
+        filename = claim_filename(
+            secure_filename(file.filename), content_hash, size)
+        _, _, filepath = file.stream.commit()
+    else:
+        content_hash, size, temp_path = _write_temp_blob(
+            _read_chunks(file.stream))
+        filename, filepath = _store_claimed_blob(
+            file.filename, temp_path, content_hash, size)
 
-    # Find input file size
-    pos = file.tell()
-    file.seek(0, 2)
-    file_size = file.tell()
-    file.seek(pos)
+    print(f"- Saved as '{filename}'")
 
-    filename, filepath = create_filepath(filename, file_size)
+    return filename, filepath, content_hash
 
-    print(f"Saving file to '{os.path.basename(os.path.normpath(filepath))}' ")
-    file.save(filepath)
-    print("- Done")
 
-    return filename, filepath
+def save_file_bytes(filename, data):
+    """
+    Saves already read upload to the content-addressed store.
 
+    Args:
+        filename (str): Original filename of the upload.
+        data (bytes): Content of the file.
 
-def create_filepath(filename, file_size, file_index=0):
-    # Check if the input file already exists
-    filepath = os.path.abspath(os.path.join(files_path, filename))
+    Returns:
+        filename (str): Name of the saved file.
+        filepath (str): Absolute path of the saved file.
+        content_hash (str): SHA-256 hex digest of the content.
+    """
+    print(f"Saving file '{filename}'")
+
+    content_hash, size, temp_path = _write_temp_blob([data])
+    filename, filepath = _store_claimed_blob(
+        filename, temp_path, content_hash, size)
+
+    print(f"- Saved as '{filename}'")
+
+    return filename, filepath, content_hash
+
+
+@contextmanager
+def map_file(filepath):
+    """
+    Maps file to memory read-only, so that its content can be used as bytes
+      without reading it into a copy.
+
+    Yields:
+        data (bytes-like): Content of the file.
+    """
+    with open(filepath, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+
+def _write_temp_blob(chunks):
+    # Hashes the content while writing it to a temporary file in the blob store.
+    blobs_path = os.path.abspath(os.path.join(files_path, BLOBS_FOLDER))
+    os.makedirs(blobs_path, exist_ok=True)
+
+    content_hash = hashlib.sha256()
+    size = 0
 
-    if os.path.exists(filepath):
-        existing_file_size = os.path.getsize(filepath)
+    fd, temp_path = tempfile.mkstemp(dir=blobs_path, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                content_hash.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
 
-        if not existing_file_size == file_size:
-            filename, ext = os.path.splitext(filename)
-            filename = f"{filename}_{file_index+1}{ext}"
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
 
-            filename, filepath = create_filepath(
-                filename, file_size, file_index)
+    return content_hash.hexdigest(), size, temp_path
+
+
+def _store_claimed_blob(filename, temp_path, content_hash, size):
+    # The filename is mapped to the blob before the temporary file is moved
+    #   to the store. A blob which is found in the store and used instead of
+    #   the temporary file already has the mapping, so deleting other files
+    #   of the same content does not remove it, see _remove_blob.
+    try:
+        filename = claim_filename(
+            secure_filename(filename), content_hash, size)
+        filepath = _move_to_blob_store(temp_path, content_hash)
+
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
 
     return filename, filepath
 
 
+def create_temp_filepath(suffix=""):
+    """
+    Creates empty temporary file next to the blobs, for output which is
+      written by a library to a path, such as an encoded video. The file can
+      then be moved to the blob store with save_local_file without copying.
+
+    Returns:
+        temp_path (str): Absolute path of the temporary file.
+    """
+    blobs_path = os.path.abspath(os.path.join(files_path, BLOBS_FOLDER))
+    os.makedirs(blobs_path, exist_ok=True)
+
+    fd, temp_path = tempfile.mkstemp(dir=blobs_path, suffix=suffix)
+    os.close(fd)
+
+    return temp_path
+
+
+def save_local_file(filename, temp_path):
+    """
+    Moves file created with create_temp_filepath to the content-addressed
+      store.
+
+    Args:
+        filename (str): Wanted filename.
+        temp_path (str): Path of the temporary file. The file is moved or removed.
+
+    Returns:
+        filename (str): Name of the saved file.
+        filepath (str): Absolute path of the saved file.
+        content_hash (str): SHA-256 hex digest of the content.
+    """
+    print(f"Saving file '{filename}'")
+
+    try:
+        content_hash = hashlib.sha256()
+        with open(temp_path, "rb") as f:
+            for chunk in _read_chunks(f):
+                content_hash.update(chunk)
+        content_hash = content_hash.hexdigest()
+
+        size = os.path.getsize(temp_path)
+
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    filename, filepath = _store_claimed_blob(
+        filename, temp_path, content_hash, size)
+
+    print(f"- Saved as '{filename}'")
+
+    return filename, filepath, content_hash
+
+
+def _move_to_blob_store(temp_path, content_hash):
+    filepath = get_blob_path(content_hash)
+
+    if os.path.isfile(filepath):
+        os.remove(temp_path)
+    else:
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        os.replace(temp_path, filepath)
+
+    return filepath
+
+
+def ensure_file_indexes():
+    # Used for checking if a blob is still used before deleting it.
+    backend.database.mongo.db[FILES_COLLECTION].create_index("blob")
+
+
+def get_blob_path(content_hash):
+    # Two levels of subfolders keep the folder sizes small with millions of blobs.
+    return os.path.abspath(os.path.join(
+        files_path, BLOBS_FOLDER, content_hash[:2], content_hash[2:4], content_hash))
+
+
+def claim_filename(filename, content_hash, size):
+    """
+    Maps filename to blob. Same content uploaded with the same name keeps
+      the name. If the name is taken by different content, a '_<number>'
+      suffix is added to it.
+
+    Args:
+        filename (str): Wanted filename.
+        content_hash (str): SHA-256 hex digest of the content.
+        size (int): Size of the content in bytes.
+
+    Returns:
+        filename (str): Filename mapped to the blob.
+    """
+    collection = backend.database.mongo.db[FILES_COLLECTION]
+    name, ext = os.path.splitext(filename)
+    candidate = filename
+    index = 0
+
+    while True:
+        # Unique _id makes claiming a name atomic between workers.
+        if not _is_legacy_file_taken(candidate, content_hash):
+            try:
+                collection.insert_one(
+                    {"_id": candidate, "blob": content_hash, "size": size})
+                return candidate
+            except DuplicateKeyError:
+                pass
+
+        existing = collection.find_one({"_id": candidate})
+        if existing and existing["blob"] == content_hash:
+            return candidate
+
+        index += 1
+        candidate = f"{name}_{index}{ext}"
+
+
+def _is_legacy_file_taken(filename, content_hash):
+    # Files saved before the blob store are in the files folder itself.
+    legacy_filepath = os.path.abspath(os.path.join(files_path, filename))
+
+    if not os.path.isfile(legacy_filepath):
+        return False
+
+    with open(legacy_filepath, "rb") as f:
+        legacy_hash = hashlib.sha256()
+        for chunk in _read_chunks(f):
+            legacy_hash.update(chunk)
+
+    return legacy_hash.hexdigest() != content_hash
+
+
+def _read_chunks(stream, chunk_size=CHUNK_SIZE):
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def iterate_archive_files(archive_file, archive_filename):
+    """
+    Reads files from zip or tar archive one at a time.
+
+    Args:
+        archive_file (file-like): Seekable archive file.
+        archive_filename (str): Filename of the archive, used for checking the type.
+
+    Yields:
+        filename (str): Name of the file without directories.
+        data (bytes): Content of the file.
+    """
+    name = archive_filename.lower()
+
+    if name.endswith(".zip"):
+        with zipfile.ZipFile(archive_file) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    yield os.path.basename(info.filename), archive.read(info)
+
+    elif name.endswith((".tar", ".tar.gz", ".tgz")):
+        with tarfile.open(fileobj=archive_file, mode="r:*") as archive:
+            for member in archive:
+                if member.isfile():
+                    yield os.path.basename(member.name), archive.extractfile(member).read()
+
+    else:
+        raise Exception("Unsupported archive type")
+
+
 def does_file_exist(filepath):
     return os.path.exists(filepath)
 
@@ -73,23 +432,102 @@ def delete_file(filename):
         file_status = "no_filename"
 
     else:
-        filepath = os.path.abspath(os.path.join(files_path, filename))
+        mapping = backend.database.mongo.db[FILES_COLLECTION].find_one_and_delete(
+            {"_id": filename})
 
-        if not os.path.isfile(filepath):
-            file_status = "not_found"
+        if mapping:
+            _delete_unused_blob(mapping["blob"])
+            file_status = "deleted"
         else:
-            os.remove(filepath)
-            if os.path.isfile(filepath):
-                file_status = "unable_to_delete"
-            else:
-                file_status = "deleted"
+            file_status = _delete_legacy_file(filename)
 
     return file_status
 
 
-def get_filepath(filename):
+def delete_files(filenames):
+    """
+    Deletes many files with one query for their mappings, one delete and
+      one query for the blobs still used by other filenames.
+
+    Args:
+        filenames (list): Names of the files.
+
+    Returns:
+        file_statuses (dict): Status of every filename, as returned by delete_file.
+    """
+    print(f"Deleting {len(filenames)} files")
+    collection = backend.database.mongo.db[FILES_COLLECTION]
+    filenames = list({filename for filename in filenames if filename})
+
+    mappings = list(collection.find({"_id": {"$in": filenames}}))
+    collection.delete_many({"_id": {"$in": [mapping["_id"] for mapping in mappings]}})
+
+    blobs = {mapping["blob"] for mapping in mappings}
+    used_blobs = {mapping["blob"] for mapping in collection.find(
+        {"blob": {"$in": list(blobs)}}, {"blob": 1})}
+    for content_hash in blobs - used_blobs:
+        _remove_blob(content_hash)
+
+    file_statuses = {mapping["_id"]: "deleted" for mapping in mappings}
+    for filename in filenames:
+        if filename not in file_statuses:
+            file_statuses[filename] = _delete_legacy_file(filename)
+
+    print(f"- Done")
+
+    return file_statuses
+
+
+def _delete_unused_blob(content_hash):
+    # Other filenames can point to the same blob.
+    if backend.database.mongo.db[FILES_COLLECTION].find_one({"blob": content_hash}):
+        return
+
+    _remove_blob(content_hash)
+
+
+def _remove_blob(content_hash):
+    # The blob is moved aside before the last check for its mappings. An
+    #   upload which maps the same content meanwhile either finds the blob
+    #   missing and stores its own copy, or gets the blob moved back here.
+    filepath = get_blob_path(content_hash)
+    removed_path = f"{filepath}.{uuid.uuid4().hex}.removed"
+
+    try:
+        os.rename(filepath, removed_path)
+    except FileNotFoundError:
+        return
+
+    if backend.database.mongo.db[FILES_COLLECTION].find_one({"blob": content_hash}):
+        os.replace(removed_path, filepath)
+    else:
+        os.remove(removed_path)
+
+
+def _delete_legacy_file(filename):
     filepath = os.path.abspath(os.path.join(files_path, filename))
 
+    if not os.path.isfile(filepath):
+        file_status = "not_found"
+    else:
+        os.remove(filepath)
+        if os.path.isfile(filepath):
+            file_status = "unable_to_delete"
+        else:
+            file_status = "deleted"
+
+    return file_status
+
+
+def get_filepath(filename):
+    mapping = backend.database.mongo.db[FILES_COLLECTION].find_one(
+        {"_id": filename})
+
+    if mapping:
+        filepath = get_blob_path(mapping["blob"])
+    else:
+        filepath = os.path.abspath(os.path.join(files_path, filename))
+
     if not os.path.isfile(filepath):
         filepath = None
 
@@ -103,9 +541,9 @@ def open_file(filename):
         file_status = "no_filename"
 
     else:
-        filepath = os.path.abspath(os.path.join(files_path, filename))
+        filepath = get_filepath(filename)
 
-        if not os.path.isfile(filepath):
+        if not filepath:
             file_status = "not_found"
         else:
             file = open(filepath, "r")
@@ -118,7 +556,44 @@ def open_file(filename):
 
 
 def get_files():
-    files = [f for f in os.listdir(files_path) if os.path.isfile(
-        os.path.join(files_path, f))]
+    files = [mapping["_id"] for mapping in
+             backend.database.mongo.db[FILES_COLLECTION].find({}, {"_id": 1})]
+
+    # Files saved before the blob store
+    with os.scandir(files_path) as it:
+        legacy_files = [entry.name for entry in it if entry.is_file()]
+    mapped = set(files)
+    files.extend(f for f in legacy_files if f not in mapped)
 
     return files
+
+
+def migrate_legacy_files():
+    """
+    Moves files saved before the blob store from the files folder to the
+      blob store, keeping their filenames.
+    """
+    print("Migrating files to blob store")
+    collection = backend.database.mongo.db[FILES_COLLECTION]
+    migrated = 0
+
+    with os.scandir(files_path) as it:
+        legacy_files = [entry.path for entry in it if entry.is_file()]
+
+    for legacy_filepath in legacy_files:
+        filename = os.path.basename(legacy_filepath)
+        if collection.find_one({"_id": filename}):
+            continue
+
+        with open(legacy_filepath, "rb") as f:
+            content_hash, size, temp_path = _write_temp_blob(_read_chunks(f))
+
+        collection.insert_one(
+            {"_id": filename, "blob": content_hash, "size": size})
+        _move_to_blob_store(temp_path, content_hash)
+        os.remove(legacy_filepath)
+        migrated += 1
+
+    print(f"- Migrated {migrated} files")
+
+    return migrated
@@ -0,0 +1,48 @@
+# Gunicorn settings for serving the app:
+#   gunicorn -c backend/gunicorn_config.py backend.web_app:app
+#
+# One worker process with several threads by default. Prediction jobs are
+#   kept in the memory of the worker which created them, so with several
+#   workers GET /jobs/<id> and its events are found only in that worker.
+#   The threads keep the event streams from holding up the other requests.
+#
+# The app is imported and the fork-safe models are downloaded once in the
+#   master process. Workers are forked from it, so the imported libraries and
+#   the app are shared copy-on-write. No interpreters or graphs are created
+#   before the fork: every worker creates its own on its first prediction of
+#   the model. TFLite interpreters memory-map the model file, so its pages in
+#   the page cache are shared between the workers, but their tensors are not.
+#
+# With inferenceWorkers set, the master starts one inference server, to which
+#   all workers send their predictions.
+import multiprocessing
+import os
+
+# Tells web_app to load only fork-safe models before the fork.
+os.environ["FORKED_WORKERS"] = "True"
+
+bind = os.environ.get("GUNICORN_BIND", ":8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 2 * multiprocessing.cpu_count()))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+preload_app = True
+
+
+def post_fork(server, worker):
+    # Imported already in the master because of preload_app.
+    from backend.web_app import reinitialize_after_fork
+
+    reinitialize_after_fork()
+
+
+def on_starting(server):
+    from backend.web_app import start_inference_server
+
+    start_inference_server()
+
+
+def on_exit(server):
+    from backend.web_app import stop_inference_server
+
+    stop_inference_server()
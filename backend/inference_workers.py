@@ -0,0 +1,647 @@
+import itertools
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import traceback
+
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from multiprocessing.connection import Listener, Client, AuthenticationError, wait
+
+from backend.process_memory import read_process_memory, current_rss_mb
+
+# How often InferenceServer.start() checks whether the server is alive.
+_SERVER_POLL_INTERVAL = 0.1
+# How long a stopped worker gets to exit before it is terminated.
+_STOP_TIMEOUT = 5
+# How long InferenceServer.start() waits for the server to listen.
+_SERVER_START_TIMEOUT = 60
+# How long InferenceClient.health() waits for the server to answer.
+_HEALTH_TIMEOUT = 5
+
+_STOP = None
+
+
+class InferenceWorkerError(Exception):
+    pass
+
+
+class InferenceWorkerCrashed(InferenceWorkerError):
+    pass
+
+
+class _Worker:
+    def __init__(self, slot: int, models, process, task_queue, result_reader):
+        self.slot = slot
+        self.models = models
+        self.process = process
+        self.task_queue = task_queue
+        self.result_reader = result_reader
+        self.in_flight = {}
+        self.tasks_done = 0
+        self.rss_mb = None
+        self.retiring = False
+        self.replacing = False
+        self.exited = False
+        self.started = time.time()
+
+
+class InferenceWorkerPool:
+    """
+    Runs inference in separate worker processes, so that the web workers
+      only decode requests and wait for the results.
+
+    Every worker process has its own task queue and result pipe, which a
+      thread of the submitting process reads. A worker which dies can not
+      leave a lock shared with the other workers locked, and the end of its
+      pipe tells that it has exited after its last result was read. Tasks go
+      to the least busy worker which serves the model. Every
+      worker runs threads_per_worker tasks at a time, so that the models can
+      batch concurrent requests.
+
+    Workers which crash are started again and their unfinished tasks fail.
+      Workers which have run max_tasks_per_worker tasks or whose memory use
+      grew over max_memory_mb get no new tasks, are replaced and exit after
+      their queued tasks.
+
+    The processes are started on the first submit, so a pool created before
+      forking web workers is started separately in every web worker. Use
+      InferenceServer to share one pool between forked processes.
+    """
+
+    def __init__(self, fn, workers: int = 2, worker_models=None, default_models=None,
+                 initializer=None, max_tasks_per_worker: int = None, max_memory_mb: float = None,
+                 threads_per_worker: int = 4):
+        """
+        Args:
+            fn (function): Module level function run in the worker processes.
+            workers (int): Amount of worker processes.
+            worker_models (list): Model names for every worker. The worker
+              gets only tasks of its models and loads them when started.
+              Workers without models, or beyond the list, serve every model.
+            default_models (list): Model names loaded by the workers which
+              serve every model.
+            initializer (function): Module level function called with the
+              model names of the worker when the worker starts.
+            max_tasks_per_worker (int): Replace workers after this many tasks.
+            max_memory_mb (float): Replace workers whose RSS grows over this.
+            threads_per_worker (int): Tasks run at the same time in a worker.
+        """
+        if workers < 1:
+            raise Exception("Inference worker pool needs at least one worker")
+        if threads_per_worker < 1:
+            raise Exception("Inference worker needs at least one thread")
+
+        worker_models = worker_models or []
+        self.fn = fn
+        self.default_models = list(default_models or [])
+        self.initializer = initializer
+        self.slot_models = [list(worker_models[slot]) if slot < len(worker_models) else []
+                            for slot in range(workers)]
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.max_memory_mb = max_memory_mb
+        self.threads_per_worker = threads_per_worker
+
+        self._context = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._owner_pid = None
+        self._closed = False
+
+    def start(self):
+        """
+        Starts the worker processes without waiting for the first submit.
+        """
+        with self._lock:
+            self._ensure_started()
+
+    def submit(self, model_name: str, *args, **kwargs):
+        """
+        Submits task to a worker which serves the model.
+
+        Args:
+            model_name (str): Model of the task, selects the worker.
+            args, kwargs: Arguments for fn.
+
+        Returns:
+            future (Future): Result of fn. Fails with InferenceWorkerError if
+              fn raised an exception and InferenceWorkerCrashed if the worker
+              process died before finishing the task.
+        """
+        with self._lock:
+            self._ensure_started()
+
+            candidates = [worker for worker in self._workers
+                          if not worker.retiring and model_name in worker.models] or \
+                [worker for worker in self._workers
+                 if not worker.retiring and not worker.models]
+            if not candidates:
+                raise InferenceWorkerError(
+                    f"No inference worker serves model '{model_name}'")
+
+            worker = min(candidates, key=lambda worker: len(worker.in_flight))
+            task_id = next(self._task_ids)
+            future = Future()
+            worker.in_flight[task_id] = future
+            self._tasks[task_id] = worker
+
+        worker.task_queue.put((task_id, args, kwargs))
+
+        return future
+
+    def run(self, model_name: str, *args, timeout: float = None, **kwargs):
+        """
+        Runs task in a worker and waits for the result. See submit().
+        """
+        return self.submit(model_name, *args, **kwargs).result(timeout)
+
+    def health(self):
+        """
+        Returns state of the worker processes.
+
+        Returns:
+            health (dict): 'started', 'healthy' if every worker is alive,
+              'restarts' by crash, 'recycled' workers and for every worker
+              its 'slot', 'pid', 'alive', 'models', tasks 'in_flight',
+              'tasks_done', 'uptime_seconds' and 'memory'.
+        """
+        with self._lock:
+            if self._owner_pid != os.getpid():
+                return {"started": False, "healthy": False, "restarts": 0,
+                        "recycled": 0, "workers": []}
+
+            workers = [(worker, worker.process.pid, worker.process.is_alive(),
+                        len(worker.in_flight)) for worker in self._workers]
+            restarts, recycled = self._restarts, self._recycled
+
+        return {
+            "started": True,
+            "healthy": all(alive for _, _, alive, _ in workers),
+            "restarts": restarts,
+            "recycled": recycled,
+            "workers": [{
+                "slot": worker.slot,
+                "pid": pid,
+                "alive": alive,
+                "models": worker.models,
+                "in_flight": in_flight,
+                "tasks_done": worker.tasks_done,
+                "uptime_seconds": round(time.time() - worker.started, 1),
+                "memory": read_process_memory(pid) if alive else {}
+            } for worker, pid, alive, in_flight in workers]
+        }
+
+    def close(self):
+        """
+        Stops the worker processes. Unfinished tasks fail.
+        """
+        with self._lock:
+            if self._owner_pid != os.getpid() or self._closed:
+                return
+            self._closed = True
+            workers = self._workers + self._retired
+
+        print("Stopping inference workers")
+        for worker in workers:
+            _stop_process(worker)
+            with self._lock:
+                self._fail_tasks(worker, "Inference worker pool was closed")
+        self._wakeup_writer.send_bytes(b"")
+        self._collector.join()
+        for worker in workers:
+            worker.result_reader.close()
+        print("- Done")
+
+    def _ensure_started(self):
+        if self._owner_pid == os.getpid():
+            if self._closed:
+                raise InferenceWorkerError("Inference worker pool is closed")
+            return
+
+        # Not started yet, or started by the parent before a fork. Threads and
+        #   child processes of the parent are not usable in the fork.
+        print(f"Starting {len(self.slot_models)} inference workers")
+        self._owner_pid = os.getpid()
+        self._closed = False
+        self._task_ids = itertools.count()
+        self._tasks = {}
+        self._retired = []
+        self._restarts = 0
+        self._recycled = 0
+        # Wakes up the collector to read the pipes of new workers.
+        self._wakeup_reader, self._wakeup_writer = self._context.Pipe(duplex=False)
+        self._workers = [self._start_worker(slot) for slot in range(len(self.slot_models))]
+
+        self._collector = threading.Thread(
+            target=self._collect_results, name="inference-results", daemon=True)
+        self._collector.start()
+        print("- Done")
+
+    def _start_worker(self, slot):
+        models = self.slot_models[slot]
+        task_queue = self._context.Queue()
+        result_reader, result_writer = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=_run_worker,
+            args=(slot, self.fn, self.initializer, models or self.default_models,
+                  self.threads_per_worker, task_queue, result_writer),
+            name=f"inference-worker-{slot}", daemon=True)
+        process.start()
+        # Only the worker writes to the pipe, so the pipe ends when it exits.
+        result_writer.close()
+
+        return _Worker(slot, models, process, task_queue, result_reader)
+
+    def _collect_results(self):
+        while True:
+            with self._lock:
+                if self._closed:
+                    return
+                workers = {worker.result_reader: worker
+                           for worker in self._workers + self._retired
+                           if not worker.exited}
+
+            for reader in wait(list(workers) + [self._wakeup_reader]):
+                if reader is self._wakeup_reader:
+                    reader.recv_bytes()
+                    continue
+
+                try:
+                    message = reader.recv()
+                except (EOFError, OSError):
+                    self._worker_exited(workers[reader])
+                    continue
+                self._set_result(workers[reader], message)
+
+    def _set_result(self, worker, message):
+        task_id, error, result, rss_mb = message
+        with self._lock:
+            if self._tasks.pop(task_id, None) is None:
+                # Task was failed already when the pool was closed.
+                return
+            future = worker.in_flight.pop(task_id)
+            worker.tasks_done += 1
+            worker.rss_mb = rss_mb
+            recycle = not worker.replacing and self._should_recycle(worker)
+            if recycle:
+                worker.replacing = True
+
+        if recycle:
+            print(f"Replacing inference worker {worker.process.pid} after "
+                  f"{worker.tasks_done} tasks with {worker.rss_mb} MB RSS")
+            self._start_replacement(worker, crashed=False)
+
+        if error:
+            future.set_exception(InferenceWorkerError(error))
+        else:
+            future.set_result(result)
+
+    def _should_recycle(self, worker):
+        return (self.max_tasks_per_worker and worker.tasks_done >= self.max_tasks_per_worker) or \
+            (self.max_memory_mb and worker.rss_mb and worker.rss_mb > self.max_memory_mb)
+
+    def _worker_exited(self, worker):
+        if not self._closed:
+            # Reaps the process for its exit code. close() joins it otherwise.
+            worker.process.join(_STOP_TIMEOUT)
+        with self._lock:
+            worker.exited = True
+            self._fail_tasks(worker, "Inference worker crashed")
+            if worker in self._retired:
+                self._retired.remove(worker)
+            restart = worker in self._workers and not self._closed
+            if worker.replacing or not restart:
+                # The replacement which is being started swaps it out.
+                restart = False
+            worker.replacing = True
+
+        if restart:
+            print(f"Inference worker {worker.process.pid} exited with "
+                  f"code {worker.process.exitcode}, restarting it")
+            self._start_replacement(worker, crashed=True)
+        elif worker not in self._workers:
+            worker.result_reader.close()
+
+    def _start_replacement(self, worker, crashed):
+        # Starting a process is slow, so it is done in its own thread and
+        #   without the lock, which the submitting requests need.
+        threading.Thread(target=self._replace, args=(worker, crashed),
+                         name="inference-replace", daemon=True).start()
+
+    def _replace(self, worker, crashed):
+        # The old worker keeps getting tasks until the replacement has
+        #   started and is swapped in.
+        replacement = self._start_worker(worker.slot)
+        with self._lock:
+            closed = self._closed
+            if not closed:
+                self._workers[self._workers.index(worker)] = replacement
+                if crashed:
+                    self._restarts += 1
+                else:
+                    self._recycled += 1
+                if worker.exited:
+                    # Tasks given to the dead worker while it was replaced.
+                    self._fail_tasks(worker, "Inference worker crashed")
+                else:
+                    worker.retiring = True
+                    self._retired.append(worker)
+
+        if closed:
+            _stop_process(replacement)
+            replacement.result_reader.close()
+            return
+
+        if worker.exited:
+            worker.result_reader.close()
+        else:
+            # The old worker finishes its queued tasks before it reads the
+            #   stop marker.
+            worker.task_queue.put(_STOP)
+        # Wakes up the collector to read the pipe of the replacement.
+        self._wakeup_writer.send_bytes(b"")
+
+    def _fail_tasks(self, worker, message):
+        for task_id, future in list(worker.in_flight.items()):
+            self._tasks.pop(task_id, None)
+            if not future.done():
+                future.set_exception(InferenceWorkerCrashed(message))
+        worker.in_flight.clear()
+
+
+def _stop_process(worker):
+    try:
+        worker.task_queue.put(_STOP)
+    except ValueError:
+        pass
+    worker.process.join(_STOP_TIMEOUT)
+    if worker.process.is_alive():
+        worker.process.terminate()
+        worker.process.join()
+
+
+def _run_worker(slot, fn, initializer, models, threads, task_queue, result_writer):
+    print(f"Inference worker {slot} started in process {os.getpid()}")
+    if initializer:
+        initializer(models)
+
+    send_lock = threading.Lock()
+    # Leaving the executor waits for the tasks queued before the stop marker.
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="inference") as executor:
+        while True:
+            task = task_queue.get()
+            if task is _STOP:
+                return
+
+            executor.submit(_run_task, fn, task, result_writer, send_lock)
+
+
+def _run_task(fn, task, result_writer, send_lock):
+    task_id, args, kwargs = task
+    error, result = None, None
+    try:
+        result = fn(*args, **kwargs)
+    except Exception as err:
+        traceback.print_exc()
+        error = f"{type(err).__name__}: {err}"
+
+    message = (task_id, error, result, current_rss_mb())
+    with send_lock:
+        result_writer.send(message)
+
+
+class InferenceServer:
+    """
+    Runs one InferenceWorkerPool in a server process, which the processes
+      forked after start() share through client(). Used by gunicorn, so that
+      all web workers of the host send their tasks to the same inference
+      workers instead of starting their own.
+
+    The server listens on a Unix socket and accepts only the clients which
+      know the key generated when the server was created.
+    """
+
+    def __init__(self, fn, address: str, **pool_options):
+        """
+        Args:
+            fn (function): Module level function run in the worker processes.
+            address (str): Path of the Unix socket.
+            pool_options: Other arguments of InferenceWorkerPool.
+        """
+        self.fn = fn
+        self.address = address
+        self.pool_options = pool_options
+        self.authkey = os.urandom(32)
+
+        self._context = multiprocessing.get_context("spawn")
+        self._process = None
+
+    def start(self):
+        """
+        Starts the server process and its worker processes. Returns when the
+          server accepts clients.
+        """
+        print(f"Starting inference server at '{self.address}'")
+        ready = self._context.Event()
+        self._process = self._context.Process(
+            target=_serve,
+            args=(self.address, self.authkey, self.fn, self.pool_options, ready),
+            name="inference-server")
+        self._process.start()
+
+        deadline = time.time() + _SERVER_START_TIMEOUT
+        while not ready.wait(_SERVER_POLL_INTERVAL):
+            if not self._process.is_alive() or time.time() > deadline:
+                self.stop()
+                raise InferenceWorkerError("Inference server did not start")
+        print("- Done")
+
+    def stop(self):
+        """
+        Stops the server process and its worker processes.
+        """
+        if self._process is None:
+            return
+
+        print("Stopping inference server")
+        self._process.terminate()
+        self._process.join()
+        self._process = None
+        print("- Done")
+
+    def client(self):
+        return InferenceClient(self.address, self.authkey)
+
+
+class InferenceClient:
+    """
+    Submits tasks to an InferenceServer. Has the submit(), run() and health()
+      of InferenceWorkerPool, so the callers use either of them the same way.
+
+    Every process connects on its first request, so a client created before
+      forking web workers connects separately from every web worker.
+    """
+
+    def __init__(self, address: str, authkey: bytes):
+        self.address = address
+        self.authkey = authkey
+
+        self._lock = threading.Lock()
+        self._owner_pid = None
+        self._connection = None
+
+    def submit(self, model_name: str, *args, **kwargs):
+        """
+        Submits task to the server. See InferenceWorkerPool.submit(). Fails
+          with InferenceWorkerCrashed also if the server can not be reached.
+        """
+        return self._request("submit", (model_name,) + args, kwargs)
+
+    def run(self, model_name: str, *args, timeout: float = None, **kwargs):
+        """
+        Runs task in a worker and waits for the result. See submit().
+        """
+        return self.submit(model_name, *args, **kwargs).result(timeout)
+
+    def health(self):
+        """
+        Returns state of the worker processes of the server. See
+          InferenceWorkerPool.health(). Not healthy if the server does not
+          answer.
+        """
+        try:
+            return self._request("health", (), {}).result(_HEALTH_TIMEOUT)
+        except (InferenceWorkerError, FutureTimeoutError) as err:
+            return {"started": True, "healthy": False, "restarts": 0,
+                    "recycled": 0, "workers": [],
+                    "error": str(err) or "Inference server did not answer"}
+
+    def _request(self, action, args, kwargs):
+        with self._lock:
+            if self._owner_pid != os.getpid() or self._connection is None:
+                self._connect()
+
+            request_id = next(self._request_ids)
+            future = Future()
+            self._pending[request_id] = future
+            try:
+                self._connection.send((request_id, action, args, kwargs))
+            except (OSError, ValueError) as err:
+                del self._pending[request_id]
+                raise InferenceWorkerCrashed(
+                    f"Could not send task to inference server: {err}")
+
+        return future
+
+    def _connect(self):
+        # Not connected yet, or connected by the parent before a fork. The
+        #   connection of the parent is left to the parent.
+        try:
+            connection = Client(self.address, family="AF_UNIX", authkey=self.authkey)
+        except (OSError, EOFError, AuthenticationError) as err:
+            raise InferenceWorkerCrashed(
+                f"Could not connect to inference server: {err}")
+
+        self._owner_pid = os.getpid()
+        self._connection = connection
+        self._request_ids = itertools.count()
+        self._pending = {}
+        threading.Thread(
+            target=self._receive, args=(connection, self._pending),
+            name="inference-client", daemon=True).start()
+
+    def _receive(self, connection, pending):
+        while True:
+            try:
+                request_id, error, result = connection.recv()
+            except (EOFError, OSError):
+                break
+
+            with self._lock:
+                future = pending.pop(request_id)
+            if error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        # Server was stopped. Unfinished tasks fail and the next request
+        #   connects again.
+        with self._lock:
+            if self._connection is connection:
+                self._connection = None
+            failed = list(pending.values())
+            pending.clear()
+        connection.close()
+
+        for future in failed:
+            future.set_exception(InferenceWorkerCrashed(
+                "Connection to inference server was lost"))
+
+
+def _serve(address, authkey, fn, pool_options, ready):
+    # Default SIGTERM would leave the worker processes running.
+    signal.signal(signal.SIGTERM, _exit_on_signal)
+
+    pool = InferenceWorkerPool(fn, **pool_options)
+    if os.path.exists(address):
+        os.remove(address)
+    listener = Listener(address, family="AF_UNIX", authkey=authkey)
+    try:
+        pool.start()
+        print(f"Inference server listening in process {os.getpid()}")
+        ready.set()
+
+        while True:
+            try:
+                connection = listener.accept()
+            except (AuthenticationError, EOFError, OSError) as err:
+                print(f"Inference client was not accepted: {err}")
+                continue
+
+            threading.Thread(
+                target=_serve_client, args=(pool, connection),
+                name="inference-server-client", daemon=True).start()
+    except SystemExit:
+        pass
+    finally:
+        listener.close()
+        pool.close()
+
+
+def _exit_on_signal(signum, frame):
+    raise SystemExit(0)
+
+
+def _serve_client(pool, connection):
+    send_lock = threading.Lock()
+
+    def send(request_id, error=None, result=None):
+        with send_lock:
+            try:
+                connection.send((request_id, error, result))
+            except (OSError, ValueError):
+                # Client is gone.
+                pass
+
+    def reply(request_id, future):
+        error = future.exception()
+        send(request_id, error, None if error else future.result())
+
+    with connection:
+        while True:
+            try:
+                request_id, action, args, kwargs = connection.recv()
+            except (EOFError, OSError):
+                return
+
+            if action == "health":
+                send(request_id, result=pool.health())
+                continue
+
+            try:
+                future = pool.submit(*args, **kwargs)
+            except InferenceWorkerError as err:
+                send(request_id, err)
+                continue
+            future.add_done_callback(
+                lambda future, request_id=request_id: reply(request_id, future))
@@ -0,0 +1,140 @@
+import threading
+import time
+import traceback
+import uuid
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_STATUS_QUEUED = "queued"
+JOB_STATUS_RUNNING = "running"
+JOB_STATUS_DONE = "done"
+JOB_STATUS_FAILED = "failed"
+
+FINISHED_STATUSES = (JOB_STATUS_DONE, JOB_STATUS_FAILED)
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobManager:
+    """
+    Runs prediction jobs in a bounded in-process worker pool.
+
+    Jobs are kept in memory. Finished jobs are forgotten oldest first when
+      more than max_finished_jobs of them are stored.
+    """
+
+    def __init__(self, max_workers: int = 2, max_queued: int = 100, max_finished_jobs: int = 1000):
+        self.max_queued = max_queued
+        self.max_finished_jobs = max_finished_jobs
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="job-worker")
+        self._jobs = OrderedDict()
+        self._condition = threading.Condition()
+
+    def submit(self, fn, **kwargs):
+        """
+        Submits job to the worker pool.
+
+        Args:
+            fn (function): Function run by the worker. Gets a progress(stage)
+              callback and kwargs as arguments and returns the job result.
+            kwargs: Arguments for fn. Strings among them are stored with the job.
+
+        Returns:
+            job (dict): Snapshot of the queued job.
+
+        Raises:
+            JobQueueFull: If too many jobs are waiting already.
+        """
+        with self._condition:
+            queued = sum(1 for job in self._jobs.values()
+                         if job["status"] == JOB_STATUS_QUEUED)
+            if queued >= self.max_queued:
+                raise JobQueueFull("Too many queued jobs")
+
+            job_id = uuid.uuid4().hex
+            now = time.time()
+            self._jobs[job_id] = {
+                "id": job_id,
+                "status": JOB_STATUS_QUEUED,
+                "stage": JOB_STATUS_QUEUED,
+                "params": {key: value for key, value in kwargs.items()
+                           if isinstance(value, str)},
+                "created": now,
+                "updated": now,
+                "version": 0,
+                "result": None,
+                "error": None
+            }
+            job = dict(self._jobs[job_id])
+
+        print(f"Queued job ({job_id})")
+        self._executor.submit(self._run, job_id, fn, kwargs)
+
+        return job
+
+    def get(self, job_id: str):
+        """
+        Returns snapshot of the job or None if not found.
+        """
+        with self._condition:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def wait_for_update(self, job_id: str, version: int, timeout: float = None):
+        """
+        Waits until the job has a newer version than the given one.
+
+        Returns:
+            job (dict): Snapshot of the job, None if not found.
+        """
+        with self._condition:
+            self._condition.wait_for(
+                lambda: job_id not in self._jobs
+                or self._jobs[job_id]["version"] > version,
+                timeout=timeout)
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _update(self, job_id, **values):
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if not job:
+                return
+            job.update(values)
+            job["updated"] = time.time()
+            job["version"] += 1
+
+            if job["status"] in FINISHED_STATUSES:
+                self._forget_finished_jobs()
+
+            self._condition.notify_all()
+
+    def _forget_finished_jobs(self):
+        # Expects self._condition to be held by the caller.
+        finished = [job_id for job_id, job in self._jobs.items()
+                    if job["status"] in FINISHED_STATUSES]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job_id]
+
+    def _run(self, job_id, fn, kwargs):
+        self._update(job_id, status=JOB_STATUS_RUNNING,
+                     stage=JOB_STATUS_RUNNING)
+
+        def progress(stage):
+            self._update(job_id, stage=stage)
+
+        try:
+            result = fn(progress, **kwargs)
+        except Exception as err:
+            print(f"- Job ({job_id}) failed: '{err}'")
+            traceback.print_exc()
+            self._update(job_id, status=JOB_STATUS_FAILED,
+                         stage=JOB_STATUS_FAILED, error=str(err))
+        else:
+            print(f"- Job ({job_id}) done")
+            self._update(job_id, status=JOB_STATUS_DONE,
+                         stage=JOB_STATUS_DONE, result=result)
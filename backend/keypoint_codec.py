@@ -0,0 +1,87 @@
+import struct
+
+import numpy as np
+
+from bson.binary import Binary
+
+# Keypoints are stored as BSON binary of this user defined subtype. The
+#   binary starts with a header of magic bytes, format version, dtype code,
+#   amount of dimensions and the dimensions, followed by the values in
+#   little-endian byte order.
+KEYPOINTS_BINARY_SUBTYPE = 0x80
+KEYPOINTS_STORAGE_FORMATS = ("list", "float32", "float16")
+
+_MAGIC = b"KP"
+_VERSION = 1
+_HEADER = struct.Struct("<2sBBB")
+_DTYPES = {
+    1: np.dtype("<f4"),
+    2: np.dtype("<f2")
+}
+_DTYPE_CODES = {dtype: code for code, dtype in _DTYPES.items()}
+# Keypoints and their (y, x, score) values of one person.
+_PERSON_SHAPE = (17, 3)
+
+
+def encode_keypoints(keypoints_with_scores, storage_format: str = "float32"):
+    """
+    Encodes keypoints for storing to database.
+
+    Args:
+        keypoints_with_scores (array-like): Keypoints as numpy array, nested
+          lists or already encoded binary.
+        storage_format (str): 'float32' or 'float16' for packed binary, 'list'
+          for nested lists of floats.
+
+    Returns:
+        Binary or list: Encoded keypoints.
+    """
+    if storage_format not in KEYPOINTS_STORAGE_FORMATS:
+        raise Exception(
+            f"Keypoint storage format '{storage_format}' not supported")
+
+    if storage_format == "list":
+        return decode_keypoints(keypoints_with_scores).tolist()
+
+    dtype = np.dtype(storage_format).newbyteorder("<")
+    array = np.ascontiguousarray(
+        decode_keypoints(keypoints_with_scores), dtype=dtype)
+
+    header = _HEADER.pack(_MAGIC, _VERSION, _DTYPE_CODES[dtype], array.ndim) + \
+        struct.pack(f"<{array.ndim}I", *array.shape)
+
+    return Binary(header + array.tobytes(), KEYPOINTS_BINARY_SUBTYPE)
+
+
+def decode_keypoints(value):
+    """
+    Decodes stored keypoints to numpy array. Packed binary is read without
+      copying, so the returned array is read-only. Stored lists of a result
+      without people, [[]], are decoded to shape [1, 0, 17, 3].
+
+    Args:
+        value (Binary, list or numpy array): Stored keypoints.
+
+    Returns:
+        keypoints_with_scores (numpy array): Keypoints.
+    """
+    if not is_encoded(value):
+        array = np.asarray(value)
+        # Lists do not keep the shape of a result without people.
+        if array.size == 0:
+            return array.reshape(1, 0, *_PERSON_SHAPE)
+        return array
+
+    magic, version, dtype_code, ndim = _HEADER.unpack_from(value)
+    if magic != _MAGIC or version != _VERSION or dtype_code not in _DTYPES:
+        raise Exception("Unknown keypoint encoding")
+
+    shape = struct.unpack_from(f"<{ndim}I", value, _HEADER.size)
+    offset = _HEADER.size + 4 * ndim
+
+    return np.frombuffer(value, dtype=_DTYPES[dtype_code],
+                         count=int(np.prod(shape)), offset=offset).reshape(shape)
+
+
+def is_encoded(value):
+    return isinstance(value, bytes) and value[:len(_MAGIC)] == _MAGIC
@@ -0,0 +1,56 @@
+import argparse
+import sys
+
+from backend.config import config
+from backend.keypoint_codec import KEYPOINTS_STORAGE_FORMATS
+from backend.web_app import app, db_connection
+from backend.file_handler import ensure_file_indexes, migrate_legacy_files
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Maintenance commands for the backend.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser(
+        "migrate-files", help="Move files saved before the blob store to it.")
+    migrate_keypoints_parser = subparsers.add_parser(
+        "migrate-keypoints", help="Convert stored keypoints to another storage format.")
+    migrate_keypoints_parser.add_argument(
+        "--format", choices=KEYPOINTS_STORAGE_FORMATS,
+        default=config.dict().get("keypointStorage") or "float32",
+        help="Storage format, defaults to keypointStorage of the config.")
+    subparsers.add_parser(
+        "ensure-indexes", help="Create the indexes of the collections.")
+    subparsers.add_parser(
+        "rebuild-stats", help="Recount the stats counters from the predictions.")
+    subparsers.add_parser(
+        "check-stats", help="Compare the stats counters to the predictions.")
+
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.command == "migrate-files":
+            migrate_legacy_files()
+
+        elif args.command == "migrate-keypoints":
+            db_connection.migrate_keypoints(args.format)
+
+        elif args.command == "ensure-indexes":
+            db_connection.ensure_indexes()
+            ensure_file_indexes()
+
+        elif args.command == "rebuild-stats":
+            db_connection.rebuild_stats_counters()
+
+        elif args.command == "check-stats":
+            differences = db_connection.check_stats_counters()
+            for (kind, key), (counter, expected) in sorted(differences.items()):
+                print(f"- {kind} '{key}': counter {counter}, expected {expected}")
+            print(f"Found {len(differences)} differences")
+            if differences:
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,20 @@
 import os
+import threading
 import requests
 import cv2
 
+from collections import OrderedDict
+from contextlib import contextmanager
+
 import numpy as np
 import mediapipe as mp
 import tensorflow as tf
 import tensorflow_hub as hub
 
+from backend.batching import MicroBatcher
+from backend.config import config
+from backend.resource_pool import ResourcePool
+
 dir_path = os.path.dirname(os.path.realpath(__file__))
 MODELS_DIR = os.path.join(dir_path, "models")
 
@@ -17,9 +25,55 @@ SUPPORTED_MODELS = [
     "tflite_movenet_lightning_int8",
     "tflite_movenet_thunder_int8",
     "movenet_lightning",
-    "movenet_thunder"
+    "movenet_thunder",
+    "movenet_multipose_lightning"
 ]
 
+# Models which return up to MULTIPOSE_MAX_INSTANCES people with their
+#   bounding boxes instead of a single person.
+MULTIPOSE_MODELS = [
+    "movenet_multipose_lightning"
+]
+MULTIPOSE_MAX_INSTANCES = 6
+# People detected with lower bounding box score are left out.
+MULTIPOSE_MIN_INSTANCE_SCORE = 0.2
+
+# Models which are loaded without running TensorFlow operations. These can
+#   be registered before the server forks its worker processes, which only
+#   downloads the model files, because interpreters and graphs are created on
+#   first use. See ModelRegistry.reinitialize_after_fork. TensorFlow itself is
+#   not fork-safe once it has run operations.
+FORK_SAFE_MODELS = [
+    model_name for model_name in SUPPORTED_MODELS
+    if "tflite" in model_name or model_name == "blazepose"
+]
+
+# Versions of the model weights. Part of the prediction cache key, so
+#   results of older weights are not reused.
+MODEL_VERSIONS = {
+    "blazepose": f"mediapipe-{mp.__version__}",
+    "tflite_movenet_lightning_f16": "4",
+    "tflite_movenet_thunder_f16": "4",
+    "tflite_movenet_lightning_int8": "4",
+    "tflite_movenet_thunder_int8": "4",
+    "movenet_lightning": "4",
+    "movenet_thunder": "4",
+    "movenet_multipose_lightning": "1"
+}
+
+# Approximate resident memory of a loaded model including runtime buffers.
+#   Used by the model registry to keep loaded models under the memory budget.
+MODEL_MEMORY_ESTIMATES_MB = {
+    "blazepose": 60,
+    "tflite_movenet_lightning_f16": 10,
+    "tflite_movenet_thunder_f16": 25,
+    "tflite_movenet_lightning_int8": 8,
+    "tflite_movenet_thunder_int8": 16,
+    "movenet_lightning": 40,
+    "movenet_thunder": 90,
+    "movenet_multipose_lightning": 50
+}
+
 
 def model_downloader(
     url: str,
@@ -103,9 +157,17 @@ def select_movenet_model(model_name: str):
         model_filename = f"{model_name}.tflite"
         model_path = model_downloader(url, model_filename)
 
-        # Initialize the TFLite interpreter
-        interpreter = tf.lite.Interpreter(model_path=model_path)
-        interpreter.allocate_tensors()
+        def create_interpreter():
+            # Initialize the TFLite interpreter
+            interpreter = tf.lite.Interpreter(
+                model_path=model_path,
+                num_threads=config.dict().get("interpreterNumThreads"))
+            interpreter.allocate_tensors()
+            return interpreter
+
+        # Interpreters are not thread-safe, so each concurrent call checks out its own.
+        interpreter_pool = ResourcePool(
+            create_interpreter, config.dict().get("interpreterPoolSize", 1))
 
         def keypoint_detector(input_image):
             """Runs detection on an input image.
@@ -123,22 +185,30 @@ def select_movenet_model(model_name: str):
 
             # TF Lite format expects tensor type of uint8.
             input_image = tf.cast(input_image, dtype=tf.uint8)
-            input_details = interpreter.get_input_details()
-            output_details = interpreter.get_output_details()
-            interpreter.set_tensor(
-                input_details[0]['index'], input_image.numpy())
-            # Invoke inference.
-            interpreter.invoke()
-            # Get the model prediction.
-            keypoints_with_scores = interpreter.get_tensor(
-                output_details[0]['index'])
+            with interpreter_pool.checkout() as interpreter:
+                input_details = interpreter.get_input_details()
+                output_details = interpreter.get_output_details()
+                interpreter.set_tensor(
+                    input_details[0]['index'], input_image.numpy())
+                # Invoke inference.
+                interpreter.invoke()
+                # Get the model prediction.
+                keypoints_with_scores = interpreter.get_tensor(
+                    output_details[0]['index'])
 
             print("- Done")
 
             return keypoints_with_scores
 
+        keypoint_detector.close = interpreter_pool.close
+        keypoint_detector.after_fork = interpreter_pool.reinitialize_after_fork
+
     else:
-        if "movenet_lightning" in model_name:
+        if "movenet_multipose_lightning" in model_name:
+            module = hub.load(
+                "https://tfhub.dev/google/movenet/multipose/lightning/1")
+            input_size = 256
+        elif "movenet_lightning" in model_name:
             module = hub.load(
                 "https://tfhub.dev/google/movenet/singlepose/lightning/4")
             input_size = 192
@@ -149,6 +219,17 @@ def select_movenet_model(model_name: str):
         else:
             raise ValueError("Unsupported model name: %s" % model_name)
 
+        model = module.signatures['serving_default']
+
+        batcher = None
+        if config.dict().get("batchingEnabled"):
+            # Concurrent requests for the same model are run as one batch.
+            batcher = MicroBatcher(
+                _create_movenet_batch_fn(model, input_size),
+                max_batch_size=config.dict().get("batchMaxSize", 16),
+                max_wait_ms=config.dict().get("batchMaxWaitMs", 5),
+                name=f"{model_name}-batcher")
+
         def keypoint_detector(input_image):
             """Runs detection on an input image.
 
@@ -159,38 +240,89 @@ def select_movenet_model(model_name: str):
 
             Returns:
               keypoints_with_scores [1, 1, 17, 3] (float numpy array): representing the predicted keypoint
-                coordinates and scores.
+                coordinates and scores. MultiPose models return [1, 6, 56], see
+                convert_multipose_output.
             """
-            model = module.signatures['serving_default']
-
             # SavedModel format expects tensor type of int32.
             input_image = tf.cast(input_image, dtype=tf.int32)
+
+            if batcher:
+                return batcher.submit(input_image)
+
             # Run model inference.
             outputs = model(input_image)
-            # Output is a [1, 1, 17, 3] tensor.
+            # Output is a [1, 1, 17, 3] tensor, or [1, 6, 56] for MultiPose.
             keypoints_with_scores = outputs['output_0'].numpy()
             return keypoints_with_scores
 
+        if batcher:
+            keypoint_detector.close = batcher.close
+
     return keypoint_detector, input_size
 
 
-def select_blazepose_model():
+def _create_movenet_batch_fn(model, input_size):
+    """
+    Creates function which runs a list of [1, height, width, 3] input tensors
+      through the MoveNet serving_default signature as one batch.
+
+    The single pose signatures have a fixed batch dimension of 1. In that case
+      the batch is mapped over inside one graph call, which still lets
+      TensorFlow run the images in parallel.
+
+    Args:
+        model (ConcreteFunction): serving_default signature of the model.
+        input_size (int): Input tensor size for the model.
+
+    Returns:
+        batch_fn (function): Returns list of [1, 1, 17, 3] numpy arrays.
+    """
+    input_spec = tf.nest.flatten(model.structured_input_signature)[0]
+    fixed_batch_size = input_spec.shape[0] is not None
+
+    @tf.function(input_signature=[
+        tf.TensorSpec([None, input_size, input_size, 3], tf.int32)])
+    def run_batch(batch):
+        if not fixed_batch_size:
+            return model(batch)['output_0']
+
+        return tf.map_fn(
+            lambda image: model(tf.expand_dims(image, axis=0))['output_0'][0],
+            batch,
+            fn_output_signature=tf.float32,
+            parallel_iterations=16)
+
+    def batch_fn(inputs):
+        batch = tf.concat(inputs, axis=0)
+        keypoints_with_scores = run_batch(batch).numpy()
+
+        return [keypoints_with_scores[i:i + 1] for i in range(len(inputs))]
+
+    return batch_fn
+
+
+def select_blazepose_model(model_complexity: int = 2, enable_segmentation: bool = True):
     """
     Selects Blazepose model.
 
+    Args:
+        model_complexity (int): Complexity of the pose landmark model: 0, 1 or 2.
+        enable_segmentation (bool): Whether to generate segmentation mask.
+
     Returns:
         keypoint_detector (function): Function which returns keypoints_with_scores 
           from input image.
     """
+    pose_pool = _get_pose_pool(model_complexity, enable_segmentation)
 
-    def keypoint_detector(image_path):
+    def keypoint_detector(image):
         """
         Detects keypoints from input image
         Converting image to tensor before inference not required with BlazePose.
         Image will be converted to square shape before inference.
 
         Args:
-            image_path (str): Absolute path to image
+            image (numpy array): uint8 RGB image [height, width, 3].
 
         Returns:
             results (Mediapipe pose process): Object containing the keypoints 
@@ -220,25 +352,63 @@ def select_blazepose_model():
 
             return image
 
-        mp_pose = mp.solutions.pose
+        image = add_padding(image)
 
-        with mp_pose.Pose(
-                static_image_mode=True,
-                model_complexity=2,
-                enable_segmentation=True,
-                min_detection_confidence=0.5) as pose:
+        with pose_pool.checkout() as pose:
             print(f"Estimating pose")
-            image = cv2.imread(image_path)
-            image = add_padding(image)
-
-            results = pose.process(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+            try:
+                results = pose.process(image)
+            except Exception:
+                # Graph is restarted so that the error does not carry over
+                #   to the next image.
+                pose.reset()
+                raise
             print("- Done")
 
         return results
 
+    def close():
+        with _pose_pools_lock:
+            _pose_pools.pop((model_complexity, enable_segmentation), None)
+        pose_pool.close()
+
+    keypoint_detector.close = close
+    keypoint_detector.after_fork = pose_pool.reinitialize_after_fork
+
     return keypoint_detector, None
 
 
+_pose_pools = {}
+_pose_pools_lock = threading.Lock()
+
+
+def _get_pose_pool(model_complexity: int, enable_segmentation: bool):
+    """
+    Returns pool of long-lived MediaPipe Pose graphs for the given settings.
+      The graphs run in static image mode, so every image is detected on its
+      own and the warm graphs can be reused without resetting them.
+    """
+    key = (model_complexity, enable_segmentation)
+
+    with _pose_pools_lock:
+        if key not in _pose_pools:
+            def create_pose():
+                print(
+                    f"- Initializing BlazePose graph (complexity {model_complexity})")
+                return mp.solutions.pose.Pose(
+                    static_image_mode=True,
+                    model_complexity=model_complexity,
+                    enable_segmentation=enable_segmentation,
+                    min_detection_confidence=0.5)
+
+            _pose_pools[key] = ResourcePool(
+                create_pose,
+                config.dict().get("blazeposePoolSize", 1),
+                on_discard=lambda pose: pose.close())
+
+        return _pose_pools[key]
+
+
 MOVENET_TO_BLAZEPOSE_DICT = {
     # Keys: MoveNet - Values: BlazePose
     0: 0,     # 'nose'
@@ -294,3 +464,248 @@ def convert_blazepose_results_to_movenet_keypoints_with_scores(results):
     print(f"- Done")
 
     return keypoints_with_scores
+
+
+def convert_multipose_output(outputs, min_instance_score=MULTIPOSE_MIN_INSTANCE_SCORE):
+    """
+    Converts MoveNet MultiPose output to keypoints_with_scores of all detected
+      people and their bounding boxes.
+
+    Args:
+        outputs (numpy array): [1, 6, 56] output of the model. For every
+          person the first 51 values are the 17 keypoints as (y, x, score)
+          and the last 5 the bounding box as (y_min, x_min, y_max, x_max, score).
+        min_instance_score (float): People with lower bounding box score are
+          left out.
+
+    Returns:
+        keypoints_with_scores [1, N, 17, 3] (float numpy array): Keypoints of
+          the N detected people, most confident first.
+        boxes [1, N, 5] (float numpy array): Bounding boxes of the people.
+    """
+    outputs = np.asarray(outputs, dtype=np.float32)[0]
+
+    instances = outputs[outputs[:, 55] >= min_instance_score]
+    instances = instances[np.argsort(-instances[:, 55], kind="stable")]
+
+    keypoints_with_scores = instances[:, :51].reshape(1, -1, 17, 3)
+    boxes = instances[:, 51:56].reshape(1, -1, 5)
+
+    return keypoints_with_scores, boxes
+
+
+class ModelRegistry:
+    """
+    Process-wide registry of loaded keypoint detectors.
+
+    Each model is loaded once with select_model and the warm instance is handed
+      out to every caller. When a memory budget is given, the least recently
+      used models are evicted to keep the estimated memory usage under it.
+
+    Models used with use() are closed only after the last caller is done with
+      them, so an eviction does not fail requests which got the model before it.
+    """
+
+    def __init__(self, memory_budget_mb=None):
+        self.memory_budget_mb = memory_budget_mb
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading_locks = {}
+        # Amount of callers using a model, by id of the model.
+        self._users = {}
+        # Evicted models waiting for their callers to finish, by id of the model.
+        self._retired = {}
+
+    def get(self, model_name: str):
+        """
+        Returns loaded keypoint detector for the model. Loads the model if
+          it is not loaded yet.
+
+        Args:
+            model_name (str): Name of the model.
+
+        Returns:
+            keypoint_detector (function): Function which returns keypoints_with_scores
+            input_size (int): Input tensor size for the model.
+        """
+        if model_name not in SUPPORTED_MODELS:
+            raise Exception(f"- Model name '{model_name}' not supported")
+
+        with self._lock:
+            if model_name in self._models:
+                self._models.move_to_end(model_name)
+                return self._models[model_name]
+            loading_lock = self._loading_locks.setdefault(
+                model_name, threading.Lock())
+
+        # Only one thread loads a model, the others wait for it to finish.
+        with loading_lock:
+            with self._lock:
+                if model_name in self._models:
+                    self._models.move_to_end(model_name)
+                    return self._models[model_name]
+
+            print(f"Loading model '{model_name}' to registry")
+            model = select_model(model_name)
+
+            with self._lock:
+                self._models[model_name] = model
+                evicted = self._enforce_memory_budget(keep=model_name)
+            print("- Done")
+
+            for evicted_model in evicted:
+                _close_model(evicted_model)
+
+        return model
+
+    @contextmanager
+    def use(self, model_name: str):
+        """
+        Returns loaded keypoint detector for the model like get(), and keeps
+          it open until the block exits even if it is evicted meanwhile.
+
+        Args:
+            model_name (str): Name of the model.
+
+        Yields:
+            keypoint_detector (function): Function which returns keypoints_with_scores
+            input_size (int): Input tensor size for the model.
+        """
+        while True:
+            model = self.get(model_name)
+            with self._lock:
+                # Model could have been evicted and closed since get() returned it.
+                if self._models.get(model_name) is model:
+                    self._users[id(model)] = self._users.get(id(model), 0) + 1
+                    break
+
+        try:
+            yield model
+        finally:
+            self._release(model)
+
+    def preload(self, model_names, fork_safe_only=False):
+        """
+        Loads the given models to registry beforehand.
+
+        Args:
+            model_names (list): Names of the models to load.
+            fork_safe_only (bool): Load only models in FORK_SAFE_MODELS. Used
+              before forking worker processes. Their interpreters and graphs
+              are not created yet, so this only downloads the model files.
+        """
+        for model_name in model_names:
+            if fork_safe_only and model_name not in FORK_SAFE_MODELS:
+                print(f"Loading model '{model_name}' after fork")
+                continue
+            self.get(model_name)
+
+    def reinitialize_after_fork(self):
+        """
+        Prepares the registry for a forked worker process. Downloaded model
+          files are kept, but interpreters and graphs, which depend on threads
+          of the parent process, are created again on demand. Models not in
+          FORK_SAFE_MODELS are dropped and loaded again in the worker.
+        """
+        self._lock = threading.Lock()
+        self._loading_locks = {}
+        self._users = {}
+        self._retired = {}
+
+        for model_name, (keypoint_detector, _) in list(self._models.items()):
+            if model_name not in FORK_SAFE_MODELS:
+                del self._models[model_name]
+                continue
+
+            after_fork = getattr(keypoint_detector, "after_fork", None)
+            if after_fork:
+                after_fork()
+
+    def evict(self, model_name: str):
+        """
+        Removes model from registry and releases its resources.
+
+        Args:
+            model_name (str): Name of the model.
+
+        Returns:
+            evicted (bool): True if the model was loaded.
+        """
+        with self._lock:
+            model = self._models.pop(model_name, None)
+            closable = self._retire(model) if model else None
+
+        if model:
+            print(f"Evicted model '{model_name}' from registry")
+        if closable:
+            _close_model(closable)
+
+        return model is not None
+
+    def clear(self):
+        for model_name in self.loaded_models():
+            self.evict(model_name)
+
+    def loaded_models(self):
+        """
+        Returns names of the loaded models from least to most recently used.
+        """
+        with self._lock:
+            return list(self._models.keys())
+
+    def memory_usage_mb(self):
+        with self._lock:
+            return self._estimated_memory_usage_mb()
+
+    def _estimated_memory_usage_mb(self):
+        return sum(MODEL_MEMORY_ESTIMATES_MB.get(model_name, 0)
+                   for model_name in self._models)
+
+    def _enforce_memory_budget(self, keep):
+        # Expects self._lock to be held by the caller. Returns the evicted
+        #   models which the caller closes after releasing the lock.
+        closable = []
+        if self.memory_budget_mb is None:
+            return closable
+
+        while self._estimated_memory_usage_mb() > self.memory_budget_mb:
+            evictable = [name for name in self._models if name != keep]
+            if not evictable:
+                break
+
+            model = self._models.pop(evictable[0])
+            print(f"- Evicted model '{evictable[0]}' to stay in memory budget")
+            if self._retire(model):
+                closable.append(model)
+
+        return closable
+
+    def _retire(self, model):
+        # Expects self._lock to be held by the caller. Returns the model if it
+        #   can be closed now, otherwise it is closed by the last caller using it.
+        if self._users.get(id(model)):
+            self._retired[id(model)] = model
+            return None
+        return model
+
+    def _release(self, model):
+        with self._lock:
+            self._users[id(model)] -= 1
+            if self._users[id(model)]:
+                return
+            del self._users[id(model)]
+            retired = self._retired.pop(id(model), None)
+
+        if retired:
+            _close_model(retired)
+
+
+def _close_model(model):
+    keypoint_detector, _ = model
+    close = getattr(keypoint_detector, "close", None)
+    if close:
+        close()
+
+
+model_registry = ModelRegistry(
+    memory_budget_mb=config.dict().get("modelMemoryBudgetMb"))
@@ -0,0 +1,142 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+
+import numpy as np
+
+
+class OverlayCache:
+    """
+    Size-bounded least recently used cache of rendered overlay PNG files on
+      local disk.
+
+    Files are named by item id and a hash of the keypoints and the render
+      settings, so changed keypoints or renderer never hit an old overlay.
+      Using a cached file updates its modification time, and the files with
+      the oldest modification time are removed first when the cache is full.
+    """
+
+    def __init__(self, cache_path: str, max_size_mb: float):
+        self.cache_path = cache_path
+        self.max_size = max_size_mb * 1024 * 1024
+        self._lock = threading.Lock()
+        self._size = None
+
+    def get(self, item_id: str, keypoints_with_scores, render_settings: dict):
+        """
+        Returns path of the cached overlay, None if not cached.
+        """
+        filepath = self._filepath(
+            item_id, keypoints_with_scores, render_settings)
+
+        try:
+            os.utime(filepath)
+        except FileNotFoundError:
+            return None
+
+        print(f"- Overlay found from cache")
+        return filepath
+
+    def put(self, item_id: str, keypoints_with_scores, render_settings: dict, png_bytes: bytes):
+        """
+        Saves rendered overlay to cache.
+
+        Returns:
+            filepath (str): Path of the cached overlay.
+        """
+        filepath = self._filepath(
+            item_id, keypoints_with_scores, render_settings)
+
+        # Written to a temporary file first so that readers never see a partial file.
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_path, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(png_bytes)
+        os.replace(temp_path, filepath)
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, _, size in self._entries())
+            else:
+                self._size += len(png_bytes)
+
+            if self._size > self.max_size:
+                self._evict()
+
+        return filepath
+
+    def invalidate(self, item_id: str):
+        """
+        Removes all cached overlays of the item.
+
+        Returns:
+            removed (int): Amount of removed files.
+        """
+        removed = self.invalidate_items([item_id])
+
+        if removed:
+            print(f"- Removed {removed} cached overlays of item ({item_id})")
+
+        return removed
+
+    def invalidate_items(self, item_ids):
+        """
+        Removes all cached overlays of the items with one pass over the cache folder.
+
+        Returns:
+            removed (int): Amount of removed files.
+        """
+        removed = 0
+        item_ids = set(item_ids)
+
+        with self._lock:
+            for path, _, size in self._entries():
+                if os.path.basename(path).split("_")[0] in item_ids:
+                    removed += self._remove(path, size)
+
+        return removed
+
+    def _filepath(self, item_id, keypoints_with_scores, render_settings):
+        key = json.dumps([np.asarray(keypoints_with_scores).tolist(), render_settings],
+                         sort_keys=True)
+        key_hash = hashlib.sha1(key.encode()).hexdigest()
+
+        return os.path.join(self.cache_path, f"{item_id}_{key_hash}.png")
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.cache_path) as it:
+            for entry in it:
+                if entry.name.endswith(".png"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((entry.path, stat.st_mtime, stat.st_size))
+
+        return entries
+
+    def _evict(self):
+        # Expects self._lock to be held by the caller. Other processes may
+        #   share the folder, so the size is recalculated from the disk.
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        self._size = sum(size for _, _, size in entries)
+
+        # Evicts a bit more than needed so that eviction does not run on every put.
+        target_size = self.max_size * 0.9
+        for path, _, size in entries:
+            if self._size <= target_size:
+                break
+            self._remove(path, size)
+
+    def _remove(self, path, size):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return 0
+
+        if self._size is not None:
+            self._size -= size
+
+        return 1
@@ -0,0 +1,252 @@
+import queue
+import threading
+import time
+
+_STOP = object()
+# How often blocked threads check whether the pipeline was cancelled.
+_POLL_INTERVAL = 0.1
+
+
+class PipelineCancelled(Exception):
+    pass
+
+
+class Stage:
+    """
+    One processing stage of a Pipeline.
+    """
+
+    def __init__(self, name: str, fn, workers: int = 1, ordered: bool = False):
+        """
+        Args:
+            name (str): Name of the stage, used for the counters and threads.
+            fn (function): Gets an item and returns the processed item.
+            workers (int): Amount of threads running fn in parallel.
+            ordered (bool): Items are given to fn in source order. Needed by
+              stateful stages, such as tracking or encoding. Ordered stages
+              have one worker.
+        """
+        if ordered and workers != 1:
+            raise Exception(f"Ordered stage '{name}' can have only one worker")
+
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.ordered = ordered
+
+
+class Pipeline:
+    """
+    Runs items through stages in threads, with bounded queues between them.
+
+    The source is read in its own thread and every stage runs in its own
+      worker threads, so all stages work at the same time and the wall-clock
+      time approaches that of the slowest stage. A full queue blocks the
+      stage before it, so at most about queue_size items per stage are in
+      memory however long the source is.
+
+    Stages with several workers can finish items out of order. Ordered stages
+      and the output get the items back in source order.
+    """
+
+    def __init__(self, stages, queue_size: int = 8, source_name: str = "source"):
+        """
+        Args:
+            stages (list): Stages in processing order.
+            queue_size (int): Maximum amount of items waiting for each stage.
+            source_name (str): Name of the source in the counters.
+        """
+        self.stages = stages
+        self.queue_size = queue_size
+        self.source_name = source_name
+        self._counters = {name: {"items": 0, "busy_seconds": 0.0, "blocked_seconds": 0.0}
+                          for name in [source_name] + [stage.name for stage in stages]}
+        self._counter_lock = threading.Lock()
+
+    def run(self, source):
+        """
+        Runs the items of source through the stages.
+
+        Args:
+            source (iterable): Items to process. Iterated in a separate thread.
+
+        Yields:
+            Output of the last stage for every item, in source order.
+
+        Raises:
+            The first exception raised by the source or a stage. The other
+              threads are stopped before it is raised.
+        """
+        queues = [queue.Queue(maxsize=self.queue_size)
+                  for _ in range(len(self.stages) + 1)]
+        cancelled = threading.Event()
+        errors = []
+
+        threads = [threading.Thread(
+            target=self._read_source, args=(source, queues[0], cancelled, errors),
+            name=f"pipeline-{self.source_name}", daemon=True)]
+
+        for i, stage in enumerate(self.stages):
+            remaining_workers = [stage.workers]
+            for worker in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._run_stage,
+                    args=(stage, queues[i], queues[i + 1], remaining_workers,
+                          cancelled, errors),
+                    name=f"pipeline-{stage.name}-{worker}", daemon=True))
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            for _, item in _in_order(_iterate_queue(queues[-1], cancelled)):
+                yield item
+        finally:
+            # Also reached when the caller stops reading the output early.
+            cancelled.set()
+            for thread in threads:
+                thread.join()
+
+        if errors:
+            raise errors[0]
+
+    def stats(self):
+        """
+        Returns the counters of the source and every stage.
+
+        Returns:
+            stats (dict): For every stage the amount of processed 'items',
+              'workers', 'busy_seconds' spent in the stage function,
+              'blocked_seconds' waiting for the next stage to take the items
+              and 'capacity_fps', the items per second the stage could
+              process on its own. The stage with the lowest capacity limits
+              the throughput.
+        """
+        workers = {stage.name: stage.workers for stage in self.stages}
+        stats = {}
+
+        with self._counter_lock:
+            for name, counters in self._counters.items():
+                busy_seconds = counters["busy_seconds"]
+                stage_workers = workers.get(name, 1)
+                stats[name] = {
+                    "items": counters["items"],
+                    "workers": stage_workers,
+                    "busy_seconds": round(busy_seconds, 3),
+                    "blocked_seconds": round(counters["blocked_seconds"], 3),
+                    "capacity_fps": round(counters["items"] * stage_workers / busy_seconds, 2)
+                    if busy_seconds else None
+                }
+
+        return stats
+
+    def _read_source(self, source, output_queue, cancelled, errors):
+        iterator = iter(source)
+        sequence = 0
+
+        try:
+            while not cancelled.is_set():
+                busy_start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                self._count(self.source_name, time.perf_counter() - busy_start)
+
+                self._put(self.source_name, output_queue,
+                          (sequence, item), cancelled)
+                sequence += 1
+
+        except PipelineCancelled:
+            pass
+
+        except Exception as err:
+            errors.append(err)
+            cancelled.set()
+
+        _put_stop(output_queue, cancelled)
+
+    def _run_stage(self, stage, input_queue, output_queue, remaining_workers, cancelled, errors):
+        items = _iterate_queue(input_queue, cancelled, stop_siblings=True)
+        if stage.ordered:
+            items = _in_order(items)
+
+        try:
+            for sequence, item in items:
+                busy_start = time.perf_counter()
+                result = stage.fn(item)
+                self._count(stage.name, time.perf_counter() - busy_start)
+
+                self._put(stage.name, output_queue,
+                          (sequence, result), cancelled)
+
+        except PipelineCancelled:
+            pass
+
+        except Exception as err:
+            errors.append(err)
+            cancelled.set()
+
+        # The last worker of the stage tells the next stage to stop.
+        with self._counter_lock:
+            remaining_workers[0] -= 1
+            last_worker = remaining_workers[0] == 0
+        if last_worker:
+            _put_stop(output_queue, cancelled)
+
+    def _put(self, name, output_queue, item, cancelled):
+        blocked_start = time.perf_counter()
+
+        while True:
+            if cancelled.is_set():
+                raise PipelineCancelled()
+            try:
+                output_queue.put(item, timeout=_POLL_INTERVAL)
+                break
+            except queue.Full:
+                continue
+
+        with self._counter_lock:
+            self._counters[name]["blocked_seconds"] += time.perf_counter() - \
+                blocked_start
+
+    def _count(self, name, busy_seconds):
+        with self._counter_lock:
+            self._counters[name]["items"] += 1
+            self._counters[name]["busy_seconds"] += busy_seconds
+
+
+def _iterate_queue(input_queue, cancelled, stop_siblings=False):
+    while not cancelled.is_set():
+        try:
+            item = input_queue.get(timeout=_POLL_INTERVAL)
+        except queue.Empty:
+            continue
+
+        if item is _STOP:
+            if stop_siblings:
+                # Other workers of the same stage stop at the same marker.
+                input_queue.put(_STOP)
+            return
+        yield item
+
+
+def _in_order(items):
+    # Buffers items which arrive before their predecessors.
+    pending = {}
+    next_sequence = 0
+
+    for sequence, item in items:
+        pending[sequence] = item
+        while next_sequence in pending:
+            yield next_sequence, pending.pop(next_sequence)
+            next_sequence += 1
+
+
+def _put_stop(output_queue, cancelled):
+    while not cancelled.is_set():
+        try:
+            output_queue.put(_STOP, timeout=_POLL_INTERVAL)
+            return
+        except queue.Full:
+            continue
@@ -1,20 +1,121 @@
-from backend.model_utils import select_model, convert_blazepose_results_to_movenet_keypoints_with_scores
-from backend.tensor_utils import convert_image_to_tensor, resize_image_tensor
+from backend.model_utils import model_registry, convert_blazepose_results_to_movenet_keypoints_with_scores, convert_multipose_output, MULTIPOSE_MODELS
+from backend.tensor_utils import resize_image_tensor, decode_image
+from backend.file_handler import map_file
+from backend.cropping import CropRegionTracker, init_crop_region, to_image_coordinates
 
 
-def estimate_pose(filepath, model_name):
-    image_tensor = convert_image_to_tensor(filepath)
+def estimate_pose(image, model_name, with_boxes=False):
+    """
+    Estimates pose from decoded image.
 
-    keypoint_detector, input_size = select_model(
-        model_name)
+    Args:
+        image (numpy array): uint8 RGB image [height, width, 3].
+        model_name (str): Name of the model.
+        with_boxes (bool): Return also the bounding boxes of the people.
 
-    if "movenet" in model_name:
-        resized_image_tensor = resize_image_tensor(
-            image_tensor, input_size)
-        keypoints_with_scores = keypoint_detector(resized_image_tensor)
-    elif "blazepose" in model_name:
-        blazepose_results = keypoint_detector(filepath)
-        keypoints_with_scores = convert_blazepose_results_to_movenet_keypoints_with_scores(
-            blazepose_results)
+    Returns:
+        keypoints_with_scores [1, N, 17, 3] (float numpy array): representing the predicted keypoint
+          coordinates and scores. N is 1, except for MultiPose models.
+        boxes [1, N, 5] (float numpy array): Bounding boxes as (y_min, x_min,
+          y_max, x_max, score), None for single pose models. Only returned
+          with_boxes.
+    """
+    boxes = None
 
-    return keypoints_with_scores, image_tensor
+    with model_registry.use(model_name) as (keypoint_detector, input_size):
+        if "movenet" in model_name:
+            resized_image_tensor = resize_image_tensor(
+                image, input_size)
+            keypoints_with_scores = keypoint_detector(resized_image_tensor)
+            if model_name in MULTIPOSE_MODELS:
+                keypoints_with_scores, boxes = convert_multipose_output(
+                    keypoints_with_scores)
+        elif "blazepose" in model_name:
+            blazepose_results = keypoint_detector(image)
+            keypoints_with_scores = convert_blazepose_results_to_movenet_keypoints_with_scores(
+                blazepose_results)
+
+    if with_boxes:
+        return keypoints_with_scores, boxes
+
+    return keypoints_with_scores
+
+
+def estimate_pose_task(model_name, image=None, filepath=None, filename=None, with_boxes=False, max_pixels=None):
+    """
+    Runs estimate_pose in an inference worker process. Saved images are
+      given as filepath and decoded in the worker, so that only the path is
+      sent to it instead of the decoded image.
+
+    Args:
+        model_name (str): Name of the model.
+        image (numpy array): Decoded image, if it has no file.
+        filepath (str): Absolute path of the saved image.
+        filename (str): Filename of the image, used for checking the file type.
+        with_boxes (bool): Return also the bounding boxes of the people.
+        max_pixels (int): Optional maximum amount of pixels of the image.
+
+    Returns:
+        See estimate_pose.
+    """
+    if filepath:
+        with map_file(filepath) as image_bytes:
+            image = decode_image(image_bytes, filename, max_pixels)
+
+    return estimate_pose(image, model_name, with_boxes=with_boxes)
+
+
+def preload_models(model_names):
+    """
+    Loads the models before the first prediction. Used as initializer of
+      the inference worker processes.
+    """
+    model_registry.preload(model_names)
+
+
+def create_sequence_estimator(model_name, crop_tracking=True, estimate=None):
+    """
+    Creates pose estimator for consecutive frames of one video.
+
+    With crop_tracking, single pose MoveNet models crop every frame to the
+      region around the person found in the previous frame. Other models
+      estimate every frame on its own from the frame padded to a square.
+      The keypoints are in coordinates normalized to the frame either way,
+      not to the padded square.
+
+    Args:
+        model_name (str): Name of the model.
+        crop_tracking (bool): Track the crop region between frames.
+        estimate (function): Runs estimate_pose for the frames which are not
+          tracked, for example in an inference worker process. Defaults
+          to estimate_pose.
+
+    Returns:
+        estimator (function): Gets uint8 RGB image [height, width, 3] and
+          returns keypoints_with_scores [1, 1, 17, 3] and the crop region used,
+          None without crop region tracking.
+        sequential (bool): The frames need to be given to the estimator one
+          at a time in frame order.
+    """
+    estimate = estimate or estimate_pose
+
+    if crop_tracking and "movenet" in model_name and model_name not in MULTIPOSE_MODELS:
+        with model_registry.use(model_name) as (_, input_size):
+            pass
+
+        def keypoint_detector(input_image):
+            # Model is looked up for every frame, so it can be evicted and
+            #   loaded again during a long video.
+            with model_registry.use(model_name) as (keypoint_detector, _):
+                return keypoint_detector(input_image)
+
+        return CropRegionTracker(keypoint_detector, input_size), True
+
+    def estimate_letterboxed(image):
+        # MoveNet letterboxes the frame and BlazePose pads it to a square, so
+        #   the keypoints are relative to the square around the frame.
+        keypoints_with_scores = estimate(image, model_name)
+        return to_image_coordinates(
+            keypoints_with_scores, init_crop_region(*image.shape[:2])), None
+
+    return estimate_letterboxed, False
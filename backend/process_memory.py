@@ -0,0 +1,64 @@
+import os
+import resource
+import sys
+
+# Fields of /proc/<pid>/smaps_rollup which are reported, in kB.
+_SMAPS_FIELDS = {
+    "Rss": "rss_mb",
+    "Pss": "pss_mb",
+    "Shared_Clean": "shared_clean_mb",
+    "Shared_Dirty": "shared_dirty_mb",
+    "Private_Clean": "private_clean_mb",
+    "Private_Dirty": "private_dirty_mb"
+}
+
+
+def read_process_memory(pid="self"):
+    """
+    Reads memory usage of a process.
+
+    On Linux the usage is read from /proc/<pid>/smaps_rollup. Pages shared
+      copy-on-write with the parent process or other workers count in full
+      to 'rss_mb', but are divided between the processes sharing them in
+      'pss_mb', so the 'pss_mb' of all workers adds up to their real memory use.
+
+    Args:
+        pid (int or str): Process id, 'self' for the current process.
+
+    Returns:
+        memory (dict): Memory usage in megabytes. Only 'max_rss_mb' of the
+          current process is known on platforms without /proc.
+    """
+    memory = {}
+    smaps_path = f"/proc/{pid}/smaps_rollup"
+
+    if os.path.isfile(smaps_path):
+        with open(smaps_path) as f:
+            for line in f:
+                field, _, value = line.partition(":")
+                if field in _SMAPS_FIELDS:
+                    memory[_SMAPS_FIELDS[field]] = round(
+                        int(value.split()[0]) / 1024, 1)
+
+    if pid == "self":
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS.
+        memory["max_rss_mb"] = round(
+            max_rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+    return memory
+
+
+def current_rss_mb():
+    """
+    Returns resident memory of the current process in megabytes. Cheaper than
+      read_process_memory(), so it can be read after every task.
+    """
+    statm_path = "/proc/self/statm"
+
+    if os.path.isfile(statm_path):
+        with open(statm_path) as f:
+            resident_pages = int(f.read().split()[1])
+        return round(resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+
+    return read_process_memory()["max_rss_mb"]
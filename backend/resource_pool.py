@@ -0,0 +1,135 @@
+import threading
+
+from contextlib import contextmanager
+
+
+class ResourcePool:
+    """
+    Thread-safe pool of reusable resources, for example model interpreters.
+
+    Resources are created lazily with the factory function until the pool
+      size is reached. After that callers wait until a resource is checked
+      back in.
+    """
+
+    def __init__(self, factory, size: int, on_checkin=None, on_discard=None):
+        """
+        Args:
+            factory (function): Function which creates a new resource.
+            size (int): Maximum amount of resources in the pool.
+            on_checkin (function): Optional function called with the resource
+              when it is returned to the pool. If it raises, the resource
+              is discarded.
+            on_discard (function): Optional function called with the resource
+              when it is dropped from the pool, for example to close it.
+        """
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+
+        self.factory = factory
+        self.size = size
+        self.on_checkin = on_checkin
+        self.on_discard = on_discard
+        self._idle = []
+        self._created = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def checkout(self, timeout=None):
+        """
+        Checks out a resource from the pool and returns it when the block exits.
+
+        Args:
+            timeout (float): Seconds to wait for a free resource. Waits forever if None.
+
+        Raises:
+            TimeoutError: If no resource became free within the timeout.
+        """
+        resource = self._acquire(timeout)
+        try:
+            yield resource
+        finally:
+            self._release(resource)
+
+    def close(self):
+        """
+        Drops idle resources. Resources in use are dropped when checked in.
+        """
+        with self._condition:
+            self._closed = True
+            self._created -= len(self._idle)
+            discarded = self._idle
+            self._idle = []
+            self._condition.notify_all()
+
+        for resource in discarded:
+            self._discard(resource)
+
+    def reinitialize_after_fork(self):
+        """
+        Forgets the resources created before the process was forked. They can
+          depend on threads of the parent process, so they are dropped
+          without closing and new ones are created on demand.
+        """
+        self._idle = []
+        self._created = 0
+        self._condition = threading.Condition()
+
+    def stats(self):
+        with self._condition:
+            return {
+                "size": self.size,
+                "created": self._created,
+                "idle": len(self._idle),
+                "in_use": self._created - len(self._idle)
+            }
+
+    def _acquire(self, timeout):
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise Exception("Resource pool is closed")
+                if self._idle:
+                    return self._idle.pop()
+                if self._created < self.size:
+                    self._created += 1
+                    break
+                if not self._condition.wait(timeout):
+                    raise TimeoutError("No free resource in pool")
+
+        # Resource is created outside the lock so others can check in meanwhile.
+        try:
+            return self.factory()
+        except Exception:
+            with self._condition:
+                self._created -= 1
+                self._condition.notify()
+            raise
+
+    def _release(self, resource):
+        reusable = True
+        if self.on_checkin:
+            try:
+                self.on_checkin(resource)
+            except Exception as err:
+                print(f"- Discarding pooled resource: '{err}'")
+                reusable = False
+
+        with self._condition:
+            if reusable and not self._closed:
+                self._idle.append(resource)
+                resource = None
+            else:
+                self._created -= 1
+            self._condition.notify()
+
+        if resource is not None:
+            self._discard(resource)
+
+    def _discard(self, resource):
+        if self.on_discard:
+            try:
+                self.on_discard(resource)
+            except Exception as err:
+                print(f"- Error discarding pooled resource: '{err}'")
@@ -0,0 +1,94 @@
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class PredictionCache:
+    """
+    Cache of pose estimation results keyed by (content hash, model name,
+      model version).
+
+    Results are looked up from an in-memory LRU tier first and then from the
+      optional persistent tier. Concurrent requests for the same key are
+      coalesced, so that only one of them runs the inference and the others
+      wait for its result.
+    """
+
+    def __init__(self, max_size: int = 1024, persistent_lookup=None):
+        """
+        Args:
+            max_size (int): Maximum amount of results in memory. 0 disables the memory tier.
+            persistent_lookup (function): Optional function which returns stored
+              result for the key or None.
+        """
+        self.max_size = max_size
+        self.persistent_lookup = persistent_lookup
+        self.hits = {"memory": 0, "persistent": 0}
+        self.misses = 0
+        self._results = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns cached result for the key or computes it.
+
+        Args:
+            key (tuple): (content_hash, model_name, model_version)
+            compute (function): Function which computes the result.
+
+        Returns:
+            result: Cached or computed result.
+            source (str): 'memory', 'persistent' or 'computed'.
+        """
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                self.hits["memory"] += 1
+                return self._results[key], "memory"
+
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+
+        if not leader:
+            # Same key is being computed by another request.
+            return future.result(), "memory"
+
+        try:
+            result, source = self._lookup_or_compute(key, compute)
+        except Exception as err:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(err)
+            raise
+
+        with self._lock:
+            self._store(key, result)
+            del self._in_flight[key]
+        future.set_result(result)
+
+        return result, source
+
+    def _lookup_or_compute(self, key, compute):
+        if self.persistent_lookup:
+            result = self.persistent_lookup(key)
+            if result is not None:
+                self.hits["persistent"] += 1
+                return result, "persistent"
+
+        self.misses += 1
+        return compute(), "computed"
+
+    def _store(self, key, result):
+        # Expects self._lock to be held by the caller.
+        if self.max_size <= 0:
+            return
+
+        self._results[key] = result
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_size:
+            self._results.popitem(last=False)
@@ -1,24 +1,112 @@
 import datetime
 from bson.objectid import ObjectId
 
+DATE_FORMAT = "%Y-%m-%d"
 
-def calculate_stats(items):
-    filename_count = {}
-    model_count = {}
+# Items without filename or model name are not counted in the amounts.
+COUNTED_ITEMS_FILTER = {
+    "filename": {"$nin": [None, ""]},
+    "model_name": {"$nin": [None, ""]}
+}
+
+
+def date_range_filter(start=None, end=None):
+    """
+    Creates filter for items created within the date range. Creation time is
+      read from the '_id', so the filter is a range on the '_id' index.
+
+    Args:
+        start (date): First date of the range, None for no lower bound.
+        end (date): Last date of the range, None for no upper bound.
+
+    Returns:
+        filter (dict): MongoDB filter.
+    """
+    id_range = {}
+
+    if start:
+        id_range["$gte"] = ObjectId.from_datetime(_utc_midnight(start))
+    if end:
+        id_range["$lt"] = ObjectId.from_datetime(
+            _utc_midnight(end + datetime.timedelta(days=1)))
+
+    return {"_id": id_range} if id_range else {}
+
+
+def stats_pipeline(filter, top=None, with_dates=True):
+    """
+    Creates aggregation pipeline which counts the items by model, filename
+      and creation date in one pass in the database.
+
+    Args:
+        filter (dict): Filter for the counted items.
+        top (int): Return only this many most common models and filenames.
+        with_dates (bool): Count dates in the pipeline. Needs MongoDB 4.0.
+
+    Returns:
+        pipeline (list): Pipeline which returns one document of facets.
+    """
+    facets = {
+        "total": [{"$count": "count"}],
+        "models": _count_by("$model_name", top),
+        "images": _count_by("$filename", top)
+    }
+
+    if with_dates:
+        facets["dates"] = _count_by({
+            "$dateToString": {
+                "format": DATE_FORMAT,
+                "date": {"$toDate": "$_id"}
+            }
+        })
+
+    return [{"$match": filter}, {"$facet": facets}]
+
+
+def _count_by(key, top=None):
+    stages = [
+        {"$match": COUNTED_ITEMS_FILTER},
+        {"$group": {"_id": key, "count": {"$sum": 1}}},
+        {"$sort": {"count": -1, "_id": 1}}
+    ]
+    if top:
+        stages.append({"$limit": top})
+
+    return stages
+
+
+def read_stats(facets):
+    """
+    Converts result of the stats pipeline to amounts by key.
+
+    Returns:
+        total_results (int): Amount of items.
+        model_amounts (dict): Amount of items by model name.
+        image_amounts (dict): Amount of items by filename.
+        prediction_dates (dict): Amount of items by creation date.
+    """
+    total = facets["total"][0]["count"] if facets["total"] else 0
+
+    def amounts(facet):
+        return {group["_id"]: group["count"] for group in facets.get(facet, [])}
+
+    return total, amounts("models"), amounts("images"), amounts("dates")
+
+
+def count_prediction_dates(object_ids):
+    """
+    Counts items by creation date read from their '_id'. Used with MongoDB
+      versions which can not convert '_id' to date in the pipeline.
+    """
     date_count = {}
 
-    for item in items:
-        filename = item.get("filename")
-        model_name = item.get("model_name")
-        obj_id = ObjectId(item.get("_id"))
+    for obj_id in object_ids:
+        date = obj_id.generation_time.strftime(DATE_FORMAT)
+        date_count[date] = date_count.get(date, 0) + 1
 
-        if filename and model_name and obj_id:
-            filename_count[filename] = filename_count.get(filename, 0) + 1
-            model_count[model_name] = model_count.get(model_name, 0) + 1
+    return date_count
 
-            timestamp = obj_id.generation_time.timestamp()
-            dt_object = datetime.datetime.fromtimestamp(timestamp)
-            date = dt_object.strftime("%Y-%m-%d")
-            date_count[date] = date_count.get(date, 0) + 1
 
-    return model_count, filename_count, date_count
+def _utc_midnight(date):
+    return datetime.datetime(date.year, date.month, date.day,
+                             tzinfo=datetime.timezone.utc)
@@ -0,0 +1,171 @@
+from collections import Counter
+
+from bson.objectid import ObjectId
+
+import backend.database
+from backend.stats import DATE_FORMAT
+
+COUNTER_KIND_TOTAL = "total"
+COUNTER_KIND_MODEL = "model"
+COUNTER_KIND_IMAGE = "image"
+COUNTER_KIND_DATE = "date"
+
+# Written by rebuild(). Counters without it were never counted from the
+#   predictions, for example on a database upgraded with existing predictions.
+_BUILT_MARKER_ID = {"kind": "built", "key": "built"}
+
+
+class StatsCounters:
+    """
+    Materialized prediction counts, kept up to date when predictions are
+      saved, updated or deleted.
+
+    Every count is its own small document
+      {"_id": {"kind": kind, "key": key}, "count": count}, which is changed
+      with an atomic $inc. Reading the stats reads only these documents, so
+      it does not depend on the amount of predictions.
+    """
+
+    def __init__(self, collection: str):
+        self.collection = collection
+
+    def ensure_indexes(self):
+        backend.database.mongo.db[self.collection].create_index(
+            [("_id.kind", 1), ("count", -1)])
+
+    def add(self, items):
+        """
+        Counts saved items. Items need to have their '_id' set.
+        """
+        self._increment(items, 1)
+
+    def remove(self, items):
+        """
+        Removes deleted items from the counts.
+        """
+        self._increment(items, -1)
+
+    def is_built(self):
+        """
+        Returns True if the counters have been rebuilt from the predictions.
+        """
+        return backend.database.mongo.db[self.collection].find_one(
+            {"_id": _BUILT_MARKER_ID}) is not None
+
+    def read(self, top=None):
+        """
+        Returns the counts.
+
+        Args:
+            top (int): Return only this many most common models and filenames.
+
+        Returns:
+            total_results (int): Amount of items.
+            model_amounts (dict): Amount of items by model name.
+            image_amounts (dict): Amount of items by filename.
+            prediction_dates (dict): Amount of items by creation date.
+        """
+        collection = backend.database.mongo.db[self.collection]
+
+        def amounts(kind, limit=None):
+            cursor = collection.find(
+                {"_id.kind": kind, "count": {"$gt": 0}}).sort([("count", -1), ("_id.key", 1)])
+            if limit:
+                cursor = cursor.limit(limit)
+            return {counter["_id"]["key"]: counter["count"] for counter in cursor}
+
+        total = collection.find_one(
+            {"_id": {"kind": COUNTER_KIND_TOTAL, "key": COUNTER_KIND_TOTAL}})
+
+        return (total["count"] if total else 0,
+                amounts(COUNTER_KIND_MODEL, top),
+                amounts(COUNTER_KIND_IMAGE, top),
+                amounts(COUNTER_KIND_DATE))
+
+    def rebuild(self, stats):
+        """
+        Replaces all counts with the given stats. Changes saved while the
+          stats were counted can be missed, so check() is worth running after.
+
+        Args:
+            stats (tuple): total_results, model_amounts, image_amounts and
+              prediction_dates counted from the predictions.
+        """
+        print("Rebuilding stats counters")
+        collection = backend.database.mongo.db[self.collection]
+
+        counters = _counters_from_stats(stats)
+        collection.delete_many({})
+        collection.insert_many(
+            [{"_id": {"kind": kind, "key": key}, "count": count}
+             for (kind, key), count in counters.items()] +
+            [{"_id": _BUILT_MARKER_ID}])
+
+        print(f"- Saved {len(counters)} counters")
+
+    def check(self, stats):
+        """
+        Compares the counts to the given stats.
+
+        Args:
+            stats (tuple): total_results, model_amounts, image_amounts and
+              prediction_dates counted from the predictions.
+
+        Returns:
+            differences (dict): (kind, key): (counter, expected) for every
+              count which differs. Empty if the counters are consistent.
+        """
+        expected = _counters_from_stats(stats)
+        actual = _counters_from_stats(self.read())
+
+        return {counter: (actual.get(counter, 0), expected.get(counter, 0))
+                for counter in set(expected) | set(actual)
+                if actual.get(counter, 0) != expected.get(counter, 0)}
+
+    def _increment(self, items, amount):
+        counters = Counter()
+        for item in items:
+            for counter in _item_counters(item):
+                counters[counter] += amount
+
+        if not counters:
+            return
+
+        # Items of one change share most of their counters, so there are
+        #   only a few updates even for bulk inserts.
+        collection = backend.database.mongo.db[self.collection]
+        for (kind, key), count in counters.items():
+            if count:
+                collection.update_one({"_id": {"kind": kind, "key": key}},
+                                      {"$inc": {"count": count}}, upsert=True)
+
+        if amount < 0:
+            collection.delete_many({"count": {"$lte": 0}})
+
+
+def _item_counters(item):
+    counters = [(COUNTER_KIND_TOTAL, COUNTER_KIND_TOTAL)]
+
+    # Same items are left out of the amounts as in the stats pipeline.
+    if item.get("filename") and item.get("model_name"):
+        date = ObjectId(item["_id"]).generation_time.strftime(DATE_FORMAT)
+        counters += [(COUNTER_KIND_MODEL, item["model_name"]),
+                     (COUNTER_KIND_IMAGE, item["filename"]),
+                     (COUNTER_KIND_DATE, date)]
+
+    return counters
+
+
+def _counters_from_stats(stats):
+    total, model_amounts, image_amounts, prediction_dates = stats
+
+    counters = {}
+    if total:
+        counters[(COUNTER_KIND_TOTAL, COUNTER_KIND_TOTAL)] = total
+    for kind, amounts in [(COUNTER_KIND_MODEL, model_amounts),
+                          (COUNTER_KIND_IMAGE, image_amounts),
+                          (COUNTER_KIND_DATE, prediction_dates)]:
+        for key, count in amounts.items():
+            counters[(kind, key)] = count
+
+    return counters
@@ -1,32 +1,119 @@
 import os
+import cv2
+import struct
+
+import numpy as np
 import tensorflow as tf
 
+SUPPORTED_IMAGE_EXTENSIONS = (".jpeg", ".jpg", ".png")
+SUPPORTED_VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv", ".webm")
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# JPEG start of frame markers, which hold the image size
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                    0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
 
-def convert_image_to_tensor(image_path: str):
+
+def read_image_size(header):
     """
-    Converts JPG or PNG image file to TensorFlow tensor.
+    Reads image size from the beginning of PNG or JPEG file without decoding
+      the image.
 
     Args:
-        image_path (str): Absolute path to image
+        header (bytes-like): First bytes of the file.
 
     Returns:
-        image_tensor (tensor): Tensorflow tensor [x_res, y_res, 3]
+        size (tuple): (width, height), None if the header is not PNG or
+          JPEG or the size is not within the given bytes.
     """
+    header = bytes(header)
 
-    image = tf.io.read_file(image_path)
+    if header.startswith(PNG_SIGNATURE):
+        if len(header) >= 24 and header[12:16] == b"IHDR":
+            return struct.unpack(">II", header[16:24])
+        return None
 
-    print(f"Converting image '{os.path.basename(image_path)}' to tensor")
+    if not header.startswith(b"\xff\xd8"):
+        return None
 
-    if image_path.lower().endswith((".jpeg", ".jpg")):
-        image_tensor = tf.image.decode_jpeg(image, channels=3)
-    elif image_path.lower().endswith(".png"):
-        image_tensor = tf.image.decode_png(image, channels=3)
-    else:
+    i = 2
+    while i + 4 <= len(header):
+        if header[i] != 0xFF:
+            return None
+
+        marker = header[i + 1]
+        if marker == 0xFF:
+            # Fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            # Markers without length
+            i += 2
+            continue
+
+        if marker in JPEG_SOF_MARKERS:
+            if i + 9 > len(header):
+                return None
+            height, width = struct.unpack(">HH", header[i + 5:i + 9])
+            return width, height
+
+        segment_length = struct.unpack(">H", header[i + 2:i + 4])[0]
+        i += 2 + segment_length
+
+    return None
+
+
+def decode_image(image_bytes, filename: str, max_pixels: int = None):
+    """
+    Decodes JPG or PNG image bytes to RGB image array. The decoded array is
+      the single frame used through the whole pose estimation pipeline.
+
+    Args:
+        image_bytes (bytes-like): Encoded image.
+        filename (str): Filename of the image, used for checking the file type.
+        max_pixels (int): Optional maximum amount of pixels, checked from
+          the header before decoding.
+
+    Returns:
+        image (numpy array): uint8 array [height, width, 3] in RGB order.
+    """
+    print(f"Decoding image '{os.path.basename(filename)}'")
+
+    if not filename.lower().endswith(SUPPORTED_IMAGE_EXTENSIONS):
         raise Exception("Unsupported file type")
 
+    if max_pixels:
+        size = read_image_size(memoryview(image_bytes)[:64 * 1024])
+        if size and size[0] * size[1] > max_pixels:
+            raise Exception(
+                f"Image has more than {max_pixels} pixels")
+
+    image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8),
+                         cv2.IMREAD_COLOR)
+    if image is None:
+        raise Exception("Unable to decode image")
+
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
     print("- Done")
 
-    return image_tensor
+    return image
+
+
+def load_image(image_path: str):
+    """
+    Reads and decodes JPG or PNG image file to RGB image array.
+
+    Args:
+        image_path (str): Absolute path to image
+
+    Returns:
+        image (numpy array): uint8 array [height, width, 3] in RGB order.
+    """
+    with open(image_path, "rb") as f:
+        image_bytes = f.read()
+
+    return decode_image(image_bytes, image_path)
 
 
 def resize_image_tensor(image_tensor, input_size):
@@ -35,7 +122,7 @@ def resize_image_tensor(image_tensor, input_size):
       Adds black bars to image to create a square output.
 
     Args:
-        image_tensor (tensor): Tensorflow tensor.
+        image_tensor (tensor, numpy array): Image [height, width, 3].
         input_size (int, tuple): Size what the resized tensor should be.
 
     Returns:
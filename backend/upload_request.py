@@ -0,0 +1,57 @@
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from backend.file_handler import BlobUpload, SUPPORTED_ARCHIVE_EXTENSIONS
+from backend.tensor_utils import read_image_size, SUPPORTED_VIDEO_EXTENSIONS
+
+
+class StreamingUploadRequest(Request):
+    """
+    Request which streams uploaded files straight into the blob store.
+
+    Every uploaded file is hashed and written to disk while the request body
+      is received, instead of being spooled by Werkzeug and copied again when
+      saved. Files larger than max_file_size and images with more than
+      max_image_pixels pixels are rejected as soon as it is known, with
+      413 Request Entity Too Large. Videos and archives of images have their
+      own size limits, max_video_file_size and max_archive_file_size.
+    """
+
+    max_file_size = None
+    max_video_file_size = None
+    max_archive_file_size = None
+    max_image_pixels = None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if filename and filename.lower().endswith(SUPPORTED_VIDEO_EXTENSIONS):
+            upload = BlobUpload(max_size=self.max_video_file_size)
+        elif filename and filename.lower().endswith(SUPPORTED_ARCHIVE_EXTENSIONS):
+            upload = BlobUpload(max_size=self.max_archive_file_size)
+        else:
+            upload = BlobUpload(
+                max_size=self.max_file_size,
+                header_check=self._check_image_header if self.max_image_pixels else None)
+
+        # Uploads of a rejected request never reach request.files, so they
+        #   are tracked here for removing their temporary files.
+        self.__dict__.setdefault("_blob_uploads", []).append(upload)
+
+        return upload
+
+    def close(self):
+        super().close()
+
+        for upload in self.__dict__.get("_blob_uploads", []):
+            upload.close()
+
+    def _check_image_header(self, header):
+        size = read_image_size(header)
+        if not size:
+            return False
+
+        width, height = size
+        if width * height > self.max_image_pixels:
+            raise RequestEntityTooLarge(
+                f"Image is {width}x{height} pixels, maximum is {self.max_image_pixels} pixels")
+
+        return True
@@ -0,0 +1,96 @@
+import cv2
+
+# Codec of the annotated videos. Supported by every OpenCV build without
+#   extra encoders.
+ANNOTATED_VIDEO_FOURCC = "mp4v"
+
+
+class VideoNotReadable(Exception):
+    pass
+
+
+def open_video(filepath):
+    """
+    Opens video for decoding it frame by frame.
+
+    Args:
+        filepath (str): Path of the video file.
+
+    Returns:
+        capture (cv2.VideoCapture): Opened video. Needs to be released.
+        info (dict): 'fps', 'frame_count', 'width' and 'height' as reported by
+          the container. 'frame_count' is 0 when it is not known.
+    """
+    capture = cv2.VideoCapture(filepath)
+
+    if not capture.isOpened():
+        capture.release()
+        raise VideoNotReadable("Video could not be opened")
+
+    info = {
+        "fps": capture.get(cv2.CAP_PROP_FPS) or 0.0,
+        "frame_count": max(int(capture.get(cv2.CAP_PROP_FRAME_COUNT)), 0),
+        "width": int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        "height": int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    }
+
+    return capture, info
+
+
+def iterate_video_frames(capture, every_nth=1, max_frames=None):
+    """
+    Decodes frames one at a time, so only the current frame is in memory
+      no matter how long the video is.
+
+    Args:
+        capture (cv2.VideoCapture): Opened video.
+        every_nth (int): Yield only every nth frame. Skipped frames are
+          grabbed but not converted.
+        max_frames (int): Stop after yielding this many frames. None for no limit.
+
+    Yields:
+        frame_index (int): Index of the frame in the video.
+        timestamp_ms (float): Position of the frame in the video.
+        frame (numpy array): uint8 RGB image [height, width, 3].
+    """
+    frame_index = -1
+    yielded = 0
+
+    while max_frames is None or yielded < max_frames:
+        if not capture.grab():
+            break
+        frame_index += 1
+
+        if frame_index % every_nth:
+            continue
+
+        timestamp_ms = capture.get(cv2.CAP_PROP_POS_MSEC)
+        ok, frame = capture.retrieve()
+        if not ok:
+            break
+
+        yielded += 1
+        yield frame_index, timestamp_ms, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+
+class AnnotatedVideoWriter:
+    """
+    Encodes RGB frames to a video file as they are produced.
+    """
+
+    def __init__(self, filepath: str, fps: float, width: int, height: int):
+        self.size = (width, height)
+        self._writer = cv2.VideoWriter(
+            filepath, cv2.VideoWriter_fourcc(*ANNOTATED_VIDEO_FOURCC),
+            fps or 30.0, self.size)
+
+        if not self._writer.isOpened():
+            raise Exception("Annotated video could not be created")
+
+    def write(self, frame):
+        if (frame.shape[1], frame.shape[0]) != self.size:
+            frame = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        self._writer.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+
+    def release(self):
+        self._writer.release()
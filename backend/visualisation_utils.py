@@ -2,13 +2,9 @@ import cv2
 import os
 import io
 
-from matplotlib import pyplot as plt
-from matplotlib.collections import LineCollection
 from PIL import Image as im
 
-import matplotlib.patches as patches
 import numpy as np
-import tensorflow as tf
 
 
 # Dictionary that maps from joint names to keypoint indices.
@@ -54,6 +50,52 @@ KEYPOINT_EDGE_INDS_TO_COLOR = {
     (14, 16): 'c'
 }
 
+# Keypoint colors used when predictions of several models are drawn on one image.
+COMPARISON_KEYPOINT_COLORS = [
+    '#FF1493',
+    '#00FF00',
+    '#FF8C00',
+    '#1E90FF',
+    '#FFFF00',
+    '#FF0000',
+    '#FFFFFF',
+    '#8A2BE2'
+]
+
+
+# RGB values of the matplotlib color names used in the visualizations.
+MATPLOTLIB_COLOR_TO_RGB = {
+    'm': (191, 0, 191),
+    'c': (0, 191, 191),
+    'y': (191, 191, 0),
+    'b': (0, 0, 255)
+}
+
+KEYPOINT_COLOR = '#FF1493'
+
+# Overlays are drawn at this size. Line widths and keypoint sizes are given
+#   in pixels at this size and scaled with the image height.
+DISPLAY_SIZE = 1200
+EDGE_LINE_WIDTH = 6
+KEYPOINT_RADIUS = 5
+CROP_REGION_LINE_WIDTH = 1
+
+# Changing any of these changes the rendered overlays, so they are part of
+#   the overlay cache key.
+OVERLAY_RENDER_SETTINGS = {
+    "renderer": "opencv",
+    "display_size": DISPLAY_SIZE,
+    "edge_line_width": EDGE_LINE_WIDTH,
+    "keypoint_radius": KEYPOINT_RADIUS,
+    "keypoint_threshold": 0.11
+}
+
+_EDGE_INDS = np.array(list(KEYPOINT_EDGE_INDS_TO_COLOR.keys()))
+_EDGE_COLORS = np.array(list(KEYPOINT_EDGE_INDS_TO_COLOR.values()))
+
+# cv2 drawing functions take integer coordinates with this many fractional bits.
+_DRAW_SHIFT = 4
+
 
 def _keypoints_and_edges_for_display(
         keypoints_with_scores,
@@ -62,13 +104,14 @@ def _keypoints_and_edges_for_display(
         keypoint_threshold=0.11
 ):
     """
-    Function done by TensorFlow team.
+    Function done by TensorFlow team. Vectorized by me.
 
     Returns high confidence keypoints and edges for visualization.    
 
     Args:
-      keypoints_with_scores: A numpy array with shape [1, 1, 17, 3] representing
-        the keypoint coordinates and scores returned from the MoveNet model.
+      keypoints_with_scores: A numpy array with shape [1, N, 17, 3] representing
+        the keypoint coordinates and scores of N people returned from the
+        MoveNet model.
       height: height of the image in pixels.
       width: width of the image in pixels.
       keypoint_threshold: minimum confidence score for a keypoint to be
@@ -80,41 +123,23 @@ def _keypoints_and_edges_for_display(
         * the coordinates of all skeleton edges of all detected entities;
         * the colors in which the edges should be plotted.
     """
+    _, num_instances, _, _ = keypoints_with_scores.shape
+    kpts = keypoints_with_scores[0, :num_instances]
+
+    # [instances, 17, 2] in (x, y) pixel order
+    kpts_absolute_xy = np.stack(
+        [width * kpts[..., 1], height * kpts[..., 0]], axis=-1)
+    kpts_above_thresh = kpts[..., 2] > keypoint_threshold
+
+    keypoints_xy = kpts_absolute_xy[kpts_above_thresh]
+
+    # Edge is shown when both of its keypoints are above the threshold.
+    edges_above_thresh = kpts_above_thresh[:, _EDGE_INDS[:, 0]] & \
+        kpts_above_thresh[:, _EDGE_INDS[:, 1]]
+    edges_xy = kpts_absolute_xy[:, _EDGE_INDS][edges_above_thresh]
+    edge_colors = _EDGE_COLORS[np.nonzero(edges_above_thresh)[1]].tolist()
 
-    keypoints_all = []
-    keypoint_edges_all = []
-    edge_colors = []
-    num_instances, _, _, _ = keypoints_with_scores.shape
-    for idx in range(num_instances):
-        kpts_x = keypoints_with_scores[0, idx, :, 1]
-        kpts_y = keypoints_with_scores[0, idx, :, 0]
-        kpts_scores = keypoints_with_scores[0, idx, :, 2]
-        kpts_absolute_xy = np.stack(
-            [width * np.array(kpts_x), height * np.array(kpts_y)], axis=-1)
-        kpts_above_thresh_absolute = kpts_absolute_xy[
-            kpts_scores > keypoint_threshold, :]
-        keypoints_all.append(kpts_above_thresh_absolute)
-
-        for edge_pair, color in KEYPOINT_EDGE_INDS_TO_COLOR.items():
-            if (kpts_scores[edge_pair[0]] > keypoint_threshold and
-                    kpts_scores[edge_pair[1]] > keypoint_threshold):
-                x_start = kpts_absolute_xy[edge_pair[0], 0]
-                y_start = kpts_absolute_xy[edge_pair[0], 1]
-                x_end = kpts_absolute_xy[edge_pair[1], 0]
-                y_end = kpts_absolute_xy[edge_pair[1], 1]
-                line_seg = np.array([[x_start, y_start], [x_end, y_end]])
-                keypoint_edges_all.append(line_seg)
-                edge_colors.append(color)
-    if keypoints_all:
-        keypoints_xy = np.concatenate(keypoints_all, axis=0)
-    else:
-        keypoints_xy = np.zeros((0, 17, 2))
-
-    if keypoint_edges_all:
-        edges_xy = np.stack(keypoint_edges_all, axis=0)
-    else:
-        edges_xy = np.zeros((0, 2, 2))
-    return keypoints_xy, edges_xy, edge_colors
+    return keypoints_xy, edges_xy.reshape(-1, 2, 2), edge_colors
 
 
 def draw_prediction_on_image(
@@ -122,10 +147,12 @@ def draw_prediction_on_image(
         keypoints_with_scores,
         crop_region=None,
         close_figure=False,
-        output_image_height=None
+        output_image_height=None,
+        extra_predictions=None
 ):
     """
-    Function done by TensorFlow team.
+    Function done by TensorFlow team. Rewritten by me to draw directly on the
+      image with OpenCV instead of rendering a matplotlib figure.
 
     Draws the keypoint predictions on image.
 
@@ -138,110 +165,182 @@ def draw_prediction_on_image(
         of the crop region in normalized coordinates (see the init_crop_region
         function below for more detail). If provided, this function will also
         draw the bounding box on the image.
+      close_figure: Not used. Kept for compatibility with the matplotlib version.
       output_image_height: An integer indicating the height of the output image.
         Note that the image aspect ratio will be the same as the input image.
+      extra_predictions: Optional list of (keypoints_with_scores, keypoint_color)
+        pairs drawn on the same image, for example predictions of other models.
 
     Returns:
       A numpy array with shape [out_height, out_width, channel] representing the
       image overlaid with keypoint predictions.
     """
     height, width, channel = image.shape
-    aspect_ratio = float(width) / height
-    fig, ax = plt.subplots(figsize=(12 * aspect_ratio, 12))
-
-    # To remove the huge white borders
-    fig.tight_layout(pad=0)
-    ax.margins(0)
-    ax.set_yticklabels([])
-    ax.set_xticklabels([])
-    plt.axis('off')
-
-    im = ax.imshow(image)
-
-    line_segments = LineCollection([], linewidths=(4), linestyle='solid')
-    ax.add_collection(line_segments)
-    # Turn off tick labels
-    scat = ax.scatter([], [], s=60, color='#FF1493', zorder=3)
-
-    (keypoint_locs, keypoint_edges,
-     edge_colors) = _keypoints_and_edges_for_display(
-         keypoints_with_scores, height, width)
-
-    line_segments.set_segments(keypoint_edges)
-    line_segments.set_color(edge_colors)
-    if keypoint_edges.shape[0]:
-        line_segments.set_segments(keypoint_edges)
-        line_segments.set_color(edge_colors)
-    if keypoint_locs.shape[0]:
-        scat.set_offsets(keypoint_locs)
+    output_image = np.array(image, dtype=np.uint8)
+
+    scale = height / DISPLAY_SIZE
+    line_width = max(1, round(EDGE_LINE_WIDTH * scale))
+    keypoint_radius = max(1, round(KEYPOINT_RADIUS * scale))
+
+    predictions = [(keypoints_with_scores, KEYPOINT_COLOR)] + \
+        list(extra_predictions or [])
+    all_keypoints = []
+
+    for prediction_keypoints, keypoint_color in predictions:
+        (keypoint_locs, keypoint_edges,
+         edge_colors) = _keypoints_and_edges_for_display(
+             prediction_keypoints, height, width)
+
+        edges_fixed = _to_fixed_point(keypoint_edges)
+        edge_colors = np.array(edge_colors)
+        for color in np.unique(edge_colors):
+            cv2.polylines(
+                output_image, list(edges_fixed[edge_colors == color]),
+                isClosed=False, color=MATPLOTLIB_COLOR_TO_RGB[color],
+                thickness=line_width, lineType=cv2.LINE_AA, shift=_DRAW_SHIFT)
+
+        all_keypoints.append((keypoint_locs, _color_to_rgb(keypoint_color)))
+
+    # Keypoints are drawn on top of all edges.
+    for keypoint_locs, keypoint_color in all_keypoints:
+        for x, y in _to_fixed_point(keypoint_locs):
+            cv2.circle(output_image, (int(x), int(y)), keypoint_radius << _DRAW_SHIFT,
+                       keypoint_color, thickness=-1, lineType=cv2.LINE_AA,
+                       shift=_DRAW_SHIFT)
 
     if crop_region is not None:
         xmin = max(crop_region['x_min'] * width, 0.0)
         ymin = max(crop_region['y_min'] * height, 0.0)
-        rec_width = min(crop_region['x_max'], 0.99) * width - xmin
-        rec_height = min(crop_region['y_max'], 0.99) * height - ymin
-        rect = patches.Rectangle(
-            (xmin, ymin), rec_width, rec_height,
-            linewidth=1, edgecolor='b', facecolor='none')
-        ax.add_patch(rect)
-
-    fig.canvas.draw()
-    image_from_plot = np.frombuffer(fig.canvas.tostring_rgb(), dtype=np.uint8)
-    image_from_plot = image_from_plot.reshape(
-        fig.canvas.get_width_height()[::-1] + (3,))
-    plt.close(fig)
+        xmax = min(crop_region['x_max'], 0.99) * width
+        ymax = min(crop_region['y_max'], 0.99) * height
+        (x1, y1), (x2, y2) = _to_fixed_point(
+            np.array([[xmin, ymin], [xmax, ymax]]))
+        cv2.rectangle(
+            output_image, (int(x1), int(y1)), (int(x2), int(y2)),
+            MATPLOTLIB_COLOR_TO_RGB['b'],
+            thickness=max(1, round(CROP_REGION_LINE_WIDTH * scale)),
+            lineType=cv2.LINE_AA, shift=_DRAW_SHIFT)
+
     if output_image_height is not None:
         output_image_width = int(output_image_height / height * width)
-        image_from_plot = cv2.resize(
-            image_from_plot, dsize=(output_image_width, output_image_height),
+        output_image = cv2.resize(
+            output_image, dsize=(output_image_width, output_image_height),
             interpolation=cv2.INTER_CUBIC)
-    return image_from_plot
+    return output_image
+
+
+def _to_fixed_point(coordinates):
+    return np.round(np.asarray(coordinates) * (1 << _DRAW_SHIFT)).astype(np.int32)
+
+
+def _color_to_rgb(color):
+    if color in MATPLOTLIB_COLOR_TO_RGB:
+        return MATPLOTLIB_COLOR_TO_RGB[color]
+
+    color = color.lstrip('#')
+    return tuple(int(color[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def resize_with_pad(image, size):
+    """
+    Resizes image to a square keeping the aspect ratio. Adds black bars to the
+      sides to fill the square, like tf.image.resize_with_pad.
+
+    Args:
+        image (numpy array): uint8 image [height, width, 3].
+        size (int): Width and height of the output image.
+
+    Returns:
+        padded_image (numpy array): uint8 image [size, size, 3].
+    """
+    height, width, channel = image.shape
+    scale = min(size / height, size / width)
+    resized_height = max(1, round(height * scale))
+    resized_width = max(1, round(width * scale))
+
+    padded_image = np.zeros((size, size, channel), dtype=np.uint8)
+    top = (size - resized_height) // 2
+    left = (size - resized_width) // 2
+    padded_image[top:top + resized_height, left:left + resized_width] = cv2.resize(
+        image, dsize=(resized_width, resized_height), interpolation=cv2.INTER_LINEAR)
 
+    return padded_image
 
-def _create_overlay(image_tensor, keypoints_with_scores):
+
+def _create_overlay(image, keypoints_with_scores, extra_predictions=None):
     """
     Function done by TensorFlow team and modified by me.
 
     Creates overlay for image.
 
     Args:
-        image_tensor (tensor): Image converted to tensor.
+        image (numpy array): uint8 RGB image [height, width, 3].
         keypoints_with_scores (numpy array): Array containing keypoints and confidence values.
+        extra_predictions (list): Optional (keypoints_with_scores, keypoint_color) pairs.
 
     Returns:
         output_overlay (np array): Image with keypoints overlaid converted to Numpy array.
 
     """
-    display_image = tf.expand_dims(image_tensor, axis=0)
-    display_image = tf.cast(tf.image.resize_with_pad(
-        display_image, 1280, 1280), dtype=tf.int32)
+    display_image = resize_with_pad(np.asarray(image), DISPLAY_SIZE)
     output_overlay = draw_prediction_on_image(
-        np.squeeze(display_image.numpy(), axis=0), keypoints_with_scores)
+        display_image, keypoints_with_scores,
+        extra_predictions=extra_predictions)
     return output_overlay
 
 
-def visualize_image_with_keypoints(image_tensor, keypoints_with_scores):
+def visualize_image_with_keypoints(image, keypoints_with_scores):
     """
     Function done by TensorFlow team and modified by me.
 
     Returns single image visualization with keypoints.
 
     Args:
-        image_tensor (tensor): Image converted to tensor.
+        image (numpy array): uint8 RGB image [height, width, 3].
         keypoints_with_scores (numpy array): Array containing keypoints and confidence values.
 
     Returns
         Numpy array
     """
     print("Visualizing image with keypoints")
-    if not isinstance(keypoints_with_scores, np.ndarray):
-        keypoints_with_scores = np.array(keypoints_with_scores)
-    output_overlay = _create_overlay(image_tensor, keypoints_with_scores)
+    output_overlay = _create_overlay(
+        image, _to_keypoints_array(keypoints_with_scores))
     print("- Done")
 
     return output_overlay
 
 
+def visualize_image_with_multiple_keypoints(image, keypoints_with_scores_list):
+    """
+    Returns single image visualization with keypoints of several predictions.
+      Each prediction gets its own keypoint color from COMPARISON_KEYPOINT_COLORS.
+
+    Args:
+        image (numpy array): uint8 RGB image [height, width, 3].
+        keypoints_with_scores_list (list): Keypoint arrays, one per prediction.
+
+    Returns
+        Numpy array
+    """
+    print("Visualizing image with keypoints of several predictions")
+    predictions = [
+        (_to_keypoints_array(keypoints_with_scores),
+         COMPARISON_KEYPOINT_COLORS[i % len(COMPARISON_KEYPOINT_COLORS)])
+        for i, keypoints_with_scores in enumerate(keypoints_with_scores_list)
+    ]
+    output_overlay = _create_overlay(
+        image, predictions[0][0], extra_predictions=predictions[1:])
+    print("- Done")
+
+    return output_overlay
+
+
+def _to_keypoints_array(keypoints_with_scores):
+    # Keypoints read back from lists have lost the shape [1, 0, 17, 3] when
+    #   no people were found.
+    return np.asarray(keypoints_with_scores).reshape(1, -1, 17, 3)
+
+
 def numpy_array_to_img(np_array):
     data = im.fromarray(np_array)
     img_byte_arr = io.BytesIO()
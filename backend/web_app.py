@@ -1,22 +1,78 @@
 import os
 import io
 import json
+import time
+import base64
 
-from flask import Flask, request, send_file, abort
+import numpy as np
+
+from collections import deque
+from contextlib import closing
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask, Response, request, send_file, abort, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 
 from backend.config import config
-from backend.file_handler import save_file, create_folders, delete_file, open_file, get_filepath, get_files
-from backend.pose_estimation_process import estimate_pose
-from backend.model_utils import SUPPORTED_MODELS
-from backend.visualisation_utils import visualize_image_with_keypoints, numpy_array_to_img
-from backend.database_connection import DBConnection
+from backend.file_handler import ensure_file_indexes, save_file, save_file_bytes, save_local_file, create_temp_filepath, map_file, iterate_archive_files, create_folders, delete_file, delete_files, open_file, get_filepath, get_files
+from backend.pose_estimation_process import estimate_pose, estimate_pose_task, create_sequence_estimator, preload_models
+from backend.model_utils import SUPPORTED_MODELS, MODEL_VERSIONS, model_registry
+from backend.visualisation_utils import draw_prediction_on_image, visualize_image_with_keypoints, visualize_image_with_multiple_keypoints, numpy_array_to_img, COMPARISON_KEYPOINT_COLORS, OVERLAY_RENDER_SETTINGS
+from backend.database_connection import DBConnection, VIDEO_FRAME_INDEXES
 from backend.database import mongo
-from backend.tensor_utils import convert_image_to_tensor
-from backend.stats import calculate_stats
+import backend.database
+from backend.tensor_utils import decode_image, SUPPORTED_IMAGE_EXTENSIONS, SUPPORTED_VIDEO_EXTENSIONS
+from backend.stats import date_range_filter, DATE_FORMAT
+from backend.stats_counters import StatsCounters
+from backend.jobs import JobManager, JobQueueFull, FINISHED_STATUSES
+from backend.overlay_cache import OverlayCache
+from backend.inference_workers import InferenceWorkerPool, InferenceServer
+from backend.keypoint_codec import decode_keypoints
+from backend.pipeline import Pipeline, Stage
+from backend.process_memory import read_process_memory
+from backend.result_cache import PredictionCache
+from backend.upload_request import StreamingUploadRequest
+from backend.video_processing import open_video, iterate_video_frames, AnnotatedVideoWriter, VideoNotReadable
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
 
+class NumpyJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider which renders numpy arrays, such as keypoints decoded from
+      the database, as plain lists.
+    """
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, np.ndarray):
+            return o.tolist()
+        return DefaultJSONProvider.default(o)
+
+
 app = Flask(__name__)
+app.json = NumpyJSONProvider(app)
+
+# Set by gunicorn_config when the app is loaded once and worker processes
+#   are forked from it.
+FORKED_WORKERS = os.environ.get("FORKED_WORKERS", "False") in ["true", "True"]
+
+MAX_IMAGE_PIXELS = config.dict().get("maxImagePixels")
+
+app.request_class = StreamingUploadRequest
+StreamingUploadRequest.max_image_pixels = MAX_IMAGE_PIXELS
+if config.dict().get("maxUploadMb"):
+    StreamingUploadRequest.max_file_size = int(
+        config.dict()["maxUploadMb"] * 1024 * 1024)
+if config.dict().get("maxVideoUploadMb"):
+    StreamingUploadRequest.max_video_file_size = int(
+        config.dict()["maxVideoUploadMb"] * 1024 * 1024)
+if config.dict().get("maxArchiveUploadMb"):
+    StreamingUploadRequest.max_archive_file_size = int(
+        config.dict()["maxArchiveUploadMb"] * 1024 * 1024)
+if config.dict().get("maxRequestMb"):
+    app.config["MAX_CONTENT_LENGTH"] = int(
+        config.dict()["maxRequestMb"] * 1024 * 1024)
 
 if os.environ.get("MONGO_URI"):
     # Using for example Azure's MongoDB
@@ -30,10 +86,102 @@ else:
         + ':' + os.environ['MONGODB_PORT']  \
         + '/' + os.environ['MONGODB_DATABASE']
 
-db_connection = DBConnection("predictions")
+db_connection = DBConnection(
+    "predictions",
+    stats_counters=StatsCounters("prediction_stats"),
+    keypoint_storage=config.dict().get("keypointStorage"))
+video_connection = DBConnection("videos")
+video_frame_connection = DBConnection(
+    "video_frames",
+    keypoint_storage=config.dict().get("keypointStorage"),
+    indexes=VIDEO_FRAME_INDEXES)
+prediction_cache = PredictionCache(
+    max_size=config.dict().get("resultCacheSize", 1024),
+    persistent_lookup=(lambda key: db_connection.find_prediction(*key))
+    if config.dict().get("resultCachePersistent") else None)
+overlay_cache = OverlayCache(
+    config.dict()["overlayCachePath"],
+    config.dict().get("overlayCacheMaxMb", 512))
+job_manager = JobManager(
+    max_workers=config.dict().get("jobWorkers", 2),
+    max_queued=config.dict().get("jobQueueSize", 100),
+    max_finished_jobs=config.dict().get("jobRetention", 1000))
+
+# Runs inference in separate processes, so that slow models do not hold up
+#   the requests which only read the database or files. Forked web workers
+#   share one pool, which runs in the inference server started by the
+#   gunicorn master, see start_inference_server.
+inference_pool = None
+inference_server = None
+if config.dict().get("inferenceWorkers"):
+    inference_options = dict(
+        workers=config.dict()["inferenceWorkers"],
+        worker_models=config.dict().get("inferenceWorkerModels"),
+        default_models=config.dict().get("preloadModels"),
+        initializer=preload_models,
+        max_tasks_per_worker=config.dict().get("inferenceWorkerMaxTasks"),
+        max_memory_mb=config.dict().get("inferenceWorkerMaxMemoryMb"),
+        threads_per_worker=config.dict().get("inferenceWorkerThreads", 4))
+    if FORKED_WORKERS:
+        inference_server = InferenceServer(
+            estimate_pose_task, config.dict()["inferenceSocket"], **inference_options)
+        inference_pool = inference_server.client()
+    else:
+        inference_pool = InferenceWorkerPool(estimate_pose_task, **inference_options)
+
+# Runs the models of one comparison request in parallel.
+compare_executor = ThreadPoolExecutor(
+    max_workers=len(SUPPORTED_MODELS), thread_name_prefix="compare")
 
 create_folders()
 mongo.init_app(app)
+if config.dict().get("ensureIndexesOnStartup"):
+    db_connection.ensure_indexes()
+    video_frame_connection.ensure_indexes()
+    ensure_file_indexes()
+# With inference workers the models are loaded in the worker processes.
+if not inference_pool:
+    model_registry.preload(
+        config.dict().get("preloadModels", []), fork_safe_only=FORKED_WORKERS)
+
+
+def reinitialize_after_fork():
+    """
+    Prepares forked worker process for serving. Called by the post_fork hook
+      of gunicorn_config.
+
+    MongoClient is not fork-safe, so the worker connects with its own client.
+      Models drop their interpreters, which are created again in the worker,
+      and the models which could not be loaded before the fork are loaded.
+      Inference workers are shared through the inference server started by
+      the master.
+    """
+    print(f"Reinitializing worker {os.getpid()} after fork")
+
+    backend.database.mongo.init_app(app)
+    model_registry.reinitialize_after_fork()
+    if not inference_pool:
+        model_registry.preload(config.dict().get("preloadModels", []))
+
+    print("- Done")
+
+
+def start_inference_server():
+    """
+    Starts the inference server shared by the forked web workers. Called by
+      the on_starting hook of gunicorn_config in the master process, before
+      the workers are forked.
+    """
+    if inference_server:
+        inference_server.start()
+
+
+def stop_inference_server():
+    """
+    Stops the inference server. Called by the on_exit hook of gunicorn_config.
+    """
+    if inference_server:
+        inference_server.stop()
 
 
 @app.errorhandler(400)
@@ -48,6 +196,18 @@ def file_not_found(error):
     return {"error": error.description}, error.code
 
 
+@app.errorhandler(413)
+def request_entity_too_large(error):
+    print(error.description)
+    return {"error": error.description}, error.code
+
+
+@app.errorhandler(503)
+def service_unavailable(error):
+    print(error.description)
+    return {"error": error.description}, error.code
+
+
 @app.errorhandler(500)
 def internal_server_error(error):
     print(error.description)
@@ -72,8 +232,27 @@ def items():
     item = {}
     items = []
 
+    headers = {}
+
     if request.method == "GET":
-        items, db_status = db_connection.get_all_items()
+        limit, after, fields = _get_pagination_args()
+        filter = _get_item_filter()
+
+        if _is_true(request.args.get("explain", "false")):
+            return {"explain": db_connection.explain_items(limit, after, fields, filter)}
+
+        items, next_after, db_status = db_connection.get_items(
+            limit, after, fields, filter)
+
+        if db_status == "invalid_id":
+            abort(400, f"Invalid value for 'after': '{after}'")
+
+        headers["X-Pagination"] = json.dumps({
+            "limit": limit,
+            "after": after,
+            "next_after": next_after,
+            "has_more": next_after is not None
+        })
 
     elif request.method == "POST":
         data = json.loads(request.data)
@@ -86,7 +265,7 @@ def items():
         },
         "item": item,
         "items": items
-    }
+    }, headers
 
 
 @app.route('/stats', methods=['GET'])
@@ -97,15 +276,28 @@ def stats():
     items = []
 
     if request.method == "GET":
-        items, db_status = db_connection.get_all_items()
-        model_amounts, image_amounts, prediction_dates = calculate_stats(items)
+        try:
+            start = _parse_date(request.args.get("start"))
+            end = _parse_date(request.args.get("end"))
+            top = int(request.args["top"]) if request.args.get("top") else None
+        except ValueError as err:
+            abort(400, f"Invalid parameter: '{err}'")
+
+        if start or end:
+            # Counters are not kept by date range.
+            stats, db_status = db_connection.get_stats(
+                date_range_filter(start, end), top)
+        else:
+            stats, db_status = db_connection.get_counted_stats(top)
+
+        total_results, model_amounts, image_amounts, prediction_dates = stats
 
     return {
         "status": {
             "db_status": db_status,
             "file_status": file_status
         },
-        "total_results": len(items),
+        "total_results": total_results,
         "model_amounts": model_amounts,
         "image_amounts": image_amounts,
         "prediction_dates": prediction_dates
@@ -130,12 +322,14 @@ def item(id):
         item, db_status = db_connection.find_item_by_id(id)
 
     elif request.method == "PUT":
-        update = json.loads(request.data)
+        update = _prepare_update(json.loads(request.data))
         item, db_status = db_connection.update_item(id, update)
+        overlay_cache.invalidate(id)
 
     elif request.method == "DELETE":
         item, db_status = db_connection.delete_item(id)
         file_status = delete_file(item.get("filename"))
+        overlay_cache.invalidate(id)
 
     return {
         "status": {
@@ -146,6 +340,56 @@ def item(id):
     }
 
 
+@app.route('/items/bulk', methods=['POST'])
+def bulk_items():
+    data = json.loads(request.data)
+    operations = data.get("operations") if isinstance(data, dict) else None
+
+    if not isinstance(operations, list):
+        abort(400, "Field 'operations' must be a list")
+
+    max_operations = config.dict().get("bulkMaxOperations", 10000)
+    if len(operations) > max_operations:
+        abort(400, f"At most {max_operations} operations are allowed")
+
+    print(
+        f"\nReceived {request.method} request to run {len(operations)} bulk operations")
+
+    for operation in operations:
+        if isinstance(operation, dict) and operation.get("op") == "update" \
+                and isinstance(operation.get("update"), dict):
+            operation["update"] = _prepare_update(operation["update"])
+
+    results, deleted_items = db_connection.bulk_items(operations)
+
+    # Files of the deleted items are deleted together, like with DELETE /items/<id>.
+    deleted_filenames = {item["_id"]: item.get("filename")
+                         for item in deleted_items}
+    file_statuses = {}
+    if data.get("delete_files", True):
+        file_statuses = delete_files(list(deleted_filenames.values()))
+
+    overlay_cache.invalidate_items(
+        [result["id"] for result in results
+         if result["status"] in ("updated", "deleted")])
+
+    summary = {}
+    for result in results:
+        summary[result["status"]] = summary.get(result["status"], 0) + 1
+        if result["status"] == "deleted":
+            result["file_status"] = file_statuses.get(
+                deleted_filenames[result["id"]], "")
+
+    return {
+        "status": {
+            "db_status": "done",
+            "file_status": "deleted" if file_statuses else ""
+        },
+        "summary": summary,
+        "results": results
+    }
+
+
 @app.route('/files/<id>', methods=['GET'])
 def get_file(id):
     if request.method == "GET":
@@ -161,16 +405,28 @@ def get_file(id):
         prediction = request.args.get('prediction')
 
         if prediction:
-            print(f"- Drawing prediction on image")
-            keypoints_with_scores = item["keypoints_with_scores"]
-            image_tensor = convert_image_to_tensor(filepath)
+            keypoints_with_scores = decode_keypoints(
+                item["keypoints_with_scores"])
+            cached_filepath = overlay_cache.get(
+                id, keypoints_with_scores, OVERLAY_RENDER_SETTINGS)
 
-            np_array = visualize_image_with_keypoints(
-                image_tensor, keypoints_with_scores)
+            if cached_filepath:
+                filepath = cached_filepath
+            else:
+                print(f"- Drawing prediction on image")
+                # Blobs have no file extension, so the type is checked
+                #   from the filename of the item.
+                with map_file(filepath) as image_bytes:
+                    image = decode_image(image_bytes, filename)
 
-            image_binary = numpy_array_to_img(np_array)
+                np_array = visualize_image_with_keypoints(
+                    image, keypoints_with_scores)
 
-            filepath = io.BytesIO(image_binary)
+                image_binary = numpy_array_to_img(np_array)
+                overlay_cache.put(
+                    id, keypoints_with_scores, OVERLAY_RENDER_SETTINGS, image_binary)
+
+                filepath = io.BytesIO(image_binary)
 
         return send_file(
             filepath,
@@ -188,7 +444,7 @@ def files():
         print(
             f"\nReceived {request.method} request to save a file")
 
-        filename, filepath = save_file(file)
+        filename, filepath, _ = save_file(file)
 
         file_status = "ok" if filename else "not_saved"
 
@@ -217,24 +473,23 @@ def predict():
     print(
         f"\nReceived {request.method} request to estimate the pose using '{model_name}'")
 
-    filename, filepath = save_file(file)
-
-    keypoints_with_scores, image_tensor = estimate_pose(
-        filepath, model_name)
-
-    item = {
-        "filename": filename,
-        "keypoints_with_scores": keypoints_with_scores.tolist(),
-        "model_name": model_name
-    }
+    filename, filepath, content_hash = save_file(file)
 
-    db_id = db_connection.insert_item(item)
+    item, image, keypoints_with_scores = _run_prediction(
+        filename, filepath, content_hash, model_name)
+    # Same values as /files/<id> reads from the database, so that the cached
+    #   overlay is found with them.
+    keypoints_with_scores = db_connection.stored_keypoints(keypoints_with_scores)
 
     np_array = visualize_image_with_keypoints(
-        image_tensor, keypoints_with_scores)
+        image, keypoints_with_scores)
 
     image_binary = numpy_array_to_img(np_array)
 
+    if config.dict().get("overlayCacheOnPredict"):
+        overlay_cache.put(item["_id"], keypoints_with_scores,
+                          OVERLAY_RENDER_SETTINGS, image_binary)
+
     return send_file(
         io.BytesIO(image_binary),
         mimetype='image/png',
@@ -242,6 +497,294 @@ def predict():
         download_name=filename)
 
 
+@app.route('/predict/compare', methods=['POST'])
+def predict_compare():
+    model_names = request.args.getlist('model_name') or SUPPORTED_MODELS
+    file = request.files['file']
+
+    print(
+        f"\nReceived {request.method} request to compare models {model_names}")
+
+    for model_name in model_names:
+        if model_name not in SUPPORTED_MODELS:
+            abort(400, f"Model name '{model_name}' not supported")
+
+    start = time.perf_counter()
+
+    filename, filepath, content_hash = save_file(file)
+    with map_file(filepath) as image_bytes:
+        image = decode_image(image_bytes, filename, MAX_IMAGE_PIXELS)
+
+    def run_model(model_name):
+        model_start = time.perf_counter()
+        keypoints_with_scores, boxes = _estimate_pose_cached(
+            image, content_hash, model_name, filepath, filename)
+        return keypoints_with_scores, boxes, (time.perf_counter() - model_start) * 1000
+
+    # All models share the decoded frame and run at the same time.
+    futures = [compare_executor.submit(run_model, model_name)
+               for model_name in model_names]
+    predictions = [future.result() for future in futures]
+
+    items = [_create_prediction_item(filename, keypoints_with_scores, model_name, content_hash, boxes)
+             for model_name, (keypoints_with_scores, boxes, _) in zip(model_names, predictions)]
+    items, db_status = db_connection.insert_items(items)
+
+    np_array = visualize_image_with_multiple_keypoints(
+        image, [keypoints_with_scores for keypoints_with_scores, _, _ in predictions])
+    overlay = base64.b64encode(numpy_array_to_img(np_array)).decode("ascii")
+
+    results = {}
+    for i, (model_name, item, (_, _, latency_ms)) in enumerate(zip(model_names, items, predictions)):
+        results[model_name] = {
+            "item_id": item["_id"],
+            "keypoints_with_scores": item["keypoints_with_scores"],
+            "latency_ms": round(latency_ms, 1),
+            "keypoint_color": COMPARISON_KEYPOINT_COLORS[i % len(COMPARISON_KEYPOINT_COLORS)]
+        }
+
+    return {
+        "status": {
+            "db_status": db_status,
+            "file_status": "ok"
+        },
+        "filename": filename,
+        "results": results,
+        "total_latency_ms": round((time.perf_counter() - start) * 1000, 1),
+        "overlay": overlay
+    }
+
+
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    model_names = request.args.getlist('model_name')
+
+    print(
+        f"\nReceived {request.method} request to estimate poses using {model_names}")
+
+    if not model_names:
+        abort(400, "At least one model_name is required")
+    for model_name in model_names:
+        if model_name not in SUPPORTED_MODELS:
+            abort(400, f"Model name '{model_name}' not supported")
+
+    # Form is parsed before the response starts, so that uploads over the
+    #   size limits get their 413 status instead of a cut off stream.
+    files = request.files.getlist('file')
+    archives = request.files.getlist('archive')
+
+    def iterate_uploads():
+        for file in files:
+            yield file.filename, file.read()
+        for archive in archives:
+            for filename, data in iterate_archive_files(archive.stream, archive.filename):
+                if filename.lower().endswith(SUPPORTED_IMAGE_EXTENSIONS):
+                    yield filename, data
+
+    def generate():
+        for result in _iterate_batch_predictions(iterate_uploads(), model_names):
+            yield app.json.dumps(result) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@app.route('/predict/video', methods=['POST'])
+def predict_video():
+    model_name = request.args['model_name']
+    file = request.files['file']
+
+    print(
+        f"\nReceived {request.method} request to estimate poses of video using '{model_name}'")
+
+    if model_name not in SUPPORTED_MODELS:
+        abort(400, f"Model name '{model_name}' not supported")
+    if not file.filename.lower().endswith(SUPPORTED_VIDEO_EXTENSIONS):
+        abort(400, f"Video type of '{file.filename}' not supported")
+
+    try:
+        every_nth = int(request.args.get("every_nth", 1))
+        max_frames = int(request.args["max_frames"]) \
+            if request.args.get("max_frames") else None
+    except ValueError as err:
+        abort(400, f"Invalid parameter: '{err}'")
+    if every_nth < 1:
+        abort(400, "Parameter 'every_nth' must be positive")
+
+    crop_tracking = _is_true(request.args.get(
+        "crop_tracking", str(config.dict().get("videoCropTracking", True))))
+
+    if config.dict().get("videoMaxFrames"):
+        max_frames = min(max_frames or config.dict()["videoMaxFrames"],
+                         config.dict()["videoMaxFrames"])
+
+    filename, filepath, content_hash = save_file(file)
+
+    try:
+        video, db_status = _run_video_prediction(
+            filename, filepath, content_hash, model_name, every_nth, max_frames,
+            annotate=_is_true(request.args.get("annotate", "false")),
+            crop_tracking=crop_tracking)
+    except VideoNotReadable:
+        abort(400, f"Video '{file.filename}' could not be read")
+
+    return {
+        "status": {
+            "db_status": db_status,
+            "file_status": "ok"
+        },
+        "video": video
+    }
+
+
+@app.route('/videos/<id>', methods=['GET'])
+def get_video(id):
+    video, db_status = video_connection.find_item_by_id(id)
+
+    return {
+        "status": {
+            "db_status": db_status,
+            "file_status": ''
+        },
+        "video": video
+    }
+
+
+@app.route('/videos/<id>/frames', methods=['GET'])
+def get_video_frames(id):
+    limit, after, fields = _get_pagination_args()
+
+    frames, next_after, db_status = video_frame_connection.get_items(
+        limit, after, fields, {"video_id": id})
+
+    if db_status == "invalid_id":
+        abort(400, f"Invalid value for 'after': '{after}'")
+
+    headers = {"X-Pagination": json.dumps({
+        "limit": limit,
+        "after": after,
+        "next_after": next_after,
+        "has_more": next_after is not None
+    })}
+
+    return {
+        "status": {
+            "db_status": db_status,
+            "file_status": ''
+        },
+        "frames": frames
+    }, headers
+
+
+@app.route('/videos/<id>/annotated', methods=['GET'])
+def get_annotated_video(id):
+    video, db_status = video_connection.find_item_by_id(id)
+
+    filepath = get_filepath(video.get("annotated_filename"))
+    if not filepath:
+        abort(404, 'Annotated video not found')
+
+    return send_file(
+        filepath,
+        mimetype='video/mp4',
+        as_attachment=True,
+        download_name=video["annotated_filename"])
+
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    model_name = request.args['model_name']
+    file = request.files['file']
+
+    print(
+        f"\nReceived {request.method} request to queue pose estimation using '{model_name}'")
+
+    if model_name not in SUPPORTED_MODELS:
+        abort(400, f"Model name '{model_name}' not supported")
+
+    # Only the stored file is handed to the job, not its content.
+    filename, filepath, content_hash = save_file(file)
+
+    try:
+        job = job_manager.submit(
+            _run_prediction_job,
+            upload_filename=file.filename,
+            filename=filename,
+            filepath=filepath,
+            content_hash=content_hash,
+            model_name=model_name)
+    except JobQueueFull as err:
+        abort(503, str(err))
+
+    return {"job": _job_to_response(job)}, 202
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_manager.get(job_id)
+
+    if not job:
+        abort(404, 'Job not found')
+
+    return {"job": _job_to_response(job)}
+
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    job = job_manager.get(job_id)
+
+    if not job:
+        abort(404, 'Job not found')
+
+    def generate(job):
+        # Server-sent events, one event per job update until the job finishes.
+        yield f"data: {app.json.dumps(_job_to_response(job))}\n\n"
+
+        while job and job["status"] not in FINISHED_STATUSES:
+            updated_job = job_manager.wait_for_update(
+                job_id, job["version"], timeout=15)
+
+            if updated_job and updated_job["version"] == job["version"]:
+                yield ": keep-alive\n\n"
+                continue
+
+            job = updated_job
+            if job:
+                yield f"data: {app.json.dumps(_job_to_response(job))}\n\n"
+
+    return Response(generate(job), mimetype='text/event-stream')
+
+
+@app.route('/worker', methods=['GET'])
+def worker():
+    """
+    Returns memory usage of the worker process which served the request.
+    """
+    return {
+        "pid": os.getpid(),
+        "forked": FORKED_WORKERS,
+        "memory": read_process_memory(),
+        "loaded_models": model_registry.loaded_models(),
+        "estimated_model_memory_mb": model_registry.memory_usage_mb()
+    }
+
+
+@app.route('/health', methods=['GET'])
+def health():
+    """
+    Returns state of the inference worker processes. Status is 503 if some
+      worker is not running, for example while it is being restarted, or if
+      the inference server does not answer.
+    """
+    if not inference_pool:
+        return {"status": "ok", "inference_workers": None}
+
+    inference_health = inference_pool.health()
+    if inference_health["started"] and not inference_health["healthy"]:
+        return {"status": "degraded", "inference_workers": inference_health}, 503
+
+    return {"status": "ok", "inference_workers": inference_health}
+
+
 @app.route('/config', methods=['GET'])
 def get_dict_config():
     return config.dict()
@@ -260,6 +803,415 @@ def add_headers(response):
     return response
 
 
+def _parse_date(string):
+    return datetime.strptime(string, DATE_FORMAT).date() if string else None
+
+
+def _get_item_filter():
+    """
+    Creates filter from 'model_name', 'filename', 'start', 'end' and
+      'min_score' query parameters of a list request.
+    """
+    try:
+        start = _parse_date(request.args.get("start"))
+        end = _parse_date(request.args.get("end"))
+        min_score = float(request.args["min_score"]) \
+            if request.args.get("min_score") else None
+    except ValueError as err:
+        abort(400, f"Invalid parameter: '{err}'")
+
+    filter = date_range_filter(start, end)
+
+    for field in ["model_name", "filename"]:
+        if request.args.get(field):
+            filter[field] = request.args[field]
+
+    if min_score is not None:
+        filter["mean_score"] = {"$gte": min_score}
+
+    return filter
+
+
+def _get_pagination_args():
+    """
+    Reads 'limit', 'after' and 'fields' query parameters of a list request.
+
+    Returns:
+        limit (int): Page size, at most itemsMaxPageSize.
+        after (str): '_id' of the last item of the previous page, None for the first page.
+        fields (list): Requested fields, None for all fields.
+    """
+    default_limit = config.dict().get("itemsPageSize", 100)
+    max_limit = config.dict().get("itemsMaxPageSize", 1000)
+
+    try:
+        limit = int(request.args.get("limit", default_limit))
+    except ValueError:
+        abort(400, "Parameter 'limit' must be an integer")
+    if limit < 1:
+        abort(400, "Parameter 'limit' must be positive")
+
+    fields = None
+    if request.args.get("fields"):
+        fields = [field.strip() for field in request.args["fields"].split(",")
+                  if field.strip()]
+        for field in fields:
+            if field.startswith("$"):
+                abort(400, f"Invalid field '{field}'")
+
+    return min(limit, max_limit), request.args.get("after") or None, fields
+
+
+def _run_prediction(filename, filepath, content_hash, model_name, progress=None):
+    """
+    Runs pose estimation for saved upload and saves the result.
+
+    Args:
+        filename (str): Name of the saved file.
+        filepath (str): Absolute path of the saved file.
+        content_hash (str): SHA-256 hex digest of the file.
+        model_name (str): Name of the model.
+        progress (function): Optional callback which gets the name of the current stage.
+
+    Returns:
+        item (dict): Item saved to database.
+        image (numpy array): Decoded image.
+        keypoints_with_scores (numpy array): Estimated keypoints.
+    """
+    progress = progress or (lambda stage: None)
+
+    progress("decoding")
+    with map_file(filepath) as image_bytes:
+        image = decode_image(image_bytes, filename, MAX_IMAGE_PIXELS)
+
+    progress("estimating")
+    keypoints_with_scores, boxes = _estimate_pose_cached(
+        image, content_hash, model_name, filepath, filename)
+
+    progress("storing")
+    item = _create_prediction_item(
+        filename, keypoints_with_scores, model_name, content_hash, boxes)
+
+    item, db_status = db_connection.insert_item(item)
+
+    return item, image, keypoints_with_scores
+
+
+def _run_video_prediction(filename, filepath, content_hash, model_name,
+                          every_nth=1, max_frames=None, annotate=False, crop_tracking=False):
+    """
+    Runs pose estimation frame by frame for saved video. Decoding,
+      estimation, drawing and encoding of the annotated video run as
+      pipeline stages at the same time, see Pipeline. Frames are decoded one
+      at a time and their keypoints are saved in bulk writes of
+      videoFrameInsertSize frames, so memory use does not grow with the
+      length of the video. With crop_tracking, MoveNet models follow the
+      person from frame to frame, see CropRegionTracker, and the frames are
+      estimated one at a time in frame order.
+
+    Args:
+        filename (str): Name of the saved file.
+        filepath (str): Absolute path of the saved file.
+        content_hash (str): SHA-256 hex digest of the file.
+        model_name (str): Name of the model.
+        every_nth (int): Estimate only every nth frame.
+        max_frames (int): Estimate at most this many frames. None for no limit.
+        annotate (bool): Save video with the keypoints drawn on the frames.
+        crop_tracking (bool): Track the crop region between frames.
+
+    Returns:
+        video (dict): Video item with the processing results.
+        db_status (str): Status of the last database operation.
+    """
+    insert_size = config.dict().get("videoFrameInsertSize", 100)
+
+    capture, info = open_video(filepath)
+
+    video, db_status = video_connection.insert_item({
+        "filename": filename,
+        "content_hash": content_hash,
+        "model_name": model_name,
+        "model_version": MODEL_VERSIONS[model_name],
+        "every_nth": every_nth,
+        "crop_tracking": crop_tracking,
+        "status": "processing",
+        **info
+    })
+
+    writer = None
+    annotated_path = None
+    frames = []
+    processed_frames = 0
+    start = time.perf_counter()
+
+    try:
+        estimator, sequential = create_sequence_estimator(
+            model_name, crop_tracking, estimate=_estimate_pose)
+
+        def estimate(decoded_frame):
+            frame_index, timestamp_ms, frame = decoded_frame
+            keypoints_with_scores, crop_region = estimator(frame)
+            keypoints_with_scores = np.asarray(keypoints_with_scores)
+
+            return {
+                "video_id": video["_id"],
+                "frame_index": frame_index,
+                "timestamp_ms": timestamp_ms,
+                "keypoints_with_scores": keypoints_with_scores,
+                "crop_region": crop_region
+            }, frame
+
+        def render(estimated_frame):
+            record, frame = estimated_frame
+            return record, draw_prediction_on_image(
+                frame, record["keypoints_with_scores"], crop_region=record["crop_region"])
+
+        def encode(rendered_frame):
+            record, annotated_frame = rendered_frame
+            writer.write(annotated_frame)
+            return record, None
+
+        stages = [Stage("inference", estimate, ordered=sequential,
+                        workers=1 if sequential else config.dict().get("videoInferenceWorkers", 1))]
+
+        if annotate:
+            annotated_path = create_temp_filepath(".mp4")
+            writer = AnnotatedVideoWriter(
+                annotated_path, info["fps"] / every_nth, info["width"], info["height"])
+            stages += [Stage("render", render, workers=config.dict().get("videoRenderWorkers", 1)),
+                       Stage("encode", encode, ordered=True)]
+
+        pipeline = Pipeline(
+            stages, queue_size=config.dict().get("videoPipelineQueueSize", 8),
+            source_name="decode")
+
+        with closing(pipeline.run(iterate_video_frames(capture, every_nth, max_frames))) as outputs:
+            for record, _ in outputs:
+                frames.append(record)
+                processed_frames += 1
+                if len(frames) >= insert_size:
+                    video_frame_connection.insert_items(frames)
+                    frames = []
+
+        video_frame_connection.insert_items(frames)
+
+    except Exception:
+        video_connection.update_item(video["_id"], {"status": "failed"})
+        if annotated_path and os.path.exists(annotated_path):
+            os.remove(annotated_path)
+        raise
+
+    finally:
+        capture.release()
+        if writer:
+            writer.release()
+
+    elapsed = time.perf_counter() - start
+    update = {
+        "status": "done",
+        "processed_frames": processed_frames,
+        "processing_seconds": round(elapsed, 3),
+        "processing_fps": round(processed_frames / elapsed, 2) if elapsed else 0.0,
+        "stage_stats": pipeline.stats()
+    }
+    print(
+        f"- Processed {processed_frames} frames at {update['processing_fps']} frames per second")
+
+    if annotated_path:
+        update["annotated_filename"], _, _ = save_local_file(
+            f"{os.path.splitext(filename)[0]}_annotated.mp4", annotated_path)
+
+    return video_connection.update_item(video["_id"], update)
+
+
+def _estimate_pose_cached(image, content_hash, model_name, filepath=None, filename=None):
+    """
+    Returns keypoints and bounding boxes from the prediction cache or runs
+      estimate_pose. Concurrent requests for the same image and model share
+      one inference. Boxes are None for single pose models.
+
+    The inference workers decode the image from filepath, so image is only
+      needed when they are not enabled.
+    """
+    key = (content_hash, model_name, MODEL_VERSIONS[model_name])
+
+    (keypoints_with_scores, boxes), source = prediction_cache.get_or_compute(
+        key, lambda: _estimate_pose(
+            image, model_name, with_boxes=True, filepath=filepath, filename=filename))
+
+    if source != "computed":
+        print(f"- Prediction found from cache ({source})")
+
+    return np.asarray(keypoints_with_scores), boxes
+
+
+def _estimate_pose(image, model_name, with_boxes=False, filepath=None, filename=None):
+    """
+    Runs estimate_pose in an inference worker process, or in this process if
+      the inference workers are not enabled. Images saved to filepath are sent
+      to the worker as the path instead of the decoded array.
+    """
+    if inference_pool:
+        if filepath:
+            inputs = dict(filepath=filepath, filename=filename,
+                          max_pixels=MAX_IMAGE_PIXELS)
+        else:
+            # Video frames have no file of their own.
+            inputs = dict(image=image)
+        return inference_pool.run(
+            model_name, model_name, with_boxes=with_boxes,
+            timeout=config.dict().get("inferenceTimeoutS"), **inputs)
+
+    return estimate_pose(image, model_name, with_boxes=with_boxes)
+
+
+def _create_prediction_item(filename, keypoints_with_scores, model_name, content_hash, boxes=None):
+    item = {
+        "filename": filename,
+        "keypoints_with_scores": keypoints_with_scores,
+        "model_name": model_name,
+        "model_version": MODEL_VERSIONS[model_name],
+        "content_hash": content_hash
+    }
+
+    if boxes is not None:
+        # Bounding boxes of the people found by MultiPose models.
+        item["boxes"] = np.asarray(boxes).tolist()
+
+    return item
+
+
+def _prepare_update(update):
+    if "keypoints_with_scores" in update:
+        # Edited keypoints are not reused as cached model output.
+        update["edited"] = True
+
+    return update
+
+
+def _predict_upload(upload_filename, image_bytes, model_names):
+    """
+    Saves and decodes one uploaded image and runs it through the models.
+
+    Returns:
+        results (list): (model_name, item, error) for each model. Items are not
+          saved to database yet.
+    """
+    results = []
+
+    try:
+        filename, filepath, content_hash = save_file_bytes(
+            upload_filename, image_bytes)
+        # The inference workers decode the image themselves.
+        image = None if inference_pool else decode_image(
+            image_bytes, upload_filename, MAX_IMAGE_PIXELS)
+    except Exception as err:
+        return [(model_name, None, str(err)) for model_name in model_names]
+
+    for model_name in model_names:
+        try:
+            keypoints_with_scores, boxes = _estimate_pose_cached(
+                image, content_hash, model_name, filepath, upload_filename)
+        except Exception as err:
+            results.append((model_name, None, str(err)))
+        else:
+            results.append((model_name, _create_prediction_item(
+                filename, keypoints_with_scores, model_name, content_hash, boxes), None))
+
+    return results
+
+
+def _iterate_batch_predictions(uploads, model_names):
+    """
+    Runs batch of uploads through the models in a pipelined way. Images are
+      processed in parallel while new ones are read, and the items are saved
+      to database in bulk writes.
+
+    Args:
+        uploads (iterable): (upload_filename, image_bytes) pairs.
+        model_names (list): Names of the models.
+
+    Yields:
+        result (dict): Result for one image and model, after its item is saved.
+    """
+    workers = config.dict().get("batchPredictWorkers", 2)
+    insert_size = config.dict().get("bulkInsertSize", 50)
+    pending_results = []
+
+    def flush():
+        items = [result["item"] for result in pending_results
+                 if result.get("item")]
+        db_connection.insert_items(items)
+
+        for result in pending_results:
+            item = result.pop("item", None)
+            if item:
+                result["item_id"] = item["_id"]
+                result["stored_filename"] = item["filename"]
+                result["keypoints_with_scores"] = item["keypoints_with_scores"]
+        flushed = list(pending_results)
+        pending_results.clear()
+
+        return flushed
+
+    def collect(upload_filename, future):
+        for model_name, item, error in future.result():
+            result = {"filename": upload_filename, "model_name": model_name}
+            if error:
+                result["error"] = error
+            else:
+                result["item"] = item
+            pending_results.append(result)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # At most two images per worker are read into memory at a time.
+        in_flight = deque()
+
+        for upload_filename, image_bytes in uploads:
+            in_flight.append((upload_filename, executor.submit(
+                _predict_upload, upload_filename, image_bytes, model_names)))
+
+            while len(in_flight) >= workers * 2 or \
+                    (in_flight and in_flight[0][1].done()):
+                collect(*in_flight.popleft())
+
+            if len(pending_results) >= insert_size:
+                yield from flush()
+
+        while in_flight:
+            collect(*in_flight.popleft())
+            if len(pending_results) >= insert_size:
+                yield from flush()
+
+    yield from flush()
+
+
+def _run_prediction_job(progress, upload_filename, filename, filepath, content_hash, model_name):
+    item, _, _ = _run_prediction(
+        filename, filepath, content_hash, model_name, progress)
+
+    return {
+        "item_id": item["_id"],
+        "filename": item["filename"],
+        "keypoints_with_scores": item["keypoints_with_scores"],
+        "overlay_url": f"/files/{item['_id']}?prediction=true"
+    }
+
+
+def _job_to_response(job):
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "stage": job["stage"],
+        "model_name": job["params"].get("model_name"),
+        "filename": job["params"].get("upload_filename"),
+        "created": job["created"],
+        "updated": job["updated"],
+        "result": job["result"],
+        "error": job["error"]
+    }
+
+
 def _is_true(string):
     return False if string in ["false", "False"] else True
 
@@ -1,8 +1,12 @@
 import React, { useState, useEffect } from 'react';
+import Button from '@mui/material/Button';
 import ResultModal from '../components/modal';
 import DataTable from '../components/table';
 import baseUrl from '../BackendUrl'
 
+// Items fetched at a time. More are fetched when the user asks for them.
+const ITEMS_PAGE_SIZE = 100
+
 
 function Results(props) {
     let rootState = props.rootState
@@ -13,18 +17,41 @@ function Results(props) {
     const [showModal, setShowModal] = useState(false);
     const [activeItem, setActiveItem] = useState(null);
     const [activeImage, setActiveImage] = useState(null)
+    const [nextAfter, setNextAfter] = useState(null)
+    const [loading, setLoading] = useState(false)
 
     useEffect(() => {
-        fetch(`${baseUrl}/items`).then(res => res.json()).then(data => {
-            console.log("Fetched list of items", data.items)
-            data.items.forEach((item, index, array) => {
-                item.date = new Date(parseInt(item['_id'].slice(0, 8), 16) * 1000)
-            });
-
-            handleRootStateChange({ "items": data.items });
+        fetchItems("").then(([pageItems, after]) => {
+            setNextAfter(after)
+            handleRootStateChange({ "items": pageItems });
         });
     }, []);
 
+    const fetchItems = async (after) => {
+        // Keypoints are not needed in the list, so only the shown fields are fetched
+        setLoading(true)
+        const res = await fetch(
+            `${baseUrl}/items?fields=model_name,filename&limit=${ITEMS_PAGE_SIZE}&after=${after}`
+        );
+        const data = await res.json();
+        setLoading(false)
+        console.log("Fetched page of items", data.items)
+
+        data.items.forEach((item, index, array) => {
+            item.date = new Date(parseInt(item['_id'].slice(0, 8), 16) * 1000)
+        });
+
+        const pagination = JSON.parse(res.headers.get("X-Pagination"))
+        return [data.items, pagination && pagination.has_more ? pagination.next_after : null]
+    }
+
+    function handleLoadMore() {
+        fetchItems(nextAfter).then(([pageItems, after]) => {
+            setNextAfter(after)
+            handleRootStateChange({ "items": items.concat(pageItems) });
+        });
+    }
+
     const fetchResultImage = async (item) => {
         const res = await fetch(
             `${baseUrl}/files/${item["_id"]}?prediction=True`
@@ -51,6 +78,10 @@ function Results(props) {
         <div className="App">
             <h1>Results</h1>
             {items ? DataTable(items, handleModalOpen) : null}
+            {nextAfter ?
+                <Button variant="outlined" disabled={loading} onClick={handleLoadMore}>
+                    Load more
+                </Button> : null}
             {(activeItem && activeImage) ? ResultModal(showModal, activeItem, activeImage, handleModalClose) : null}
 
         </div>
@@ -0,0 +1,78 @@
+import threading
+import pytest
+
+from backend.batching import MicroBatcher
+
+
+class TestMicroBatcher:
+    def test_concurrent_requests_are_batched(self):
+        batch_sizes = []
+
+        def batch_fn(inputs):
+            batch_sizes.append(len(inputs))
+            return [input * 2 for input in inputs]
+
+        batcher = MicroBatcher(batch_fn, max_batch_size=4, max_wait_ms=200)
+        results = {}
+
+        def worker(i):
+            results[i] = batcher.submit(i)
+
+        threads = [threading.Thread(target=worker, args=(i,))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        batcher.close()
+
+        assert results == {0: 0, 1: 2, 2: 4, 3: 6}
+        assert sum(batch_sizes) == 4
+        assert max(batch_sizes) <= 4
+        assert batcher.batches_run < 4
+
+    def test_single_request_waits_at_most_the_window(self):
+        batcher = MicroBatcher(lambda inputs: inputs, max_wait_ms=1)
+
+        assert batcher.submit("a") == "a"
+        batcher.close()
+
+    def test_batch_error_is_raised_to_every_caller(self):
+        def batch_fn(inputs):
+            raise ValueError("broken model")
+
+        batcher = MicroBatcher(batch_fn, max_wait_ms=1)
+
+        with pytest.raises(ValueError, match="broken model"):
+            batcher.submit(1)
+        batcher.close()
+
+    def test_submit_after_close_fails(self):
+        batcher = MicroBatcher(lambda inputs: inputs, max_wait_ms=1)
+        batcher.close()
+
+        with pytest.raises(Exception, match="Batcher is closed"):
+            batcher.submit("a")
+
+    def test_requests_submitted_during_close_do_not_hang(self):
+        batcher = MicroBatcher(lambda inputs: inputs, max_wait_ms=1)
+        results = []
+
+        def worker(i):
+            try:
+                results.append(batcher.submit(i))
+            except Exception:
+                results.append("closed")
+
+        threads = [threading.Thread(target=worker, args=(i,))
+                   for i in range(20)]
+        for thread in threads[:10]:
+            thread.start()
+        batcher.close()
+        for thread in threads[10:]:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=5)
+
+        assert not any(thread.is_alive() for thread in threads)
+        assert len(results) == 20
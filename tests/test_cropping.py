@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+from backend.cropping import init_crop_region, determine_crop_region, crop_and_resize, CropRegionTracker
+from backend.pose_estimation_process import create_sequence_estimator
+from backend.visualisation_utils import KEYPOINT_DICT
+
+
+def _person_keypoints(center_y, center_x, size, score=0.9):
+    # Standing person with all keypoints around the center.
+    keypoints_with_scores = np.zeros((1, 1, 17, 3), dtype=np.float32)
+    offsets = np.linspace(-0.5, 0.5, 17) * size
+    keypoints_with_scores[0, 0, :, 0] = center_y + offsets
+    keypoints_with_scores[0, 0, :, 1] = center_x
+    keypoints_with_scores[0, 0, :, 2] = score
+
+    for joint in ["left_hip", "right_hip"]:
+        keypoints_with_scores[0, 0, KEYPOINT_DICT[joint], 0] = center_y
+    for joint in ["left_shoulder", "right_shoulder"]:
+        keypoints_with_scores[0, 0, KEYPOINT_DICT[joint], 0] = center_y - size / 4
+
+    return keypoints_with_scores
+
+
+class TestCropping:
+    def test_init_crop_region_covers_wide_image(self):
+        crop_region = init_crop_region(100, 200)
+
+        assert crop_region["x_min"] == 0.0
+        assert crop_region["width"] == 1.0
+        assert crop_region["y_min"] == pytest.approx(-0.5)
+        assert crop_region["height"] == pytest.approx(2.0)
+
+    def test_crop_and_resize_pads_outside_of_image(self):
+        image = np.full((100, 200, 3), 255, dtype=np.uint8)
+
+        input_image = crop_and_resize(image, init_crop_region(100, 200), 64)
+
+        assert input_image.shape == (1, 64, 64, 3)
+        assert input_image.dtype == np.uint8
+        # Image is in the middle half, black bars above and below.
+        assert (input_image[0, :15] == 0).all()
+        assert (input_image[0, 17:47] == 255).all()
+        assert (input_image[0, 49:] == 0).all()
+
+    def test_crop_region_follows_visible_torso(self):
+        keypoints_with_scores = _person_keypoints(0.5, 0.25, 0.2)
+
+        crop_region = determine_crop_region(keypoints_with_scores, 1000, 2000)
+
+        assert crop_region["height"] < 0.5
+        assert (crop_region["x_min"] + crop_region["x_max"]) / 2 == pytest.approx(0.25)
+        assert (crop_region["y_min"] + crop_region["y_max"]) / 2 == pytest.approx(0.5)
+        # Square in pixels.
+        assert crop_region["height"] * 1000 == pytest.approx(crop_region["width"] * 2000)
+
+    def test_crop_region_is_reset_without_torso(self):
+        keypoints_with_scores = _person_keypoints(0.5, 0.25, 0.2, score=0.1)
+
+        assert determine_crop_region(keypoints_with_scores, 1000, 2000) == \
+            init_crop_region(1000, 2000)
+
+    def test_crop_region_is_reset_when_keypoints_are_on_one_point(self):
+        keypoints_with_scores = np.full((1, 1, 17, 3), 0.5, dtype=np.float32)
+
+        crop_region = determine_crop_region(keypoints_with_scores, 1000, 2000)
+
+        assert crop_region == init_crop_region(1000, 2000)
+        assert crop_and_resize(np.zeros((1000, 2000, 3), np.uint8),
+                               crop_region, 64).shape == (1, 64, 64, 3)
+
+
+class TestCropRegionTracker:
+    def test_keypoints_are_mapped_to_image_and_crop_is_tracked(self):
+        inputs = []
+
+        def keypoint_detector(input_image):
+            inputs.append(input_image)
+            # Person in the middle of the model input.
+            return _person_keypoints(0.5, 0.5, 0.4)
+
+        tracker = CropRegionTracker(keypoint_detector, 64)
+        image = np.zeros((100, 200, 3), dtype=np.uint8)
+
+        keypoints_with_scores, crop_region = tracker(image)
+
+        assert crop_region == init_crop_region(100, 200)
+        assert inputs[0].shape == (1, 64, 64, 3)
+        hip = keypoints_with_scores[0, 0, KEYPOINT_DICT["left_hip"]]
+        assert hip[:2] == pytest.approx([0.5, 0.5])
+
+        _, next_crop_region = tracker(image)
+
+        assert next_crop_region["height"] < crop_region["height"]
+
+        tracker.reset()
+        _, crop_region = tracker(image)
+        assert crop_region == init_crop_region(100, 200)
+
+
+class TestSequenceEstimator:
+    def test_untracked_keypoints_are_mapped_to_non_square_frame(self):
+        def estimate(image, model_name):
+            # Top left corner of the frame in the square padded around it.
+            keypoints_with_scores = np.full((1, 1, 17, 3), 0.9, dtype=np.float32)
+            keypoints_with_scores[..., :2] = [0.25, 0.0]
+            return keypoints_with_scores
+
+        for model_name, crop_tracking in [("blazepose", True),
+                                          ("movenet_multipose_lightning", True),
+                                          ("movenet_lightning", False)]:
+            estimator, sequential = create_sequence_estimator(
+                model_name, crop_tracking, estimate=estimate)
+
+            keypoints_with_scores, crop_region = estimator(
+                np.zeros((100, 200, 3), dtype=np.uint8))
+
+            assert not sequential
+            assert crop_region is None
+            assert keypoints_with_scores[0, 0, :, :2] == pytest.approx(
+                np.tile([0.0, 0.0], (17, 1)))
+            assert keypoints_with_scores[0, 0, :, 2] == pytest.approx(0.9)
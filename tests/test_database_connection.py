@@ -0,0 +1,156 @@
+import pytest
+
+from bson.binary import Binary
+from mongomock import MongoClient
+from unittest.mock import patch
+
+import backend.database
+from backend.database_connection import DBConnection, summarize_explain
+from backend.stats_counters import StatsCounters
+
+
+class PyMongoMock(MongoClient):
+    pass
+
+
+class TestKeypointStorage:
+    @patch.object(backend.database, "mongo", PyMongoMock())
+    def test_keypoints_are_stored_packed(self):
+        db_connection = DBConnection("predictions", keypoint_storage="float32")
+        keypoints_with_scores = [[[[0.25, 0.5, 0.75]]]]
+
+        item, _ = db_connection.insert_item(
+            {"filename": "a.png", "keypoints_with_scores": keypoints_with_scores})
+        document = backend.database.mongo.db["predictions"].find_one()
+
+        assert isinstance(document["keypoints_with_scores"], Binary)
+        assert item["keypoints_with_scores"] == keypoints_with_scores
+
+        item, _ = db_connection.find_item_by_id(item["_id"])
+        assert item["keypoints_with_scores"].tolist() == keypoints_with_scores
+
+    @patch.object(backend.database, "mongo", PyMongoMock())
+    def test_migrate_keypoints(self):
+        collection = backend.database.mongo.db["predictions"]
+        collection.insert_many([
+            {"keypoints_with_scores": [[[[0.25, 0.5, 0.75]]]]},
+            {"keypoints_with_scores": [[[[0.5, 0.5, 0.5]]]]},
+            {"filename": "no_keypoints.png"}
+        ])
+        db_connection = DBConnection("predictions")
+
+        assert db_connection.migrate_keypoints("float16") == 2
+        assert db_connection.migrate_keypoints("float16") == 0
+        assert all(isinstance(document["keypoints_with_scores"], Binary)
+                   for document in collection.find({"keypoints_with_scores": {"$exists": True}}))
+
+        assert db_connection.migrate_keypoints("list") == 2
+        assert collection.find_one()["keypoints_with_scores"] == [
+            [[[0.25, 0.5, 0.75]]]]
+
+
+class TestStatsCounters:
+    @patch.object(backend.database, "mongo", PyMongoMock())
+    def test_counters_are_rebuilt_after_change_on_upgraded_database(self):
+        # Predictions saved before the counters existed.
+        backend.database.mongo.db["predictions"].insert_many([
+            {"filename": "a.png", "model_name": "model_a"},
+            {"filename": "b.png", "model_name": "model_a"}
+        ])
+        db_connection = DBConnection(
+            "predictions", stats_counters=StatsCounters("prediction_stats"))
+
+        db_connection.insert_item({"filename": "c.png", "model_name": "model_b"})
+        stats, db_status = db_connection.get_counted_stats()
+
+        assert db_status == "found"
+        assert stats[0] == 3
+        assert stats[1] == {"model_a": 2, "model_b": 1}
+        assert db_connection.check_stats_counters() == {}
+
+    @patch.object(backend.database, "mongo", PyMongoMock())
+    def test_update_changes_counters_from_replaced_document(self):
+        db_connection = DBConnection(
+            "predictions", stats_counters=StatsCounters("prediction_stats"))
+        item, _ = db_connection.insert_item(
+            {"filename": "a.png", "model_name": "model_a"})
+
+        item, db_status = db_connection.update_item(
+            item["_id"], {"model_name": "model_b"})
+
+        assert db_status == "updated"
+        assert item["model_name"] == "model_b"
+        assert item["filename"] == "a.png"
+        assert db_connection.get_counted_stats()[0][1] == {"model_b": 1}
+        assert db_connection.check_stats_counters() == {}
+
+
+class TestSummarizeExplain:
+    def test_index_covered_query(self):
+        explain = {
+            "queryPlanner": {
+                "winningPlan": {
+                    "stage": "LIMIT",
+                    "inputStage": {
+                        "stage": "PROJECTION_COVERED",
+                        "inputStage": {
+                            "stage": "IXSCAN",
+                            "indexName": "model_name_1__id_1"
+                        }
+                    }
+                }
+            },
+            "executionStats": {
+                "nReturned": 10,
+                "totalKeysExamined": 10,
+                "totalDocsExamined": 0
+            }
+        }
+
+        summary = summarize_explain(explain)
+
+        assert summary["stages"] == ["LIMIT", "PROJECTION_COVERED", "IXSCAN"]
+        assert summary["indexes"] == ["model_name_1__id_1"]
+        assert summary["index_covered"]
+        assert not summary["collection_scan"]
+        assert summary["returned"] == 10
+
+    def test_collection_scan(self):
+        explain = {
+            "queryPlanner": {
+                "winningPlan": {
+                    "queryPlan": {
+                        "stage": "SORT",
+                        "inputStage": {"stage": "COLLSCAN"}
+                    }
+                }
+            },
+            "executionStats": {
+                "nReturned": 1,
+                "totalKeysExamined": 0,
+                "totalDocsExamined": 1000
+            }
+        }
+
+        summary = summarize_explain(explain)
+
+        assert summary["collection_scan"]
+        assert not summary["index_covered"]
+        assert summary["indexes"] == []
+        assert summary["docs_examined"] == 1000
+
+    def test_fetch_without_execution_stats(self):
+        explain = {
+            "queryPlanner": {
+                "winningPlan": {
+                    "stage": "FETCH",
+                    "inputStage": {"stage": "IXSCAN", "indexName": "_id_"}
+                }
+            }
+        }
+
+        summary = summarize_explain(explain)
+
+        assert summary["indexes"] == ["_id_"]
+        assert not summary["index_covered"]
+        assert summary["docs_examined"] is None
@@ -0,0 +1,204 @@
+import os
+import time
+import threading
+import multiprocessing
+import pytest
+
+from backend.inference_workers import InferenceWorkerPool, InferenceServer, InferenceWorkerError, InferenceWorkerCrashed
+
+
+# Run in the spawned worker processes, so they are module level functions.
+def worker_pid(model_name):
+    return os.getpid()
+
+
+def fail_or_crash(action):
+    if action == "crash":
+        os._exit(1)
+    raise ValueError("bad input")
+
+
+# Passed only by tasks which run at the same time.
+_barrier = threading.Barrier(2)
+
+
+def wait_for_other_task(model_name):
+    _barrier.wait(timeout=10)
+    return os.getpid()
+
+
+def run_in_forked_process(client, results):
+    results.put(client.run("model", "model", timeout=60))
+
+
+def load_models(model_names):
+    with open(os.path.join(os.environ["LOADED_MODELS_DIR"], str(os.getpid())), "w") as f:
+        f.write(",".join(model_names))
+
+
+def wait_until(condition, timeout=30):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "Condition not met in time"
+        time.sleep(0.1)
+
+
+class TestInferenceWorkerPool:
+    def test_tasks_run_in_worker_processes(self):
+        pool = InferenceWorkerPool(worker_pid, workers=2)
+        try:
+            pids = {pool.run("model", "model", timeout=60) for _ in range(10)}
+
+            health = pool.health()
+            assert health["started"] and health["healthy"]
+            assert pids <= {worker["pid"] for worker in health["workers"]}
+            assert os.getpid() not in pids
+            assert sum(worker["tasks_done"]
+                       for worker in health["workers"]) == 10
+        finally:
+            pool.close()
+
+    def test_tasks_go_to_workers_of_their_model(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("LOADED_MODELS_DIR", str(tmp_path))
+        pool = InferenceWorkerPool(worker_pid, workers=3,
+                                   worker_models=[["blazepose"], ["movenet"]],
+                                   default_models=["lightning"],
+                                   initializer=load_models)
+        try:
+            assert not pool.health()["started"]
+
+            pool.run("blazepose", "blazepose", timeout=60)
+            pids = {worker["slot"]: worker["pid"]
+                    for worker in pool.health()["workers"]}
+
+            assert pool.run("blazepose", "blazepose", timeout=60) == pids[0]
+            assert pool.run("movenet", "movenet", timeout=60) == pids[1]
+            assert pool.run("other", "other", timeout=60) == pids[2]
+
+            loaded = {int(path.name): path.read_text()
+                      for path in tmp_path.iterdir()}
+            assert loaded == {pids[0]: "blazepose", pids[1]: "movenet",
+                              pids[2]: "lightning"}
+        finally:
+            pool.close()
+
+    def test_model_without_worker_fails(self):
+        pool = InferenceWorkerPool(
+            worker_pid, workers=1, worker_models=[["blazepose"]])
+        try:
+            with pytest.raises(InferenceWorkerError):
+                pool.submit("movenet", "movenet")
+        finally:
+            pool.close()
+
+    def test_exception_is_returned_to_caller(self):
+        pool = InferenceWorkerPool(fail_or_crash, workers=1)
+        try:
+            with pytest.raises(InferenceWorkerError, match="ValueError: bad input"):
+                pool.run("model", "fail", timeout=60)
+
+            assert pool.health()["restarts"] == 0
+        finally:
+            pool.close()
+
+    def test_crashed_worker_is_restarted(self):
+        pool = InferenceWorkerPool(fail_or_crash, workers=1)
+        try:
+            with pytest.raises(InferenceWorkerCrashed):
+                pool.run("model", "crash", timeout=60)
+
+            wait_until(lambda: pool.health()["healthy"])
+            assert pool.health()["restarts"] == 1
+
+            with pytest.raises(InferenceWorkerError, match="ValueError"):
+                pool.run("model", "fail", timeout=60)
+        finally:
+            pool.close()
+
+    def test_tasks_run_concurrently_in_a_worker(self):
+        pool = InferenceWorkerPool(
+            wait_for_other_task, workers=1, threads_per_worker=2)
+        try:
+            futures = [pool.submit("model", "model") for _ in range(2)]
+
+            assert len({future.result(60) for future in futures}) == 1
+        finally:
+            pool.close()
+
+    def test_worker_is_replaced_after_max_tasks(self):
+        pool = InferenceWorkerPool(
+            worker_pid, workers=1, max_tasks_per_worker=2)
+        try:
+            first_pids = [pool.run("model", "model", timeout=60)
+                          for _ in range(2)]
+            # The old worker serves until the replacement has started.
+            wait_until(lambda: pool.health()["recycled"] == 1)
+            next_pid = pool.run("model", "model", timeout=60)
+
+            assert first_pids[0] == first_pids[1]
+            assert next_pid != first_pids[0]
+            assert pool.health()["recycled"] == 1
+            assert pool.health()["restarts"] == 0
+        finally:
+            pool.close()
+
+    def test_worker_is_replaced_when_memory_grows(self):
+        pool = InferenceWorkerPool(worker_pid, workers=1, max_memory_mb=1)
+        try:
+            pids = []
+            for recycled in range(1, 4):
+                pids.append(pool.run("model", "model", timeout=60))
+                wait_until(lambda: pool.health()["recycled"] == recycled)
+
+            assert len(set(pids)) == 3
+            assert pool.health()["recycled"] == 3
+        finally:
+            pool.close()
+
+
+class TestInferenceServer:
+    def test_forked_processes_share_one_pool(self, tmp_path):
+        server = InferenceServer(
+            worker_pid, str(tmp_path / "inference.sock"), workers=1)
+        server.start()
+        try:
+            client = server.client()
+            context = multiprocessing.get_context("fork")
+            results = context.Queue()
+            processes = [context.Process(target=run_in_forked_process,
+                                         args=(client, results))
+                         for _ in range(2)]
+            for process in processes:
+                process.start()
+            pids = {results.get(timeout=60) for _ in processes}
+            for process in processes:
+                process.join()
+
+            health = client.health()
+            assert health["healthy"]
+            assert pids == {health["workers"][0]["pid"]}
+            assert health["workers"][0]["tasks_done"] == 2
+        finally:
+            server.stop()
+
+    def test_errors_are_returned_to_client(self, tmp_path):
+        server = InferenceServer(
+            fail_or_crash, str(tmp_path / "inference.sock"), workers=1)
+        server.start()
+        try:
+            client = server.client()
+
+            with pytest.raises(InferenceWorkerError, match="ValueError: bad input"):
+                client.run("model", "fail", timeout=60)
+            with pytest.raises(InferenceWorkerCrashed):
+                client.run("model", "crash", timeout=60)
+        finally:
+            server.stop()
+
+    def test_client_fails_without_server(self, tmp_path):
+        server = InferenceServer(worker_pid, str(tmp_path / "inference.sock"))
+        client = server.client()
+
+        with pytest.raises(InferenceWorkerCrashed):
+            client.run("model", "model", timeout=60)
+        assert not client.health()["healthy"]
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from bson.binary import Binary
+
+from backend.keypoint_codec import encode_keypoints, decode_keypoints, is_encoded
+
+
+class TestKeypointCodec:
+    keypoints_with_scores = np.random.rand(1, 1, 17, 3).astype(np.float32)
+
+    def test_float32_round_trip(self):
+        encoded = encode_keypoints(self.keypoints_with_scores, "float32")
+
+        assert isinstance(encoded, Binary)
+        assert is_encoded(encoded)
+        assert len(encoded) < 17 * 3 * 4 + 32
+
+        decoded = decode_keypoints(encoded)
+        assert decoded.shape == (1, 1, 17, 3)
+        assert np.array_equal(decoded, self.keypoints_with_scores)
+
+    def test_float16_round_trip(self):
+        encoded = encode_keypoints(self.keypoints_with_scores, "float16")
+        decoded = decode_keypoints(encoded)
+
+        assert decoded.dtype == np.float16
+        assert np.allclose(decoded, self.keypoints_with_scores, atol=1e-3)
+
+    def test_decoding_does_not_copy(self):
+        decoded = decode_keypoints(
+            encode_keypoints(self.keypoints_with_scores))
+
+        assert not decoded.flags.owndata
+        assert not decoded.flags.writeable
+
+    def test_lists(self):
+        keypoints_with_scores = [[[[0.1, 0.2, 0.3]]]]
+
+        assert encode_keypoints(keypoints_with_scores, "list") == \
+            keypoints_with_scores
+        assert not is_encoded(keypoints_with_scores)
+        assert decode_keypoints(keypoints_with_scores).shape == (1, 1, 1, 3)
+
+        # Binary can be converted back to lists
+        encoded = encode_keypoints(keypoints_with_scores, "float32")
+        assert np.allclose(encode_keypoints(encoded, "list"),
+                           keypoints_with_scores)
+
+    def test_lists_without_people(self):
+        keypoints_with_scores = np.zeros((1, 0, 17, 3), dtype=np.float32)
+
+        encoded = encode_keypoints(keypoints_with_scores, "list")
+        assert encoded == [[]]
+        assert decode_keypoints(encoded).shape == (1, 0, 17, 3)
+
+    def test_unsupported_format(self):
+        with pytest.raises(Exception):
+            encode_keypoints(self.keypoints_with_scores, "float64")
@@ -0,0 +1,123 @@
+import pytest
+
+import numpy as np
+
+from unittest.mock import patch
+
+import backend.model_utils
+from backend.model_utils import ModelRegistry, convert_multipose_output
+
+
+def _fake_select_model(model_name):
+    def keypoint_detector(input_image):
+        return model_name
+
+    keypoint_detector.closed = False
+
+    def close():
+        keypoint_detector.closed = True
+
+    keypoint_detector.close = close
+
+    def after_fork():
+        keypoint_detector.forked = True
+
+    keypoint_detector.forked = False
+    keypoint_detector.after_fork = after_fork
+
+    return keypoint_detector, 192
+
+
+class TestModelRegistry:
+    @patch.object(backend.model_utils, "select_model", side_effect=_fake_select_model)
+    def test_model_is_loaded_once(self, select_model_mock):
+        registry = ModelRegistry()
+
+        detector_1, input_size = registry.get("movenet_lightning")
+        detector_2, _ = registry.get("movenet_lightning")
+
+        assert detector_1 is detector_2
+        assert input_size == 192
+        assert select_model_mock.call_count == 1
+
+    @patch.object(backend.model_utils, "select_model", side_effect=_fake_select_model)
+    def test_least_recently_used_model_is_evicted(self, select_model_mock):
+        # movenet_lightning (40) + movenet_thunder (90) does not fit in 100 Mb
+        registry = ModelRegistry(memory_budget_mb=100)
+
+        registry.preload(["tflite_movenet_lightning_f16", "movenet_lightning"])
+        lightning, _ = registry.get("movenet_lightning")
+        registry.get("tflite_movenet_lightning_f16")
+        registry.get("movenet_thunder")
+
+        assert registry.loaded_models() == [
+            "tflite_movenet_lightning_f16", "movenet_thunder"]
+        assert lightning.closed
+        assert registry.memory_usage_mb() <= 100
+
+    @patch.object(backend.model_utils, "select_model", side_effect=_fake_select_model)
+    def test_model_in_use_is_closed_after_last_user(self, select_model_mock):
+        registry = ModelRegistry(memory_budget_mb=100)
+
+        with registry.use("movenet_lightning") as (lightning, _):
+            with registry.use("movenet_lightning"):
+                registry.get("movenet_thunder")
+
+                assert registry.loaded_models() == ["movenet_thunder"]
+                assert not lightning.closed
+            assert not lightning.closed
+            assert lightning("image") == "movenet_lightning"
+        assert lightning.closed
+
+        # Model which is not in use is closed when evicted.
+        with registry.use("movenet_thunder") as (thunder, _):
+            pass
+        registry.evict("movenet_thunder")
+        assert thunder.closed
+
+    @patch.object(backend.model_utils, "select_model", side_effect=_fake_select_model)
+    def test_only_fork_safe_models_are_kept_after_fork(self, select_model_mock):
+        registry = ModelRegistry()
+
+        registry.preload(["tflite_movenet_lightning_f16", "movenet_lightning"],
+                         fork_safe_only=True)
+        assert registry.loaded_models() == ["tflite_movenet_lightning_f16"]
+
+        registry.get("movenet_thunder")
+        registry.reinitialize_after_fork()
+
+        assert registry.loaded_models() == ["tflite_movenet_lightning_f16"]
+        tflite, _ = registry.get("tflite_movenet_lightning_f16")
+        assert tflite.forked
+        assert not tflite.closed
+        assert select_model_mock.call_count == 2
+
+    def test_unsupported_model(self):
+        registry = ModelRegistry()
+
+        with pytest.raises(Exception):
+            registry.get("not_a_model")
+
+
+class TestMultiPoseOutput:
+    def test_people_above_score_are_returned_most_confident_first(self):
+        outputs = np.zeros((1, 6, 56), dtype=np.float32)
+        for i, score in enumerate([0.3, 0.1, 0.9, 0.0, 0.0, 0.0]):
+            outputs[0, i, :51] = i / 10
+            outputs[0, i, 51:55] = [0.1, 0.2, 0.5, 0.6]
+            outputs[0, i, 55] = score
+
+        keypoints_with_scores, boxes = convert_multipose_output(outputs)
+
+        assert keypoints_with_scores.shape == (1, 2, 17, 3)
+        assert boxes.shape == (1, 2, 5)
+        assert boxes[0, :, 4] == pytest.approx([0.9, 0.3])
+        assert keypoints_with_scores[0, 0, 0, 0] == pytest.approx(0.2)
+        assert keypoints_with_scores[0, 1, 0, 0] == pytest.approx(0.0)
+
+    def test_no_people_found(self):
+        keypoints_with_scores, boxes = convert_multipose_output(
+            np.zeros((1, 6, 56), dtype=np.float32))
+
+        assert keypoints_with_scores.shape == (1, 0, 17, 3)
+        assert boxes.shape == (1, 0, 5)
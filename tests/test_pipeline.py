@@ -0,0 +1,96 @@
+import random
+import threading
+import time
+import pytest
+
+from backend.pipeline import Pipeline, Stage
+
+
+class TestPipeline:
+    def test_output_is_in_source_order(self):
+        seen_by_ordered_stage = []
+
+        def slow_double(item):
+            time.sleep(random.random() / 100)
+            return item * 2
+
+        def record(item):
+            seen_by_ordered_stage.append(item)
+            return item + 1
+
+        pipeline = Pipeline([
+            Stage("double", slow_double, workers=4),
+            Stage("record", record, ordered=True)
+        ], queue_size=2)
+
+        assert list(pipeline.run(range(50))) == [i * 2 + 1 for i in range(50)]
+        assert seen_by_ordered_stage == [i * 2 for i in range(50)]
+
+        stats = pipeline.stats()
+        assert stats["source"]["items"] == 50
+        assert stats["double"]["items"] == 50
+        assert stats["double"]["workers"] == 4
+        assert stats["double"]["capacity_fps"] > 0
+        assert stats["record"]["items"] == 50
+
+    def test_stages_run_at_the_same_time(self):
+        def sleep(item):
+            time.sleep(0.05)
+            return item
+
+        pipeline = Pipeline([Stage("first", sleep), Stage("second", sleep)])
+
+        start = time.perf_counter()
+        list(pipeline.run(range(10)))
+
+        # Serially this would take 1 second.
+        assert time.perf_counter() - start < 0.8
+
+    def test_source_is_not_read_ahead_of_slow_stage(self):
+        read = []
+        max_ahead = []
+        processed = []
+
+        def source():
+            for i in range(30):
+                read.append(i)
+                yield i
+
+        def slow(item):
+            max_ahead.append(len(read) - len(processed))
+            time.sleep(0.005)
+            processed.append(item)
+            return item
+
+        pipeline = Pipeline([Stage("slow", slow)], queue_size=3)
+        list(pipeline.run(source()))
+
+        # Queue of the stage, the item being processed and the item waiting to be queued.
+        assert max(max_ahead) <= 3 + 2
+
+    def test_error_stops_pipeline(self):
+        def fail(item):
+            if item == 5:
+                raise ValueError("broken frame")
+            return item
+
+        pipeline = Pipeline([Stage("fail", fail, workers=2)], queue_size=2)
+
+        with pytest.raises(ValueError):
+            list(pipeline.run(range(1000)))
+
+        assert pipeline.stats()["source"]["items"] < 1000
+
+    def test_closing_output_stops_threads(self):
+        threads_before = threading.active_count()
+        pipeline = Pipeline([Stage("identity", lambda item: item, workers=3)])
+
+        outputs = pipeline.run(iter(range(10000)))
+        assert next(outputs) == 0
+        outputs.close()
+
+        assert threading.active_count() == threads_before
+
+    def test_ordered_stage_has_one_worker(self):
+        with pytest.raises(Exception):
+            Stage("encode", lambda item: item, workers=2, ordered=True)
@@ -3,9 +3,9 @@ import pytest
 import time
 
 import numpy as np
-import tensorflow as tf
 
-from backend.pose_estimation_process import estimate_pose
+from backend.pose_estimation_process import estimate_pose, estimate_pose_task
+from backend.tensor_utils import load_image
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
 
@@ -14,6 +14,7 @@ class TestPoseEstimationProcess:
     def test_pose_estimation_process_with_single_image(self):
         filename = "test_image.png"
         filepath = os.path.join(dir_path, "fixtures", filename)
+        image = load_image(filepath)
 
         # Tests each of the models
         model_names = [
@@ -30,11 +31,9 @@ class TestPoseEstimationProcess:
             print(f"Testing model {model_name}")
             start = time.time()
 
-            keypoints_with_scores, image_tensor = estimate_pose(
-                filepath, model_name)
+            keypoints_with_scores = estimate_pose(image, model_name)
 
             assert isinstance(keypoints_with_scores, np.ndarray)
-            assert isinstance(image_tensor, tf.Tensor)
 
             # 17 keypoints
             assert len(keypoints_with_scores[0][0]) == 17
@@ -42,3 +41,26 @@ class TestPoseEstimationProcess:
             # Y coordinate, X coordinate, confidence score
             assert len(keypoints_with_scores[0][0][0]) == 3
             print(f"- Done in {round(time.time() - start, 2)}")
+
+    def test_multipose_estimation_with_single_image(self):
+        filepath = os.path.join(dir_path, "fixtures", "test_image.png")
+        image = load_image(filepath)
+
+        keypoints_with_scores, boxes = estimate_pose(
+            image, "movenet_multipose_lightning", with_boxes=True)
+
+        # At least the one person of the image, at most 6 people
+        assert 1 <= keypoints_with_scores.shape[1] <= 6
+        assert keypoints_with_scores.shape[2:] == (17, 3)
+        assert boxes.shape == (1, keypoints_with_scores.shape[1], 5)
+
+    def test_pose_estimation_task_decodes_image_from_file(self):
+        filename = "test_image.png"
+        filepath = os.path.join(dir_path, "fixtures", filename)
+        model_name = "tflite_movenet_lightning_f16"
+
+        keypoints_with_scores = estimate_pose_task(
+            model_name, filepath=filepath, filename=filename)
+
+        np.testing.assert_allclose(
+            keypoints_with_scores, estimate_pose(load_image(filepath), model_name))
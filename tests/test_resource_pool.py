@@ -0,0 +1,79 @@
+import threading
+import pytest
+
+from backend.resource_pool import ResourcePool
+
+
+class TestResourcePool:
+    def test_resources_are_reused(self):
+        created = []
+
+        def factory():
+            created.append(object())
+            return created[-1]
+
+        pool = ResourcePool(factory, size=2)
+
+        with pool.checkout() as resource_1:
+            pass
+        with pool.checkout() as resource_2:
+            pass
+
+        assert resource_1 is resource_2
+        assert len(created) == 1
+
+    def test_concurrent_checkouts_get_own_resource(self):
+        pool = ResourcePool(object, size=3)
+        barrier = threading.Barrier(3)
+        checked_out = []
+
+        def worker():
+            with pool.checkout() as resource:
+                checked_out.append(resource)
+                barrier.wait(timeout=5)
+
+        threads = [threading.Thread(target=worker) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(set(map(id, checked_out))) == 3
+        assert pool.stats() == {
+            "size": 3, "created": 3, "idle": 3, "in_use": 0}
+
+    def test_checkout_times_out_when_pool_is_exhausted(self):
+        pool = ResourcePool(object, size=1)
+
+        with pool.checkout():
+            with pytest.raises(TimeoutError):
+                with pool.checkout(timeout=0.01):
+                    pass
+
+    def test_failing_checkin_discards_resource(self):
+        def on_checkin(resource):
+            raise Exception("broken")
+
+        pool = ResourcePool(object, size=1, on_checkin=on_checkin)
+
+        with pool.checkout() as resource_1:
+            pass
+        with pool.checkout() as resource_2:
+            pass
+
+        assert resource_1 is not resource_2
+
+    def test_resources_are_created_again_after_fork(self):
+        discarded = []
+        pool = ResourcePool(object, size=1, on_discard=discarded.append)
+
+        with pool.checkout() as resource_1:
+            pass
+        pool.reinitialize_after_fork()
+        with pool.checkout() as resource_2:
+            pass
+
+        assert resource_1 is not resource_2
+        # Resources of the parent process are not closed in the child.
+        assert discarded == []
+        assert pool.stats()["created"] == 1
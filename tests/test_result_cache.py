@@ -0,0 +1,75 @@
+import threading
+import time
+import pytest
+
+from backend.result_cache import PredictionCache
+
+
+class TestPredictionCache:
+    def test_result_is_computed_once(self):
+        cache = PredictionCache(max_size=2)
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return "result"
+
+        assert cache.get_or_compute(("a", "model", "1"), compute) == (
+            "result", "computed")
+        assert cache.get_or_compute(("a", "model", "1"), compute) == (
+            "result", "memory")
+        assert len(calls) == 1
+        assert cache.hits["memory"] == 1
+        assert cache.misses == 1
+
+    def test_concurrent_requests_share_one_computation(self):
+        cache = PredictionCache()
+        calls = []
+        results = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return "result"
+
+        def worker():
+            results.append(cache.get_or_compute(("a", "model", "1"), compute))
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(calls) == 1
+        assert [result for result, _ in results] == ["result"] * 4
+
+    def test_least_recently_used_result_is_evicted(self):
+        cache = PredictionCache(max_size=2)
+
+        cache.get_or_compute("a", lambda: 1)
+        cache.get_or_compute("b", lambda: 2)
+        cache.get_or_compute("a", lambda: 1)
+        cache.get_or_compute("c", lambda: 3)
+
+        assert cache.get_or_compute("a", lambda: None) == (1, "memory")
+        assert cache.get_or_compute("b", lambda: 20) == (20, "computed")
+
+    def test_persistent_result_is_used_before_computing(self):
+        cache = PredictionCache(
+            persistent_lookup=lambda key: "stored" if key == "a" else None)
+
+        assert cache.get_or_compute("a", lambda: "new") == (
+            "stored", "persistent")
+        assert cache.get_or_compute("b", lambda: "new") == ("new", "computed")
+
+    def test_error_is_raised_and_not_cached(self):
+        cache = PredictionCache()
+
+        def fail():
+            raise Exception("Inference failed")
+
+        with pytest.raises(Exception, match="Inference failed"):
+            cache.get_or_compute("a", fail)
+
+        assert cache.get_or_compute("a", lambda: "ok") == ("ok", "computed")
@@ -4,8 +4,8 @@ import shutil
 
 import numpy as np
 
-from backend.visualisation_utils import visualize_image_with_keypoints, numpy_array_to_img
-from backend.tensor_utils import convert_image_to_tensor
+from backend.visualisation_utils import visualize_image_with_keypoints, numpy_array_to_img, _keypoints_and_edges_for_display, _EDGE_INDS
+from backend.tensor_utils import load_image
 from backend.file_handler import create_folders
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
@@ -34,7 +34,7 @@ class TestVisualisations:
         filename = "test_image.png"
         filepath = os.path.join(dir_path, "fixtures", filename)
 
-        image_tensor = convert_image_to_tensor(filepath)
+        image = load_image(filepath)
 
         # Keypoint array created with MoveNet model tflite_movenet_lightning_f16
         keypoints_with_scores = np.array(
@@ -58,8 +58,38 @@ class TestVisualisations:
         )
 
         image_array = visualize_image_with_keypoints(
-            image_tensor, keypoints_with_scores)
+            image, keypoints_with_scores)
+
+        assert image_array.shape == (1200, 1200, 3)
+        assert image_array.dtype == np.uint8
 
         img_byte_array = numpy_array_to_img(image_array)
 
-        assert 814000 < len(img_byte_array) < 815000
+        assert 1040000 < len(img_byte_array) < 1060000
+
+    def test_keypoints_of_every_person_are_displayed(self):
+        keypoints_with_scores = np.full((1, 3, 17, 3), 0.5)
+        keypoints_with_scores[0, 2, :, 2] = 0.0
+
+        keypoints_xy, edges_xy, edge_colors = _keypoints_and_edges_for_display(
+            keypoints_with_scores, 100, 200)
+
+        # Third person is below the threshold.
+        assert keypoints_xy.shape == (2 * 17, 2)
+        assert edges_xy.shape == (2 * len(_EDGE_INDS), 2, 2)
+        assert len(edge_colors) == 2 * len(_EDGE_INDS)
+
+    def test_no_people_are_displayed(self):
+        keypoints_xy, edges_xy, edge_colors = _keypoints_and_edges_for_display(
+            np.zeros((1, 0, 17, 3)), 100, 200)
+
+        assert len(keypoints_xy) == 0
+        assert len(edges_xy) == 0
+        assert edge_colors == []
+
+    def test_keypoints_without_people_read_from_lists_are_visualized(self):
+        image = np.zeros((100, 200, 3), dtype=np.uint8)
+
+        image_array = visualize_image_with_keypoints(image, [[]])
+
+        assert image_array.shape == (1200, 1200, 3)
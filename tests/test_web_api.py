@@ -3,14 +3,23 @@ import json
 import os
 import shutil
 import io
-from datetime import datetime
+import time
+import base64
+import zipfile
+import cv2
+import numpy as np
+from datetime import datetime, timezone
 
 from mongomock import MongoClient
 from unittest.mock import patch
 
-from backend.web_app import app as flask_app
-from backend.file_handler import create_folders
+from backend.web_app import app as flask_app, db_connection, reinitialize_after_fork
+from backend.inference_workers import InferenceWorkerPool
+from backend.result_cache import PredictionCache
+from backend.file_handler import create_folders, save_file_bytes, delete_file, get_filepath
+import backend.file_handler
 import backend.database
+import backend.web_app
 from backend.database import mongo
 
 
@@ -18,6 +27,14 @@ dir_path = os.path.dirname(os.path.realpath(__file__))
 temp_path = os.path.join(dir_path, "temp")
 
 
+def fake_estimate_pose_task(model_name, image=None, filepath=None, filename=None,
+                            with_boxes=False, max_pixels=None):
+    # Run in a spawned inference worker process, which gets the path of the
+    #   saved image instead of the decoded image.
+    assert image is None and os.path.isfile(filepath)
+    return np.full((1, 1, 17, 3), 0.5, dtype=np.float32), None
+
+
 class PyMongoMock(MongoClient):
     def init_app(self, app):
         return super().__init__()
@@ -64,7 +81,8 @@ class TestWebApi:
                 "tflite_movenet_lightning_int8",
                 "tflite_movenet_thunder_int8",
                 "movenet_lightning",
-                "movenet_thunder"
+                "movenet_thunder",
+                "movenet_multipose_lightning"
             ]
         }
         assert expected == json.loads(res.get_data(as_text=True))
@@ -87,7 +105,7 @@ class TestWebApi:
             assert res.status_code == 200
             assert res.headers['Content-Disposition'].startswith(
                 f"attachment; filename={expected_filename}")
-            assert 490000 < len(res.data) < 820000
+            assert 500000 < len(res.data) < 1100000
 
         # Send same file 2 times to guarantee that the recursive file saving/naming function works.
         _predict("test_image.png", "test_image.png")
@@ -95,6 +113,298 @@ class TestWebApi:
         _predict("test_image_2.png", "test_image_1.png",
                  renamed_filename="test_image.png")
 
+    @patch.object(backend.database, "mongo", PyMongoMock())
+    def test_overlay_cached_on_predict_is_found_by_files(self, app, client, setup_and_teardown):
+        mongo.init_app(app)
+
+        def float64_estimate_pose(image, model_name, with_boxes=False):
+            # Like BlazePose, which outputs float64 keypoints.
+            keypoints_with_scores = np.full((1, 1, 17, 3), 0.1)
+            keypoints_with_scores[..., 1] = np.linspace(0.1, 0.9, 17)
+            return (keypoints_with_scores, None) if with_boxes else keypoints_with_scores
+
+        with patch.object(backend.web_app, "estimate_pose", float64_estimate_pose), \
+                patch.object(db_connection, "keypoint_storage", "float16"):
+            data = {'file': (open(os.path.join(dir_path, "fixtures", "test_image.png"), 'rb'),
+                             "test_image.png")}
+            res = client.post("/predict?model_name=blazepose", data=data)
+            assert res.status_code == 200
+
+            overlay_cache_path = os.path.join(temp_path, "overlay_cache")
+            assert len(os.listdir(overlay_cache_path)) == 1
+
+            id = json.loads(client.get("/items").data)["items"][0]["_id"]
+            res = client.get(f"/files/{id}?prediction=true")
+            assert res.status_code == 200
+            assert res.data == open(os.path.join(
+                overlay_cache_path, os.listdir(overlay_cache_path)[0]), "rb").read()
+            assert len(os.listdir(overlay_cache_path)) == 1
+
+    @patch.object(backend.database, "mongo", PyMongoMock())
+    def test_predict_compare(self, app, client, setup_and_teardown):
+        mongo.init_app(app)
+
+        filepath = os.path.join(dir_path, "fixtures", "test_image.png")
+        data = {
+            'file': (open(filepath, 'rb'), "test_image.png")
+        }
+        model_names = ["tflite_movenet_lightning_f16",
+                       "tflite_movenet_thunder_int8"]
+        query = "&".join(f"model_name={name}" for name in model_names)
+
+        res = client.post(f"/predict/compare?{query}", data=data)
+        assert res.status_code == 200
+        data = json.loads(res.data)
+
+        assert data["filename"] == "test_image.png"
+        assert sorted(data["results"].keys()) == sorted(model_names)
+        for result in data["results"].values():
+            assert result["item_id"]
+            assert result["latency_ms"] > 0
+            assert len(result["keypoints_with_scores"][0][0]) == 17
+        assert base64.b64decode(data["overlay"]).startswith(b"\x89PNG")
+
+    @patch.object(backend.database, "mongo", PyMongoMock())
+    def test_predict_multipose(self, app, client, setup_and_teardown):
+        mongo.init_app(app)
+
+        filepath = os.path.join(dir_path, "fixtures", "test_image.png")
+        data = {
+            'file': (open(filepath, 'rb'), "test_image.png")
+        }
+        model_names = ["movenet_multipose_lightning",
+                       "tflite_movenet_lightning_f16"]
+        query = "&".join(f"model_name={name}" for name in model_names)
+
+        res = client.post(f"/predict/compare?{query}", data=data)
+        assert res.status_code == 200
+        results = json.loads(res.data)["results"]
+
+        res2 = client.get(
+            f"/items/{results['movenet_multipose_lightning']['item_id']}")
+        item = json.loads(res2.data)["item"]
+        people = len(item["keypoints_with_scores"][0])
+        assert people >= 1
+        assert len(item["boxes"][0]) == people
+        assert len(item["boxes"][0][0]) == 5
+
+        res3 = client.get(
+            f"/items/{results['tflite_movenet_lightning_f16']['item_id']}")
+        assert "boxes" not in json.loads(res3.data)["item"]
+
+    @patch.object(backend.database, "mongo", PyMongoMock())
+    def test_predict_batch(self, app, client, setup_and_teardown):
+        mongo.init_app(app)
+
+        filepath = os.path.join(dir_path, "fixtures", "test_image.png")
+        filepath_2 = os.path.join(dir_path, "fixtures", "test_image_2.png")
+
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as zip_file:
+            zip_file.write(filepath_2, "folder/test_image_2.png")
+            zip_file.writestr("notes.txt", "not an image")
+        archive.seek(0)
+
+        data = {
+            'file': [(open(filepath, 'rb'), "test_image.png")],
+            'archive': (archive, "images.zip")
+        }
+        model_name = "tflite_movenet_lightning_f16"
+
+        res = client.post(
+            f"/predict/batch?model_name={model_name}", data=data)
+        assert res.status_code == 200
+
+        results = [json.loads(line)
+                   for line in res.get_data(as_text=True).splitlines()]
+        assert sorted(result["filename"] for result in results) == [
+            "test_image.png", "test_image_2.png"]
+
+        for result in results:
+            assert result["model_name"] == model_name
+            assert result["item_id"]
+            assert len(result["keypoints_with_scores"][0][0]) == 17
+
+        res2 = client.get("/items")
+        assert len(json.loads(res2.data)["items"]) == 2
+
+        res3 = client.post("/predict/batch?model_name=not_a_model", data={})
+        assert res3.status_code == 400
+
+    @patch.object(backend.database, "mongo", PyMongoMock())
+    def test_predict_video(self, app, client, setup_and_teardown):
+        mongo.init_app(app)
+
+        image = cv2.imread(os.path.join(dir_path, "fixtures", "test_image.png"))
+        image = cv2.resize(image, (160, 120))
+        video_path = os.path.join(temp_path, "test_video.mp4")
+        writer = cv2.VideoWriter(
+            video_path, cv2.VideoWriter_fourcc(*"mp4v"), 10, (160, 120))
+        for _ in range(7):
+            writer.write(image)
+        writer.release()
+
+        model_name = "tflite_movenet_lightning_f16"
+
+        # 1. Every second frame with annotated video
+        data = {'file': (open(video_path, 'rb'), "test_video.mp4")}
+        res1 = client.post(
+            f"/predict/video?model_name={model_name}&every_nth=2&annotate=true", data=data)
+        assert res1.status_code == 200
+        video = json.loads(res1.data)["video"]
+
+        assert video["status"] == "done"
+        assert video["filename"] == "test_video.mp4"
+        assert video["frame_count"] == 7
+        assert video["processed_frames"] == 4
+        assert video["processing_fps"] > 0
+        assert [video["stage_stats"][stage]["items"] for stage in
+                ["decode", "inference", "render", "encode"]] == [4, 4, 4, 4]
+        assert video["annotated_filename"] == "test_video_annotated.mp4"
+
+        # 2. Frames are saved in frame order
+        res2 = client.get(f"/videos/{video['_id']}/frames?limit=3")
+        assert res2.status_code == 200
+        frames = json.loads(res2.data)["frames"]
+        pagination = json.loads(res2.headers["X-Pagination"])
+        assert [frame["frame_index"] for frame in frames] == [0, 2, 4]
+        assert len(frames[0]["keypoints_with_scores"][0][0]) == 17
+        assert frames[0]["crop_region"]["width"] == 1.0
+        assert pagination["has_more"]
+
+        res3 = client.get(
+            f"/videos/{video['_id']}/frames?after={pagination['next_after']}")
+        assert [frame["frame_index"]
+                for frame in json.loads(res3.data)["frames"]] == [6]
+
+        # 3. Annotated video
+        res4 = client.get(f"/videos/{video['_id']}/annotated")
+        assert res4.status_code == 200
+        annotated_path = os.path.join(temp_path, "annotated.mp4")
+        with open(annotated_path, "wb") as f:
+            f.write(res4.data)
+        capture = cv2.VideoCapture(annotated_path)
+        assert int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) == 4
+        capture.release()
+
+        res5 = client.get(f"/videos/{video['_id']}")
+        assert json.loads(res5.data)["video"]["processed_frames"] == 4
+
+        # 4. Frame limit without crop region tracking
+        data = {'file': (open(video_path, 'rb'), "test_video.mp4")}
+        res6 = client.post(
+            f"/predict/video?model_name={model_name}&max_frames=3&crop_tracking=false", data=data)
+        video = json.loads(res6.data)["video"]
+        assert video["processed_frames"] == 3
+        assert video["crop_tracking"] is False
+        assert "annotated_filename" not in video
+
+        res6 = client.get(f"/videos/{video['_id']}/frames")
+        assert json.loads(res6.data)["frames"][0]["crop_region"] is None
+
+        # 5. Not a video
+        data = {'file': (io.BytesIO(b"not a video"), "broken.mp4")}
+        res7 = client.post(
+            f"/predict/video?model_name={model_name}", data=data)
+        assert res7.status_code == 400
+
+        data = {'file': (open(video_path, 'rb'), "test_video.txt")}
+        res8 = client.post(
+            f"/predict/video?model_name={model_name}", data=data)
+        assert res8.status_code == 400
+
+    @patch.object(backend.database, "mongo", PyMongoMock())
+    def test_worker(self, app, client, setup_and_teardown):
+        mongo.init_app(app)
+
+        res = client.get("/worker")
+        assert res.status_code == 200
+        data = json.loads(res.data)
+
+        assert data["pid"] == os.getpid()
+        assert data["forked"] is False
+        assert data["memory"]["max_rss_mb"] > 0
+        assert isinstance(data["loaded_models"], list)
+
+        # Worker gets its own database client after fork.
+        reinitialize_after_fork()
+        res2 = client.post("/items", data=json.dumps({"filename": "a.png"}))
+        assert json.loads(res2.data)["status"]["db_status"] == "saved"
+
+    def test_health(self, app, client):
+        res = client.get("/health")
+        assert res.status_code == 200
+        assert json.loads(res.data) == {
+            "status": "ok", "inference_workers": None}
+
+    @patch.object(backend.database, "mongo", PyMongoMock())
+    def test_predict_in_inference_worker(self, app, client, setup_and_teardown):
+        mongo.init_app(app)
+        pool = InferenceWorkerPool(fake_estimate_pose_task, workers=1)
+
+        try:
+            # Earlier predictions of the image are not used from the cache.
+            with patch.object(backend.web_app, "inference_pool", pool), \
+                    patch.object(backend.web_app, "prediction_cache", PredictionCache()):
+                res = client.get("/health")
+                assert json.loads(res.data)["inference_workers"]["started"] is False
+
+                filepath = os.path.join(dir_path, "fixtures", "test_image.png")
+                res = client.post("/predict?model_name=tflite_movenet_lightning_f16",
+                                  data={'file': (open(filepath, 'rb'), "test_image.png")})
+                assert res.status_code == 200
+
+                res = client.get("/health")
+                assert res.status_code == 200
+                data = json.loads(res.data)
+                assert data["status"] == "ok"
+                worker = data["inference_workers"]["workers"][0]
+                assert worker["alive"] and worker["tasks_done"] == 1
+                assert worker["pid"] != os.getpid()
+
+            item = json.loads(client.get("/items").data)["items"][0]
+            assert np.allclose(item["keypoints_with_scores"], 0.5)
+        finally:
+            pool.close()
+
+    @patch.object(backend.database, "mongo", PyMongoMock())
+    def test_jobs(self, app, client, setup_and_teardown):
+        mongo.init_app(app)
+
+        filepath = os.path.join(dir_path, "fixtures", "test_image.png")
+        data = {
+            'file': (open(filepath, 'rb'), "test_image.png")
+        }
+        model_name = "tflite_movenet_lightning_f16"
+
+        # 1. POST job, returns right away
+        res1 = client.post(f"/jobs?model_name={model_name}", data=data)
+        assert res1.status_code == 202
+        job_id = json.loads(res1.data)["job"]["id"]
+
+        # 2. GET job until it is finished
+        for _ in range(600):
+            res2 = client.get(f"/jobs/{job_id}")
+            assert res2.status_code == 200
+            job = json.loads(res2.data)["job"]
+            if job["status"] in ["done", "failed"]:
+                break
+            time.sleep(0.1)
+
+        assert job["status"] == "done"
+        assert len(job["result"]["keypoints_with_scores"][0][0]) == 17
+        assert job["result"]["overlay_url"] == \
+            f"/files/{job['result']['item_id']}?prediction=true"
+
+        # 3. Event stream of finished job ends with the final state
+        res3 = client.get(f"/jobs/{job_id}/events")
+        events = res3.get_data(as_text=True).strip().split("\n\n")
+        assert json.loads(events[-1][len("data: "):])["status"] == "done"
+
+        # 4. Unknown job
+        res4 = client.get("/jobs/unknown")
+        assert res4.status_code == 404
+
     @patch.object(backend.database, "mongo", PyMongoMock())
     def test_items(self, app, client, setup_and_teardown):
         mongo.init_app(app)
@@ -120,6 +430,85 @@ class TestWebApi:
         for key in ["filename", "keypoints_with_scores", "model_name"]:
             assert data["items"][-1][key] == item[key]
 
+    @patch.object(backend.database, "mongo", PyMongoMock())
+    def test_items_pagination(self, app, client, setup_and_teardown):
+        mongo.init_app(app)
+
+        ids = []
+        for i in range(5):
+            item = {
+                "filename": f"filename_{i}.abc",
+                "keypoints_with_scores": [[[1, 2, 3], [4, 5, 6]]],
+                "model_name": "model_abc"
+            }
+            res = client.post("/items", data=json.dumps(item))
+            ids.append(json.loads(res.data)["item"]["_id"])
+
+        # 1. Pages follow each other by the last _id
+        fetched_ids = []
+        after = ""
+        while True:
+            res = client.get(
+                f"/items?limit=2&after={after}&fields=filename")
+            assert res.status_code == 200
+            items = json.loads(res.data)["items"]
+            pagination = json.loads(res.headers["X-Pagination"])
+
+            assert len(items) <= 2
+            for item in items:
+                assert set(item.keys()) == {"_id", "filename"}
+            fetched_ids.extend(item["_id"] for item in items)
+
+            if not pagination["has_more"]:
+                break
+            after = pagination["next_after"]
+
+        assert fetched_ids == ids
+
+        # 2. Invalid parameters
+        assert client.get("/items?after=abc").status_code == 400
+        assert client.get("/items?limit=0").status_code == 400
+
+    @patch.object(backend.database, "mongo", PyMongoMock())
+    def test_items_filters(self, app, client, setup_and_teardown):
+        mongo.init_app(app)
+        db_connection.ensure_indexes()
+
+        for i, (model_name, score) in enumerate([("model_a", 0.2), ("model_b", 0.6), ("model_a", 0.9)]):
+            item = {
+                "filename": f"filename_{i}.abc",
+                "keypoints_with_scores": [[[1, 2, score], [4, 5, score]]],
+                "model_name": model_name
+            }
+            if i < 2:
+                client.post("/items", data=json.dumps(item))
+            else:
+                client.post("/items/bulk", data=json.dumps(
+                    {"operations": [{"op": "insert", "item": item}]}))
+
+        def _filenames(query):
+            res = client.get(f"/items?{query}")
+            assert res.status_code == 200
+            return [item["filename"] for item in json.loads(res.data)["items"]]
+
+        assert _filenames("model_name=model_a") == [
+            "filename_0.abc", "filename_2.abc"]
+        assert _filenames("filename=filename_1.abc") == ["filename_1.abc"]
+        assert _filenames("min_score=0.5") == [
+            "filename_1.abc", "filename_2.abc"]
+        assert _filenames("model_name=model_a&min_score=0.5") == [
+            "filename_2.abc"]
+
+        today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        assert len(_filenames(f"start={today}&end={today}")) == 3
+        assert _filenames("end=2000-01-01") == []
+
+        assert client.get("/items?min_score=high").status_code == 400
+
+        index_keys = [index["key"] for index in
+                      backend.database.mongo.db["predictions"].index_information().values()]
+        assert [("model_name", 1), ("_id", 1)] in index_keys
+
     @patch.object(backend.database, "mongo", PyMongoMock())
     def test_post_get_delete_item(self, app, client, setup_and_teardown):
         mongo.init_app(app)
@@ -216,6 +605,64 @@ class TestWebApi:
         assert res2.headers['Content-Disposition'] == f"attachment; filename={filename}"
         assert 730000 < len(res2.data) < 740000
 
+        # 4. Overlay is cached and the second request is served from cache
+        overlay_cache_path = os.path.join(temp_path, "overlay_cache")
+        assert len(os.listdir(overlay_cache_path)) == 1
+
+        res4 = client.get(f"/files/{id}?prediction=true")
+        assert res4.status_code == 200
+        assert res4.data == res3.data
+
+        # 5. Updating the item invalidates the cached overlay
+        client.put(f"/items/{id}", data=json.dumps({"extra": "abc"}))
+        assert len(os.listdir(overlay_cache_path)) == 0
+
+    @patch.object(backend.database, "mongo", PyMongoMock())
+    def test_get_file_from_blob_store_with_prediction(self, app, client, setup_and_teardown):
+        mongo.init_app(app)
+
+        with open(os.path.join(dir_path, "fixtures", "test_image.png"), "rb") as f:
+            filename, _, _ = save_file_bytes("test_image.png", f.read())
+        item = {"filename": filename,
+                "keypoints_with_scores": np.full((1, 1, 17, 3), 0.5).tolist()}
+        id = json.loads(client.post("/items", data=json.dumps(item)).data)[
+            "item"]["_id"]
+
+        res = client.get(f"/files/{id}?prediction=true")
+        assert res.status_code == 200
+        assert res.headers['Content-Disposition'] == f"attachment; filename={filename}"
+
+    @patch.object(backend.database, "mongo", PyMongoMock())
+    def test_prediction_without_people_in_list_storage(self, app, client, setup_and_teardown):
+        mongo.init_app(app)
+
+        with open(os.path.join(dir_path, "fixtures", "test_image.png"), "rb") as f:
+            filename, _, content_hash = save_file_bytes("test_image.png", f.read())
+
+        with patch.object(db_connection, "keypoint_storage", "list"):
+            # Stored as [[]], which does not keep the shape.
+            item, _ = db_connection.insert_item({
+                "filename": filename,
+                "content_hash": content_hash,
+                "model_name": "movenet_multipose_lightning",
+                "model_version": "1",
+                "keypoints_with_scores": np.zeros((1, 0, 17, 3), dtype=np.float32),
+                "boxes": [[]]
+            })
+
+            keypoints_with_scores, _ = db_connection.find_prediction(
+                content_hash, "movenet_multipose_lightning", "1")
+            assert keypoints_with_scores.shape == (1, 0, 17, 3)
+
+            res1 = client.get(f"/files/{item['_id']}?prediction=true")
+            assert res1.status_code == 200
+
+            res2 = client.put(f"/items/{item['_id']}",
+                              data=json.dumps({"keypoints_with_scores": [[]]}))
+            assert res2.status_code == 200
+            assert json.loads(client.get(f"/items/{item['_id']}").data)[
+                "item"]["mean_score"] == 0.0
+
     @patch.object(backend.database, "mongo", PyMongoMock())
     def test_files(self, app, client, setup_and_teardown):
         mongo.init_app(app)
@@ -245,6 +692,173 @@ class TestWebApi:
         data2 = json.loads(res2.data)
         assert data2["files"] == ["test.jpg"]
 
+        # 3. POST same content with another name, stored only once
+        item = {'file': (io.BytesIO(b"abcdef"), 'copy.jpg')}
+        res3 = client.post("/files", data=item)
+        assert res3.status_code == 200
+
+        res4 = client.get("/files")
+        assert sorted(json.loads(res4.data)["files"]) == [
+            "copy.jpg", "test.jpg"]
+
+        blobs = [f for _, _, files in os.walk(os.path.join(temp_path, "files", "blobs"))
+                 for f in files]
+        assert len(blobs) == 1
+
+        # 4. POST different content with the same name
+        item = {'file': (io.BytesIO(b"ghijkl"), 'test.jpg')}
+        client.post("/files", data=item)
+        res5 = client.get("/files")
+        assert sorted(json.loads(res5.data)["files"]) == [
+            "copy.jpg", "test.jpg", "test_1.jpg"]
+
+    @patch.object(backend.database, "mongo", PyMongoMock())
+    def test_delete_during_upload_of_same_content(self, app, client, setup_and_teardown):
+        mongo.init_app(app)
+        move_to_blob_store = backend.file_handler._move_to_blob_store
+
+        def upload_with_delete(filename, other_filename, before_move):
+            # Deletes the only other file of the same content while the
+            #   upload is being stored.
+            def move(temp_path, content_hash):
+                if before_move:
+                    delete_file(other_filename)
+                filepath = move_to_blob_store(temp_path, content_hash)
+                if not before_move:
+                    delete_file(other_filename)
+                return filepath
+
+            with patch.object(backend.file_handler, "_move_to_blob_store", move):
+                return save_file_bytes(filename, b"abcdef")
+
+        save_file_bytes("a.jpg", b"abcdef")
+        _, filepath, _ = upload_with_delete("b.jpg", "a.jpg", before_move=True)
+        assert get_filepath("b.jpg") == filepath
+        assert get_filepath("a.jpg") is None
+
+        # Upload finds the blob in the store and drops its own copy before
+        #   the other file is deleted.
+        _, filepath, _ = upload_with_delete("c.jpg", "b.jpg", before_move=False)
+        assert get_filepath("c.jpg") == filepath
+        with open(filepath, "rb") as f:
+            assert f.read() == b"abcdef"
+
+        assert delete_file("c.jpg") == "deleted"
+        blobs = [f for _, _, files in os.walk(os.path.join(temp_path, "files", "blobs"))
+                 for f in files]
+        assert blobs == []
+
+    @patch.object(backend.database, "mongo", PyMongoMock())
+    def test_upload_limits(self, app, client, setup_and_teardown):
+        mongo.init_app(app)
+
+        # 1. POST file larger than maxUploadMb
+        item = {'file': (io.BytesIO(b"a" * (6 * 1024 * 1024)), 'large.jpg')}
+        res1 = client.post("/files", data=item)
+        assert res1.status_code == 413
+        assert "error" in json.loads(res1.data)
+
+        # 2. POST PNG which has more pixels than maxImagePixels in its header
+        header = b"\x89PNG\r\n\x1a\n" + b"\x00\x00\x00\x0dIHDR" + \
+            (10000).to_bytes(4, "big") + (10000).to_bytes(4, "big")
+        item = {'file': (io.BytesIO(header + b"\x00" * 1024), 'huge.png')}
+        res2 = client.post(
+            "/predict?model_name=tflite_movenet_lightning_f16", data=item)
+        assert res2.status_code == 413
+        assert "10000x10000" in json.loads(res2.data)["error"]
+
+        # 3. POST archive larger than maxUploadMb but within maxArchiveUploadMb
+        def archive_of_size(size):
+            archive = io.BytesIO()
+            with zipfile.ZipFile(archive, "w", zipfile.ZIP_STORED) as zip_file:
+                zip_file.writestr("notes.txt", b"a" * size)
+            archive.seek(0)
+            return archive
+
+        res_archive = client.post(
+            "/predict/batch?model_name=tflite_movenet_lightning_f16",
+            data={'archive': (archive_of_size(6 * 1024 * 1024), "images.zip")})
+        assert res_archive.status_code == 200
+        assert res_archive.get_data(as_text=True) == ""
+
+        # 4. POST archive larger than maxArchiveUploadMb
+        res_archive = client.post(
+            "/predict/batch?model_name=tflite_movenet_lightning_f16",
+            data={'archive': (archive_of_size(11 * 1024 * 1024), "images.zip")})
+        assert res_archive.status_code == 413
+
+        # Rejected uploads are not stored
+        res3 = client.get("/files")
+        assert json.loads(res3.data)["files"] == []
+        blobs = [f for _, _, files in os.walk(os.path.join(temp_path, "files", "blobs"))
+                 for f in files]
+        assert blobs == []
+
+    @patch.object(backend.database, "mongo", PyMongoMock())
+    def test_items_bulk(self, app, client, setup_and_teardown):
+        mongo.init_app(app)
+
+        # Two items which share a stored file
+        client.post("/files", data={'file': (io.BytesIO(b"abcdef"), 'a.jpg')})
+        ids = []
+        for model_name in ["model_a", "model_b"]:
+            item = {
+                "filename": "a.jpg",
+                "keypoints_with_scores": [[[1, 2, 3], [4, 5, 6]]],
+                "model_name": model_name
+            }
+            res = client.post("/items", data=json.dumps(item))
+            ids.append(json.loads(res.data)["item"]["_id"])
+
+        operations = [
+            {"op": "insert", "item": {"filename": "b.jpg",
+                                      "model_name": "model_a"}},
+            {"op": "update", "id": ids[0], "update": {"model_name": "model_c"}},
+            {"op": "delete", "id": ids[1]},
+            {"op": "delete", "id": "000000000000000000000000"},
+            {"op": "delete", "id": "abc"},
+            {"op": "move", "id": ids[0]}
+        ]
+
+        res = client.post("/items/bulk",
+                          data=json.dumps({"operations": operations}))
+        assert res.status_code == 200
+        data = json.loads(res.data)
+
+        assert [result["status"] for result in data["results"]] == [
+            "inserted", "updated", "deleted", "not_found", "invalid_id", "invalid_operation"]
+        assert data["results"][0]["id"]
+        assert data["results"][2]["file_status"] == "deleted"
+        assert data["summary"] == {"inserted": 1, "updated": 1, "deleted": 1,
+                                   "not_found": 1, "invalid_id": 1, "invalid_operation": 1}
+
+        items = json.loads(client.get("/items").data)["items"]
+        assert sorted(item["model_name"] for item in items) == [
+            "model_a", "model_c"]
+        assert json.loads(client.get("/files").data)["files"] == []
+
+        stats = json.loads(client.get("/stats").data)
+        assert stats["model_amounts"] == {"model_a": 1, "model_c": 1}
+        assert db_connection.check_stats_counters() == {}
+
+        # Only the first operation on an item runs
+        operations = [
+            {"op": "update", "id": ids[0], "update": {"model_name": "model_d"}},
+            {"op": "delete", "id": ids[0]},
+            {"op": "delete", "id": ids[0]}
+        ]
+        data = json.loads(client.post(
+            "/items/bulk", data=json.dumps({"operations": operations})).data)
+
+        assert [result["status"] for result in data["results"]] == [
+            "updated", "duplicate_id", "duplicate_id"]
+        assert json.loads(client.get(f"/items/{ids[0]}").data)[
+            "item"]["model_name"] == "model_d"
+        assert db_connection.check_stats_counters() == {}
+
+        res = client.post("/items/bulk", data=json.dumps({"operations": {}}))
+        assert res.status_code == 400
+
     @patch.object(backend.database, "mongo", PyMongoMock())
     def test_get_file_not_found(self, app, client, setup_and_teardown):
         mongo.init_app(app)
@@ -305,7 +919,7 @@ class TestWebApi:
                 },
             "prediction_dates":
                 {
-                    f"{datetime.now().strftime('%Y-%m-%d')}": 3
+                    f"{datetime.now(timezone.utc).strftime('%Y-%m-%d')}": 3
                 },
             "status":
                 {
@@ -314,3 +928,35 @@ class TestWebApi:
                 },
             "total_results": 3
         }
+
+        # Most common filename only
+        res = client.get("/stats?top=1")
+        assert json.loads(res.data)["image_amounts"] == {"test_image.png": 2}
+
+        # Date range without predictions
+        res = client.get("/stats?start=2000-01-01&end=2000-01-31")
+        data = json.loads(res.data)
+        assert data["total_results"] == 0
+        assert data["model_amounts"] == {}
+        assert data["prediction_dates"] == {}
+
+        res = client.get("/stats?start=yesterday")
+        assert res.status_code == 400
+
+        # Counters follow updates and deletes
+        items = json.loads(client.get("/items").data)["items"]
+        client.put(f"/items/{items[0]['_id']}",
+                   data=json.dumps({"filename": "renamed.png"}))
+        client.delete(f"/items/{items[1]['_id']}")
+
+        data = json.loads(client.get("/stats").data)
+        assert data["total_results"] == 2
+        assert data["image_amounts"] == {
+            "renamed.png": 1, "test_image_1.png": 1}
+        assert data["model_amounts"] == {"tflite_movenet_lightning_f16": 2}
+
+        assert db_connection.check_stats_counters() == {}
+
+        # Missing counters are rebuilt
+        backend.database.mongo.db["prediction_stats"].delete_many({})
+        assert json.loads(client.get("/stats").data)["total_results"] == 2